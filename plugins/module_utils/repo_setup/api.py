@@ -0,0 +1,242 @@
+#  Copyright 2021 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+#
+"""Library API installing repos in process, without sys.argv
+
+Example::
+
+    from repo_setup import api
+
+    result = api.install(api.InstallRequest(["current-podified"],
+                                            distro="centos9"))
+    for filename in result.changed:
+        print(filename)
+
+Calls reuse the pooled HTTP session and the on-disk caches of earlier
+calls in the same process; call close() to drop the pooled connections.
+"""
+from __future__ import absolute_import, division, print_function
+
+import collections
+
+try:
+    from repo_setup import main as repo_main
+    from repo_setup import session as http_session
+    from repo_setup import timings
+except ImportError:
+    from ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup import (
+        main as repo_main,
+        session as http_session,
+        timings,
+    )
+
+__metaclass__ = type
+
+# written: list of WrittenRepo, changed and removed: lists of files,
+# diffs: list of path, before and after dicts of the changed and removed
+# files, fetched: list of fetch records, timings: the --timings report
+# dict, messages: list of the lines the run printed
+InstallResult = collections.namedtuple(
+    "InstallResult",
+    ["written", "changed", "removed", "diffs", "fetched", "timings",
+     "messages"],
+)
+
+
+class InstallRequest:
+    """Repos to install, the library counterpart of the repo-setup arguments
+
+    :param repos: list of repo names, e.g. ["current-podified", "ceph"]
+    :param distro: target distro, e.g. "centos9", detected when None
+    :param branch: target branch, e.g. "master", the default when None
+    :param output_path: directory of the repo files, the default when None
+    :param mirror: base OS mirror, the distro default when None
+    :param rdo_mirror: RDO mirror, the default when None
+    :param dlrn_hash_tag: DLRN hash to pin the repos to
+    :param options: any other repo-setup argument by its destination name,
+                    e.g. staged=True or max_workers=8
+    """
+
+    def __init__(
+        self,
+        repos,
+        distro=None,
+        branch=None,
+        output_path=None,
+        mirror=None,
+        rdo_mirror=None,
+        dlrn_hash_tag=None,
+        **options
+    ):
+        self.repos = list(repos)
+        self.distro = distro
+        self.branch = branch
+        self.output_path = output_path
+        self.mirror = mirror
+        self.rdo_mirror = rdo_mirror
+        self.dlrn_hash_tag = dlrn_hash_tag
+        self.options = options
+
+    def argv(self):
+        """Get the equivalent repo-setup command line arguments"""
+        argv = list(self.repos)
+        for option, value in (
+            ("--distro", self.distro),
+            ("--branch", self.branch),
+            ("--output-path", self.output_path),
+            ("--mirror", self.mirror),
+            ("--rdo-mirror", self.rdo_mirror),
+            ("--dlrn-hash-tag", self.dlrn_hash_tag),
+        ):
+            if value is not None:
+                argv.extend([option, value])
+        return argv
+
+
+def _parse_request(request, distro_id, distro_major_version_id):
+    return repo_main._parse_args(
+        distro_id,
+        distro_major_version_id,
+        request.argv(),
+        exit_on_error=False,
+        **request.options
+    )
+
+
+def _get_stage(args, check, output):
+    # check mode writes nothing, not even to the staging directory
+    if args.staged and not check:
+        return repo_main.StagedInstall(output)
+    return repo_main.PlannedInstall(output)
+
+
+def _get_result(written, removed, stage, report, messages, urls=None):
+    fetched = report["fetches"]
+    if urls is not None:
+        fetched = [
+            fetch for fetch in fetched
+            if fetch["url"] in urls or fetch["url"][: -len(".md5")] in urls
+        ]
+    return InstallResult(
+        written=written,
+        changed=[repo.filename for repo in written if repo.changed],
+        removed=removed,
+        diffs=stage.diffs,
+        fetched=fetched,
+        timings=report,
+        messages=messages,
+    )
+
+
+def install(request, check=False):
+    """Install the repos of request
+
+    :param request: an InstallRequest
+    :param check: only report what would change, nothing is written,
+                  removed or cleaned
+    :return: an InstallResult
+    :raises InvalidArguments: when the request is not valid
+    """
+    recorder = timings.Timings()
+    # the messages of this run only, concurrent installs keep their own
+    messages = []
+    try:
+        with recorder.phase("get_distro"):
+            distro_id, distro_major_version_id, distro_name = (
+                repo_main._get_distro(messages.append)
+            )
+        with recorder.phase("parse_args"):
+            args = _parse_request(request, distro_id, distro_major_version_id)
+        args.recorder = recorder
+        stage = _get_stage(args, check, messages.append)
+        written, removed = repo_main._run(
+            args,
+            distro_name,
+            distro_major_version_id,
+            recorder,
+            stage=stage,
+            check=check,
+            output=messages.append,
+        )
+    except Exception as e:
+        recorder.error = "%s: %s" % (type(e).__name__, e)
+        raise
+    return _get_result(written, removed, stage, recorder.report(), messages)
+
+
+def install_matrix(requests, check=False):
+    """Install the repos of many requests, fetching each url once
+
+    Typically one request per distro, branch and output path. The urls of
+    every request are deduplicated and fetched concurrently up front, then
+    each request is installed from the shared results.
+
+    :param requests: list of InstallRequest
+    :param check: only report what would change, see install()
+    :return: list of InstallResult, in the order of requests, sharing one
+             timings report
+    :raises InvalidArguments: when a request is not valid
+    """
+    if not requests:
+        return []
+    recorder = timings.Timings()
+    runs = []
+    # the messages common to every request are not reported
+    discard = [].append
+    try:
+        with recorder.phase("get_distro"):
+            distro_id, distro_major_version_id, distro_name = (
+                repo_main._get_distro(discard)
+            )
+        targets = []
+        for request in requests:
+            with recorder.phase("parse_args"):
+                args = _parse_request(
+                    request, distro_id, distro_major_version_id
+                )
+            args.recorder = recorder
+            base_path = repo_main._prepare(
+                args, distro_name, distro_major_version_id, recorder, discard
+            )
+            targets.append((args, base_path))
+        caches = repo_main._prefetch_matrix(targets, recorder, discard)
+        for (args, base_path), cache in zip(targets, caches):
+            messages = []
+            stage = _get_stage(args, check, messages.append)
+            written, removed = repo_main._run(
+                args,
+                distro_name,
+                distro_major_version_id,
+                recorder,
+                stage=stage,
+                check=check,
+                cache=cache,
+                base_path=base_path,
+                output=messages.append,
+            )
+            urls = set(repo_main._get_repo_urls(args, base_path))
+            runs.append((written, removed, stage, messages, urls))
+    except Exception as e:
+        recorder.error = "%s: %s" % (type(e).__name__, e)
+        raise
+    report = recorder.report()
+    return [
+        _get_result(written, removed, stage, report, messages, urls)
+        for written, removed, stage, messages, urls in runs
+    ]
+
+
+def close():
+    """Drop the pooled HTTP connections kept between calls"""
+    http_session.close_sessions()
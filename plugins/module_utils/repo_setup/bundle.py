@@ -0,0 +1,243 @@
+#  Copyright 2021 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+#
+"""Offline bundles of the repo files of a repo-setup run
+
+A bundle is a tar.gz archive holding a manifest.json and every fetched repo
+file, as published, under files/<sha256>. The manifest records the format
+version, the repo-setup arguments the bundle was created with, the base
+path of the RDO repos and the sha256 and size of the file of each url.
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import sys
+import tarfile
+import time
+
+try:
+    from repo_setup import main as repo_main
+    from repo_setup import timings
+except ImportError:
+    from ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup import (
+        main as repo_main,
+        timings,
+    )
+
+__metaclass__ = type
+
+BUNDLE_FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+
+
+class BundleError(Exception):
+    pass
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def create(args, base_path, path, argv):
+    """Fetch the repo files of args into a bundle at path
+
+    :param argv: the repo-setup arguments recorded in the manifest and
+                 used again by install()
+    :return: the manifest
+    """
+    urls = repo_main._get_repo_urls(args, base_path)
+    cache = repo_main.FetchCache(args, fetch=repo_main._fetch_repo)
+    cache.prefetch(urls)
+    manifest = {
+        "format_version": BUNDLE_FORMAT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "argv": list(argv),
+        "distro": args.distro,
+        "branch": args.branch,
+        "base_path": base_path,
+        "files": {},
+    }
+    objects = {}
+    for url in urls:
+        data = cache.get(url).encode("utf-8")
+        digest = _sha256(data)
+        manifest["files"][url] = {"sha256": digest, "size": len(data)}
+        objects[digest] = data
+    tmp_path = path + ".tmp"
+    with tarfile.open(tmp_path, "w:gz") as tar:
+        members = [(MANIFEST_NAME, json.dumps(manifest, indent=2).encode("utf-8"))]
+        members.extend(
+            ("files/" + digest, data) for digest, data in sorted(objects.items())
+        )
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(data))
+    os.rename(tmp_path, path)
+    return manifest
+
+
+def load(path):
+    """Read and verify the bundle at path
+
+    :return: the manifest and a dict of the file content of each url
+    :raises BundleError: when the bundle is invalid or a file does not match
+                         its checksum
+    """
+    try:
+        with tarfile.open(path, "r:*") as tar:
+            members = dict(
+                (member.name, tar.extractfile(member).read())
+                for member in tar.getmembers()
+                if member.isfile()
+            )
+    except (IOError, OSError, tarfile.TarError) as e:
+        raise BundleError("Cannot read bundle %s: %s" % (path, e))
+    try:
+        manifest = json.loads(members[MANIFEST_NAME].decode("utf-8"))
+    except (KeyError, ValueError) as e:
+        raise BundleError("Invalid manifest in bundle %s: %s" % (path, e))
+    if manifest.get("format_version") != BUNDLE_FORMAT_VERSION:
+        raise BundleError(
+            "Unsupported bundle format version %s in %s"
+            % (manifest.get("format_version"), path)
+        )
+    files = {}
+    for url, entry in manifest["files"].items():
+        data = members.get("files/" + entry["sha256"])
+        if data is None or _sha256(data) != entry["sha256"]:
+            raise BundleError("Checksum mismatch for %s in %s" % (url, path))
+        files[url] = data.decode("utf-8")
+    return manifest, files
+
+
+def _offline_fetch(url, args, stats=None):
+    raise BundleError("%s is not in the bundle" % url)
+
+
+def install(manifest, files, args, distro_name, distro_major_version_id,
+            recorder):
+    """Install the repos of args from the files of a bundle, offline
+
+    Mirrors are injected and the distro templates are rendered locally, so
+    --mirror and --rdo-mirror still apply.
+
+    returns: list of WrittenRepo and list of removed files
+    """
+    repo_main._prepare(args, distro_name, distro_major_version_id, recorder)
+    # the urls of the bundle are relative to the base path it was created
+    # with, whatever --rdo-mirror is now
+    base_path = manifest["base_path"]
+    cache = repo_main.FetchCache(args, fetch=_offline_fetch)
+    for url in repo_main._get_repo_urls(args, base_path):
+        if url not in files:
+            raise BundleError("%s is not in the bundle" % url)
+        cache.add(url, repo_main._inject_mirrors(files[url], args))
+    return repo_main._run(
+        args,
+        distro_name,
+        distro_major_version_id,
+        recorder,
+        cache=cache,
+        base_path=base_path,
+    )
+
+
+@contextlib.contextmanager
+def _timings_report(args, recorder):
+    """Write the timings report of --timings once the block is done, like
+    repo-setup does"""
+    if args.timings:
+        args.recorder = recorder
+    try:
+        yield
+    except Exception as e:
+        recorder.error = "%s: %s" % (type(e).__name__, e)
+        raise
+    finally:
+        if args.timings:
+            recorder.write(args.timings)
+
+
+def main(argv):
+    """repo-setup bundle create|install entry point"""
+    parser = argparse.ArgumentParser(
+        prog="repo-setup bundle",
+        description="Create an offline bundle of repo files, or install the "
+        "repos from one without network access. Any other argument is a "
+        "repo-setup argument.",
+    )
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+    create_parser = commands.add_parser(
+        "create", help="Fetch the repo files of REPO... into a bundle."
+    )
+    create_parser.add_argument(
+        "--file",
+        help="Path of the bundle, by default "
+        "repo-setup-bundle-<distro>-<branch>-<time>.tar.gz",
+    )
+    install_parser = commands.add_parser(
+        "install", help="Install the repos of a bundle."
+    )
+    install_parser.add_argument("file", metavar="FILE", help="The bundle.")
+    bundle_args, repo_argv = parser.parse_known_args(argv)
+
+    recorder = timings.Timings()
+    with recorder.phase("get_distro"):
+        distro_id, distro_major_version_id, distro_name = (
+            repo_main._get_distro()
+        )
+    if bundle_args.command == "create":
+        with recorder.phase("parse_args"):
+            args = repo_main._parse_args(
+                distro_id, distro_major_version_id, repo_argv
+            )
+        with _timings_report(args, recorder):
+            base_path = repo_main._prepare(
+                args, distro_name, distro_major_version_id, recorder
+            )
+            path = bundle_args.file or "repo-setup-bundle-%s-%s-%s.tar.gz" % (
+                args.distro,
+                args.branch,
+                time.strftime("%Y%m%d%H%M%S"),
+            )
+            with recorder.phase("create"):
+                manifest = create(args, base_path, path, repo_argv)
+        print("Created bundle %s with %d repo file(s)"
+              % (path, len(manifest["files"])))
+        return
+    try:
+        manifest, files = load(bundle_args.file)
+    except BundleError as e:
+        print("ERROR: %s" % e, file=sys.stderr)
+        sys.exit(1)
+    # arguments given now override the ones the bundle was created with
+    with recorder.phase("parse_args"):
+        args = repo_main._parse_args(
+            distro_id, distro_major_version_id, manifest["argv"] + repo_argv
+        )
+    try:
+        with _timings_report(args, recorder):
+            install(manifest, files, args, distro_name,
+                    distro_major_version_id, recorder)
+    except BundleError as e:
+        print("ERROR: %s" % e, file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,358 @@
+#  Copyright 2021 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+#
+from __future__ import absolute_import, division, print_function
+
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+__metaclass__ = type
+
+SYSTEM_CACHE_DIR = "/var/cache/repo-setup"
+DEFAULT_CACHE_MAX_SIZE = 64 * 1024 * 1024
+
+# DLRN hash addressed paths, e.g. current/b6/e7/b6e71147e9ec.../delorean.repo
+IMMUTABLE_URL_RE = re.compile("/([0-9a-f]{2})/([0-9a-f]{2})/\\1\\2[0-9a-f_]*/")
+
+_caches = {}
+_stores = {}
+_caches_lock = threading.Lock()
+
+
+def get_default_cache_dir():
+    """Get the system cache directory for root, the XDG cache directory of
+    the user otherwise, which unlike the system one they can create"""
+    if getattr(os, "geteuid", lambda: 0)() == 0:
+        return SYSTEM_CACHE_DIR
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "repo-setup")
+
+
+DEFAULT_CACHE_DIR = get_default_cache_dir()
+
+
+def is_immutable_url(url):
+    """Whether url points at a DLRN hash addressed path
+
+    DLRN never changes the content published under such a path, so it can
+    be cached forever without revalidation.
+    """
+    return IMMUTABLE_URL_RE.search(url) is not None
+
+
+def _makedirs(path):
+    """Create path and its parents, unless it exists or another process has
+    just created it
+
+    :raises OSError: when path is still missing
+    """
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+
+
+def _atomic_write(filename, data):
+    """Write data to filename so readers never see a partial file"""
+    # lazy import
+    import tempfile
+
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(filename), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.rename(tmp_name, filename)
+    except Exception:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        raise
+
+
+class HttpCache:
+    """On-disk cache of fetched files and their HTTP validators
+
+    Each url is stored as a body file and a json metadata file holding its
+    ETag and Last-Modified validators, so later runs can revalidate it with
+    a conditional request. When the total size of the cached bodies goes
+    above max_size, least recently used entries are evicted first.
+
+    The directory is scanned on the first store only, later stores keep the
+    total up to date and scan again once it goes above max_size.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_CACHE_MAX_SIZE):
+        self.path = os.path.join(path, "http")
+        self.max_size = max_size
+        self.enabled = True
+        self._lock = threading.Lock()
+        # total size of the bodies, None until the directory is scanned
+        self._size = None
+        try:
+            _makedirs(self.path)
+        except OSError as e:
+            print(
+                "WARNING: HTTP cache disabled, cannot create %s: %s" % (self.path, e),
+                file=sys.stderr,
+            )
+            self.enabled = False
+
+    def _entry(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, key + ".json"), os.path.join(
+            self.path, key + ".body"
+        )
+
+    def validators(self, url):
+        """Get the conditional request headers for a cached url
+
+        :return: dict of headers, empty when the url is not cached
+        """
+        if not self.enabled:
+            return {}
+        meta_file, body_file = self._entry(url)
+        try:
+            with open(meta_file, "r") as f:
+                meta = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        if not os.path.exists(body_file):
+            return {}
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def load(self, url):
+        """Get the cached body of url and mark it as recently used
+
+        :return: the body as a string or None when it is not cached
+        """
+        if not self.enabled:
+            return None
+        meta_file, body_file = self._entry(url)
+        try:
+            with open(body_file, "rb") as f:
+                body = f.read().decode("utf-8")
+            os.utime(meta_file, None)
+        except (IOError, OSError):
+            return None
+        return body
+
+    def store(self, url, body, etag=None, last_modified=None):
+        """Cache body of url with its validators, then evict if needed"""
+        if not self.enabled or not (etag or last_modified):
+            return
+        meta_file, body_file = self._entry(url)
+        meta = {"url": url, "etag": etag, "last_modified": last_modified}
+        data = body.encode("utf-8")
+        try:
+            old_size = os.path.getsize(body_file)
+        except OSError:
+            old_size = 0
+        try:
+            _atomic_write(body_file, data)
+            _atomic_write(meta_file, json.dumps(meta).encode("utf-8"))
+        except (IOError, OSError) as e:
+            print(
+                "WARNING: Failed to cache %s: %s" % (url, e),
+                file=sys.stderr,
+            )
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data) - old_size
+            scan = self._size is None or self._size > self.max_size
+        if scan:
+            self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until under max_size"""
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.path):
+                if not name.endswith(".json"):
+                    continue
+                meta_file = os.path.join(self.path, name)
+                body_file = meta_file[: -len(".json")] + ".body"
+                try:
+                    used = os.path.getmtime(meta_file)
+                    size = os.path.getsize(body_file)
+                except OSError:
+                    continue
+                entries.append((used, size, meta_file, body_file))
+                total += size
+            entries.sort()
+            while entries and total > self.max_size:
+                __, size, meta_file, body_file = entries.pop(0)
+                for filename in (meta_file, body_file):
+                    try:
+                        os.remove(filename)
+                    except OSError:
+                        pass
+                total -= size
+            self._size = total
+
+
+def get_http_cache(path=DEFAULT_CACHE_DIR, max_size=DEFAULT_CACHE_MAX_SIZE):
+    """Get the shared HttpCache for path, creating it on first use"""
+    with _caches_lock:
+        cache = _caches.get((path, max_size))
+        if cache is None:
+            cache = HttpCache(path, max_size)
+            _caches[(path, max_size)] = cache
+    return cache
+
+
+class ContentStore:
+    """Immutable content addressed store for DLRN hash pinned files
+
+    Bodies are stored once under objects/ by their sha256 digest and each
+    url has a ref file pointing at its digest. Entries never expire, they
+    are only removed by an explicit prune.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.join(path, "store")
+        self.objects_path = os.path.join(self.path, "objects")
+        self.refs_path = os.path.join(self.path, "refs")
+        self.enabled = True
+        self._lock = threading.Lock()
+        try:
+            for dirname in (self.objects_path, self.refs_path):
+                _makedirs(dirname)
+        except OSError as e:
+            print(
+                "WARNING: Content store disabled, cannot create %s: %s"
+                % (self.path, e),
+                file=sys.stderr,
+            )
+            self.enabled = False
+
+    def _ref(self, url):
+        return os.path.join(
+            self.refs_path, hashlib.sha256(url.encode("utf-8")).hexdigest()
+        )
+
+    def load(self, url):
+        """Get the stored body of url
+
+        :return: the body as a string or None when it is not stored or the
+                 stored object does not match its digest
+        """
+        if not self.enabled:
+            return None
+        ref_file = self._ref(url)
+        try:
+            with open(ref_file, "r") as f:
+                digest = f.read().strip()
+            with open(os.path.join(self.objects_path, digest), "rb") as f:
+                data = f.read()
+            os.utime(ref_file, None)
+        except (IOError, OSError):
+            return None
+        if hashlib.sha256(data).hexdigest() != digest:
+            return None
+        return data.decode("utf-8")
+
+    def store(self, url, body):
+        """Store body as the immutable content of url"""
+        if not self.enabled:
+            return
+        data = body.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        object_file = os.path.join(self.objects_path, digest)
+        try:
+            if not os.path.exists(object_file):
+                _atomic_write(object_file, data)
+            _atomic_write(self._ref(url), digest.encode("utf-8"))
+        except (IOError, OSError) as e:
+            print(
+                "WARNING: Failed to store %s: %s" % (url, e),
+                file=sys.stderr,
+            )
+
+    def prune(self, max_age=None, max_size=None):
+        """Remove entries unused for max_age seconds, then the least
+        recently used ones until the stored objects fit in max_size bytes.
+
+        :return: number of refs removed
+        """
+        if not self.enabled:
+            return 0
+        with self._lock:
+            now = time.time()
+            refs = []
+            for name in os.listdir(self.refs_path):
+                ref_file = os.path.join(self.refs_path, name)
+                try:
+                    with open(ref_file, "r") as f:
+                        digest = f.read().strip()
+                    refs.append((os.path.getmtime(ref_file), ref_file, digest))
+                except (IOError, OSError):
+                    continue
+            refs.sort()
+            removed = []
+            if max_age is not None:
+                while refs and now - refs[0][0] > max_age:
+                    removed.append(refs.pop(0))
+            if max_size is not None:
+                sizes = {}
+                for __, __, digest in refs:
+                    try:
+                        sizes[digest] = os.path.getsize(
+                            os.path.join(self.objects_path, digest)
+                        )
+                    except OSError:
+                        sizes[digest] = 0
+                while refs and sum(sizes.values()) > max_size:
+                    removed.append(refs.pop(0))
+                    remaining = set(digest for __, __, digest in refs)
+                    sizes = dict(
+                        (k, v) for k, v in sizes.items() if k in remaining
+                    )
+            for __, ref_file, __ in removed:
+                try:
+                    os.remove(ref_file)
+                except OSError:
+                    pass
+            # drop objects no remaining ref points at
+            referenced = set(digest for __, __, digest in refs)
+            for name in os.listdir(self.objects_path):
+                if name not in referenced:
+                    try:
+                        os.remove(os.path.join(self.objects_path, name))
+                    except OSError:
+                        pass
+            return len(removed)
+
+
+def get_content_store(path=DEFAULT_CACHE_DIR):
+    """Get the shared ContentStore for path, creating it on first use"""
+    with _caches_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = ContentStore(path)
+            _stores[path] = store
+    return store
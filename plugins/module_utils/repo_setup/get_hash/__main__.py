@@ -18,18 +18,48 @@ import argparse
 import json
 import logging
 import sys
+from repo_setup.cache import DEFAULT_CACHE_DIR
 from repo_setup.utils import load_logging
+from repo_setup.get_hash import batch
+from repo_setup.get_hash import dlrn_api
+from repo_setup.get_hash import hash_cache
 from repo_setup.get_hash.hash_info import HashInfo
 
 
+class ConfigChoices:
+    """argparse choices read from the config file only when needed
+
+    argparse checks choices only for options given on the command line and
+    lists them only in --help, so a plain run never has to load and parse
+    the config file just to build the parser.
+    """
+
+    def __init__(self, config, key):
+        self.config = config
+        self.key = key
+
+    def _values(self):
+        if not self.config:
+            self.config.update(HashInfo.load_config())
+        return self.config[self.key]
+
+    def __contains__(self, value):
+        return value in self._values()
+
+    def __iter__(self):
+        return iter(self._values())
+
+
 def main():
     load_logging(module_name="repo-setup-get-hash")
-    config = HashInfo.load_config()
+    config = {}
     parser = argparse.ArgumentParser(description="repo-setup-get-hash.py")
     parser.add_argument(
         "--component",
-        help=("Use this to specify a component " "This is NOT valid for Centos 7."),
-        choices=config["repo_setup_ci_components"],
+        metavar="COMPONENT",
+        help=("Use this to specify a component " "This is NOT valid for Centos 7. "
+              "Choices: %(choices)s"),
+        choices=ConfigChoices(config, "repo_setup_ci_components"),
     )
     parser.add_argument(
         "--dlrn-url",
@@ -41,20 +71,26 @@ def main():
     parser.add_argument(
         "--os-version",
         default="centos8",
-        choices=config["os_versions"],
-        help=("The operating system and version to fetch the build tag for"),
+        metavar="OS_VERSION",
+        choices=ConfigChoices(config, "os_versions"),
+        help=("The operating system and version to fetch the build tag for. "
+              "Choices: %(choices)s"),
     )
     parser.add_argument(
         "--tag",
         default="current-podified",
-        choices=config["rdo_named_tags"],
-        help=("The known tag to retrieve the hash_info for"),
+        metavar="TAG",
+        choices=ConfigChoices(config, "rdo_named_tags"),
+        help=("The known tag to retrieve the hash_info for. "
+              "Choices: %(choices)s"),
     )
     parser.add_argument(
         "--release",
         default="master",
-        help=("The release of OpenStack you want the hash info for. " "Default master"),
-        choices=config["repo_setup_releases"],
+        metavar="RELEASE",
+        help=("The release of OpenStack you want the hash info for. " "Default master. "
+              "Choices: %(choices)s"),
+        choices=ConfigChoices(config, "repo_setup_releases"),
     )
     parser.add_argument(
         "--verbose",
@@ -71,8 +107,70 @@ def main():
         default=None,
         help=("Pass a particular dlrn hash tag"),
     )
+    parser.add_argument(
+        "--write-config-snapshot",
+        action="store_true",
+        help=("Write a json snapshot of the config file next to it, loaded "
+              "instead of parsing the yaml while the file is unchanged, "
+              "and exit"),
+    )
+    parser.add_argument(
+        "--matrix",
+        metavar="FILE",
+        help=("Resolve the queries of a json file, or of stdin with -, and "
+              "print one json line per query as soon as it is resolved. "
+              "The file holds a list of objects with any of the os_version, "
+              "release, component, tag and dlrn_hash_tag fields, a list "
+              "value resolves every one of its values. Omitted fields take "
+              "the value of the matching option"),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=batch.DEFAULT_BATCH_WORKERS,
+        help=("Maximum number of --matrix queries resolved at once. "
+              "Default %(default)s"),
+    )
+    parser.add_argument(
+        "--dlrn-api",
+        action="store_true",
+        help=("Resolve the --matrix queries with a few bulk promotions "
+              "requests to the DLRN API of each os version and release "
+              "instead of one request per query"),
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=DEFAULT_CACHE_DIR,
+        help=("Directory of the resolved hashes cache shared by every "
+              "repo-setup-get-hash process. Default %(default)s"),
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=int,
+        default=hash_cache.DEFAULT_HASH_CACHE_TTL,
+        help=("Seconds a cached hash is used without asking the delorean "
+              "server, older ones are revalidated with a conditional "
+              "request. Default %(default)s"),
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=("Always fetch the hashes from the delorean server, without "
+              "reading or updating the cache"),
+    )
 
     args = parser.parse_args()
+    if args.cache_ttl < 0:
+        parser.error("--cache-ttl must not be negative")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.dlrn_api and not args.matrix:
+        parser.error("--dlrn-api requires --matrix")
+    if args.write_config_snapshot:
+        print("Wrote %s" % HashInfo.write_config_snapshot())
+        return
+    if not config:
+        config.update(HashInfo.load_config())
 
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
@@ -86,6 +184,13 @@ def main():
         config["dlrn_url"] = args.dlrn_url
         logging.debug("Proceeding with the following configuration: {}".format(config))
 
+    cache = None
+    if not args.no_cache:
+        cache = hash_cache.get_hash_cache(args.cache_dir, args.cache_ttl)
+
+    if args.matrix:
+        return _main_matrix(args, config, cache)
+
     repo_setup_hash_info = HashInfo(
         args.os_version,
         args.release,
@@ -93,28 +198,41 @@ def main():
         args.tag,
         args.dlrn_hash_tag,
         config,
+        cache=cache,
     )
     if args.json:
-        dict_data = {"commit_hash": repo_setup_hash_info.commit_hash,
-                     "distro_hash": repo_setup_hash_info.distro_hash,
-                     "full_hash": repo_setup_hash_info.full_hash,
-                     "extended_hash": repo_setup_hash_info.extended_hash,
-                     "dlrn_url": repo_setup_hash_info.dlrn_url,
-                     "dlrn_api_url": repo_setup_hash_info.dlrn_api_url,
-                     "os_version": repo_setup_hash_info.os_version,
-                     "release": repo_setup_hash_info.release,
-                     "component": repo_setup_hash_info.component,
-                     "tag": repo_setup_hash_info.tag}
-
+        dict_data = repo_setup_hash_info.to_dict()
         print(json.dumps(dict_data))
     else:
         print(repo_setup_hash_info)
         return repo_setup_hash_info
 
 
+def _main_matrix(args, config, cache):
+    if args.matrix == "-":
+        items = json.load(sys.stdin)
+    else:
+        with open(args.matrix) as matrix_file:
+            items = json.load(matrix_file)
+    queries = batch.expand_matrix(items, defaults=vars(args))
+    results = []
+    if args.dlrn_api:
+        resolved = dlrn_api.resolve(queries, config)
+    else:
+        resolved = batch.resolve(queries, config, workers=args.workers,
+                                 cache=cache)
+    for result in resolved:
+        print(json.dumps(batch.result_dict(result)))
+        sys.stdout.flush()
+        results.append(result)
+    return results
+
+
 def cli_entrypoint():
     try:
-        main()
+        result = main()
+        if isinstance(result, list) and any(r.error for r in result):
+            sys.exit(1)
         sys.exit(0)
     except KeyboardInterrupt:
         logging.info("Exiting on user interrupt")
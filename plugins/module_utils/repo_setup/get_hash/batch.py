@@ -0,0 +1,172 @@
+#  Copyright 2021 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+#
+#
+"""Resolve many HashInfo queries at once over a bounded worker pool"""
+from __future__ import absolute_import, division, print_function
+
+import collections
+import itertools
+import logging
+from .exceptions import HashInvalidParameter
+from .hash_info import HashInfo
+
+
+__metaclass__ = type
+
+DEFAULT_BATCH_WORKERS = 8
+
+"""
+The fields of a query, each one taking a value or a list of values in a
+matrix item, and the config key listing the valid values when there is one.
+"""
+QUERY_FIELDS = collections.OrderedDict(
+    [
+        ("os_version", "os_versions"),
+        ("release", "repo_setup_releases"),
+        ("component", "repo_setup_ci_components"),
+        ("tag", "rdo_named_tags"),
+        ("dlrn_hash_tag", None),
+    ]
+)
+
+HashQuery = collections.namedtuple("HashQuery", list(QUERY_FIELDS))
+
+"""
+The result of a query: the resolved HashInfo, or None and the error message
+when it failed.
+"""
+HashResult = collections.namedtuple("HashResult", "query hash_info error")
+
+
+def expand_matrix(items, defaults=None):
+    """Expand matrix items to the HashQuery of each combination
+
+    :param items: list of dicts with any QUERY_FIELDS, a list value expands
+                  to one query per value, e.g.
+                  {"release": ["master", "antelope"], "tag": "current"}
+    :param defaults: dict of the values of the fields an item omits
+    :raises HashInvalidParameter for an item that is not a dict or has
+            unknown fields
+    :return: list of HashQuery, in item order
+    """
+    defaults = defaults or {}
+    queries = []
+    if not isinstance(items, list):
+        raise HashInvalidParameter("The matrix must be a list of queries")
+    for item in items:
+        if not isinstance(item, dict):
+            raise HashInvalidParameter("Invalid matrix item %r" % (item,))
+        unknown = set(item) - set(QUERY_FIELDS)
+        if unknown:
+            raise HashInvalidParameter(
+                "Unknown matrix item fields: %s" % ", ".join(sorted(unknown))
+            )
+        values = []
+        for field in QUERY_FIELDS:
+            value = item.get(field, defaults.get(field))
+            values.append(value if isinstance(value, list) else [value])
+        queries.extend(HashQuery(*combination)
+                       for combination in itertools.product(*values))
+    return queries
+
+
+def check_query(query, config):
+    """Check the fields of a HashQuery against the config
+
+    :raises HashInvalidParameter for a value missing from the config
+            choices or a missing os_version, release or tag
+    """
+    for field, config_key in QUERY_FIELDS.items():
+        value = getattr(query, field)
+        if config_key and value is not None and value not in config[config_key]:
+            raise HashInvalidParameter(
+                "Invalid {0} {1}. Choices: {2}".format(
+                    field, value, ", ".join(config[config_key])
+                )
+            )
+    if query.os_version is None or query.release is None or query.tag is None:
+        raise HashInvalidParameter("os_version, release and tag are required")
+
+
+def session_fetch(pool_size=DEFAULT_BATCH_WORKERS):
+    """Get an http_get like function using the shared pooled session
+
+    :return: the function, or None when requests is not available and each
+             fetch has to open its own connection with utils.http_get
+    """
+    try:
+        try:
+            from repo_setup import session
+        except ImportError:
+            from ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup import (
+                session,
+            )
+        shared_session = session.get_session(pool_size)
+    except ImportError:
+        return None
+
+    def fetch(url):
+        try:
+            response = session.get_with_retries(shared_session, [url])
+            return response.text, response.status_code
+        except Exception as e:
+            return str(e), -1
+
+    return fetch
+
+
+def resolve(queries, config=None, workers=DEFAULT_BATCH_WORKERS, fetch=None,
+            cache=None):
+    """Resolve HashInfo queries concurrently
+
+    The config is loaded once and shared by every query, and the queries
+    are fetched over one pooled session by at most workers threads. A
+    failed query yields its error and does not stop the others.
+
+    :param queries: iterable of HashQuery
+    :param config: dict with configuration overrides, see load_config()
+    :param workers: maximum number of queries resolved at once
+    :param fetch: http_get like function, by default session_fetch()
+    :param cache: hash_cache.HashCache the queries are answered from
+    :return: generator of HashResult, in completion order
+    """
+    # lazy import
+    from concurrent import futures
+
+    config = HashInfo.load_config(config)
+    fetch = fetch or session_fetch(workers)
+
+    def run(query):
+        check_query(query, config)
+        return HashInfo(*query, config=config, fetch=fetch, cache=cache)
+
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(run, query): query for query in queries}
+        for future in futures.as_completed(pending):
+            query = pending[future]
+            try:
+                yield HashResult(query, future.result(), None)
+            except Exception as e:
+                logging.debug("Failed to resolve %s: %s", query, e)
+                yield HashResult(query, None, str(e) or type(e).__name__)
+
+
+def result_dict(result):
+    """Get the json-lines record of a HashResult"""
+    data = dict(result.query._asdict())
+    if result.hash_info is not None:
+        data.update(result.hash_info.to_dict())
+    data["error"] = result.error
+    return data
@@ -37,6 +37,12 @@ The path is specified in [options.data_files] of the project setup.cfg.
 """
 CONFIG_PATH = "/usr/local/etc/repo_setup_get_hash/config.yaml"
 
+"""
+Suffix of the json snapshot of a config.yaml, e.g. config.yaml.json, which
+is loaded instead of parsing the yaml while it matches the config.yaml.
+"""
+CONFIG_SNAPSHOT_SUFFIX = ".json"
+
 DEFAULT_CONFIG = {
     "repo_setup_releases": [
         "master",
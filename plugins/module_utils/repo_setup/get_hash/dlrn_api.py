@@ -0,0 +1,185 @@
+#  Copyright 2021 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+#
+#
+"""Resolve named tags with the promotions call of the DLRN API, many
+queries from each response, instead of one static file per query"""
+from __future__ import absolute_import, division, print_function
+
+import collections
+import json
+import logging
+from .batch import HashResult, check_query, session_fetch
+from .exceptions import HashInvalidDLRNResponse, HashInvalidParameter
+from .hash_info import HashInfo
+
+try:
+    from repo_setup.utils import http_get
+except ImportError:
+    from ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup.utils import (
+        http_get,
+    )
+
+
+__metaclass__ = type
+
+DEFAULT_PROMOTIONS_LIMIT = 100
+
+
+class DlrnApiClient:
+    """Client of the read only promotions call of one DLRN API endpoint
+
+    :param api_url: the endpoint, see HashInfo.get_dlrn_api_url()
+    :param fetch: http_get like function, utils.http_get by default
+    :param limit: number of promotions asked for in a bulk request
+    """
+
+    def __init__(self, api_url, fetch=None, limit=DEFAULT_PROMOTIONS_LIMIT):
+        self.api_url = api_url.rstrip("/")
+        self.fetch = fetch or http_get
+        self.limit = limit
+        self.requests = 0
+
+    def promotions(self, promote_name=None, component=None, limit=None):
+        """Get the promotions matching the filters, newest first
+
+        :raises HashInvalidDLRNResponse for an error or non json response
+        :return: list of promotion dicts
+        """
+        # lazy import
+        try:
+            from urllib.parse import urlencode
+        except ImportError:
+            from urllib import urlencode
+
+        params = [
+            (name, value)
+            for name, value in (
+                ("promote_name", promote_name),
+                ("component", component),
+                ("limit", limit or self.limit),
+            )
+            if value is not None
+        ]
+        url = "%s/api/promotions?%s" % (self.api_url, urlencode(params))
+        self.requests += 1
+        body, status = self.fetch(url)
+        if status != 200:
+            raise HashInvalidDLRNResponse(
+                "Invalid response received from the DLRN API. Queried URL: "
+                "{0}. Response code: {1}. Response text: {2}.".format(url, status, body)
+            )
+        try:
+            promotions = json.loads(body)
+        except ValueError as e:
+            raise HashInvalidDLRNResponse(
+                "Invalid json received from the DLRN API at {0}: {1}".format(url, e)
+            )
+        if not isinstance(promotions, list):
+            raise HashInvalidDLRNResponse(
+                "Expected a list of promotions from the DLRN API at {0}".format(url)
+            )
+        return sorted(promotions, key=lambda p: p.get("timestamp") or 0, reverse=True)
+
+    def latest_promotions(self, queries):
+        """Get the latest promotion of each (tag, component) query
+
+        A None component stands for the aggregate of the tag, whose latest
+        promotion is the newest one with an aggregate hash. One bulk
+        request per tag answers every component promoted within its last
+        limit promotions, only the others need a request of their own.
+
+        :param queries: iterable of (tag, component) tuples
+        :return: dict of (tag, component) to the promotion, None when the
+                 tag was never promoted
+        """
+        wanted = collections.OrderedDict()
+        for tag, component in queries:
+            wanted.setdefault(tag, set()).add(component)
+        latest = {}
+        for tag, components in wanted.items():
+            for promotion in self.promotions(promote_name=tag):
+                keys = [(tag, promotion.get("component"))]
+                if promotion.get("aggregate_hash"):
+                    keys.append((tag, None))
+                for key in keys:
+                    if key[1] in components and key not in latest:
+                        latest[key] = promotion
+            for component in components:
+                if (tag, component) not in latest:
+                    logging.debug("No %s promotion of %s in the last %d, "
+                                  "asking for it", tag, component, self.limit)
+                    promotions = self.promotions(
+                        promote_name=tag, component=component, limit=1
+                    )
+                    latest[(tag, component)] = promotions[0] if promotions else None
+        return latest
+
+
+def resolve(queries, config=None, fetch=None, limit=DEFAULT_PROMOTIONS_LIMIT):
+    """Resolve HashInfo queries with the DLRN API
+
+    The queries of the same os_version and release share a DLRN API
+    endpoint and are answered by its bulk promotions requests. A failed
+    query yields its error and does not stop the others.
+
+    :param queries: iterable of batch.HashQuery, without dlrn_hash_tag
+    :param config: dict with configuration overrides, see load_config()
+    :param fetch: http_get like function, by default batch.session_fetch()
+    :param limit: number of promotions asked for in a bulk request
+    :return: generator of batch.HashResult, an endpoint at a time
+    """
+    config = HashInfo.load_config(config)
+    fetch = fetch or session_fetch()
+    endpoints = collections.OrderedDict()
+    for query in queries:
+        try:
+            check_query(query, config)
+            if query.dlrn_hash_tag:
+                raise HashInvalidParameter(
+                    "dlrn_hash_tag queries are not resolved with the DLRN API"
+                )
+        except HashInvalidParameter as e:
+            yield HashResult(query, None, str(e))
+            continue
+        endpoints.setdefault((query.os_version, query.release), []).append(query)
+
+    for (os_version, release), endpoint_queries in endpoints.items():
+        client = DlrnApiClient(
+            HashInfo.get_dlrn_api_url(config["dlrn_url"], os_version, release),
+            fetch=fetch,
+            limit=limit,
+        )
+        try:
+            latest = client.latest_promotions(
+                (query.tag, query.component) for query in endpoint_queries
+            )
+        except HashInvalidDLRNResponse as e:
+            for query in endpoint_queries:
+                yield HashResult(query, None, str(e))
+            continue
+        for query in endpoint_queries:
+            promotion = latest[(query.tag, query.component)]
+            if promotion is None:
+                yield HashResult(query, None, "No {0} promotion of {1} in {2}".format(
+                    query.tag, query.component or "the aggregate", client.api_url))
+                continue
+            try:
+                hash_info = HashInfo.from_promotion(
+                    os_version, release, query.component, query.tag, promotion, config
+                )
+            except HashInvalidDLRNResponse as e:
+                yield HashResult(query, None, str(e))
+                continue
+            yield HashResult(query, hash_info, None)
@@ -0,0 +1,255 @@
+#  Copyright 2021 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+#
+#
+"""On-disk cache of the DLRN responses hashes are resolved from, shared by
+every process using the same cache directory"""
+from __future__ import absolute_import, division, print_function
+
+import collections
+import contextlib
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    from repo_setup import cache as http_cache
+    from repo_setup import session as http_session
+    from repo_setup.utils import http_get
+except ImportError:
+    from ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup import (
+        cache as http_cache,
+        session as http_session,
+    )
+    from ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup.utils import (
+        http_get,
+    )
+
+
+__metaclass__ = type
+
+DEFAULT_HASH_CACHE_TTL = 300
+# entries not refreshed for a day are removed when a cache is opened
+DEFAULT_HASH_CACHE_MAX_AGE = 24 * 3600
+
+_hash_caches = {}
+_hash_caches_lock = threading.Lock()
+
+
+def conditional_get(url, headers):
+    """GET url with the conditional request headers
+
+    :return: tuple of the body, the HTTP status, -1 on errors like
+             utils.http_get, and the response headers
+    """
+    try:
+        session = http_session.get_session()
+    except ImportError:
+        # without requests every fetch is a plain unconditional one
+        body, status = http_get(url)
+        return body, status, {}
+    try:
+        response = http_session.get_with_retries(session, [url], headers=headers)
+    except Exception as e:
+        return str(e), -1, {}
+    return response.text, response.status_code, response.headers
+
+
+@contextlib.contextmanager
+def _file_lock(lock_file, blocking=True):
+    """Hold an exclusive lock on lock_file, across threads and processes
+
+    Yields False when blocking is False and the lock is held elsewhere,
+    True otherwise.
+    """
+    try:
+        # lazy import
+        import fcntl
+    except ImportError:
+        yield True
+        return
+    try:
+        f = open(lock_file, "a")
+    except (IOError, OSError):
+        # e.g. a read only cache shared by another user, go on unlocked
+        yield True
+        return
+    with f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking
+                        else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class HashCache:
+    """TTL cache of the commit.yaml and delorean.repo.md5 bodies of queries
+
+    Entries are keyed by the query, e.g. (dlrn_url, os_version, release,
+    component, tag, dlrn_hash_tag), and used without any request for ttl
+    seconds. Older entries are revalidated with a conditional request. A
+    per entry lock file makes concurrent processes asking for the same
+    expired entry wait for the one fetching it instead of all fetching it.
+    Entries and lock files older than max_age, or ttl when it is longer,
+    are removed when the cache is opened.
+    """
+
+    def __init__(self, path=http_cache.DEFAULT_CACHE_DIR,
+                 ttl=DEFAULT_HASH_CACHE_TTL, get=conditional_get,
+                 max_age=DEFAULT_HASH_CACHE_MAX_AGE):
+        self.path = os.path.join(path, "hashes")
+        self.ttl = ttl
+        self.max_age = max(max_age, ttl)
+        self.get = get
+        self.stats = collections.Counter()
+        self.enabled = True
+        try:
+            http_cache._makedirs(self.path)
+        except OSError as e:
+            print(
+                "WARNING: Hash cache disabled, cannot create %s: %s" % (self.path, e),
+                file=sys.stderr,
+            )
+            self.enabled = False
+            return
+        self.prune()
+
+    def _entry(self, key):
+        name = hashlib.sha256(json.dumps(list(key)).encode("utf-8")).hexdigest()
+        return (os.path.join(self.path, name + ".json"),
+                os.path.join(self.path, name + ".lock"))
+
+    def _load(self, entry_file, url):
+        try:
+            with open(entry_file, "r") as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if entry.get("url") != url:
+            return None
+        return entry
+
+    def _expired(self, entry_file, lock_file, now):
+        # the entry is rewritten on each refresh, a lock file left without
+        # one ages from its creation
+        for filename in (entry_file, lock_file):
+            try:
+                return now - os.path.getmtime(filename) > self.max_age
+            except OSError:
+                continue
+        return False
+
+    def prune(self):
+        """Remove the entries and lock files older than max_age
+
+        An entry locked by a process fetching it is left alone.
+
+        :return: number of entries removed
+        """
+        if not self.enabled:
+            return 0
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return 0
+        now = time.time()
+        removed = 0
+        for name in set(os.path.splitext(name)[0] for name in names
+                        if name.endswith((".json", ".lock"))):
+            entry_file = os.path.join(self.path, name + ".json")
+            lock_file = os.path.join(self.path, name + ".lock")
+            if not self._expired(entry_file, lock_file, now):
+                continue
+            with _file_lock(lock_file, blocking=False) as locked:
+                # it may have been refreshed since it was listed
+                if not locked or not self._expired(entry_file, lock_file, now):
+                    continue
+                for filename in (entry_file, lock_file):
+                    try:
+                        os.remove(filename)
+                    except OSError:
+                        pass
+                removed += 1
+        return removed
+
+    def _fresh(self, entry):
+        return entry is not None and time.time() - entry["fetched"] < self.ttl
+
+    def _store(self, entry_file, entry):
+        entry["fetched"] = time.time()
+        try:
+            http_cache._atomic_write(entry_file, json.dumps(entry).encode("utf-8"))
+        except (IOError, OSError) as e:
+            print(
+                "WARNING: Failed to cache %s: %s" % (entry["url"], e),
+                file=sys.stderr,
+            )
+
+    def fetch(self, key, url):
+        """Get the body and HTTP status of url, the way utils.http_get does
+
+        :param key: tuple of json serializable values identifying the query
+        :param url: the url the query resolves to
+        """
+        if not self.enabled:
+            self.stats["bypass"] += 1
+            return self.get(url, {})[:2]
+        entry_file, lock_file = self._entry(key)
+        entry = self._load(entry_file, url)
+        if self._fresh(entry):
+            self.stats["hit"] += 1
+            return entry["body"], 200
+        with _file_lock(lock_file):
+            # another process may have refreshed it while we waited
+            entry = self._load(entry_file, url)
+            if self._fresh(entry):
+                self.stats["hit"] += 1
+                return entry["body"], 200
+            headers = {}
+            if entry and entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry and entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+            body, status, response_headers = self.get(url, headers)
+            if status == 304 and entry is not None:
+                self.stats["revalidated"] += 1
+                self._store(entry_file, entry)
+                return entry["body"], 200
+            if status == 200:
+                self.stats["miss"] += 1
+                self._store(entry_file, {
+                    "url": url,
+                    "body": body,
+                    "etag": response_headers.get("ETag"),
+                    "last_modified": response_headers.get("Last-Modified"),
+                })
+            return body, status
+
+
+def get_hash_cache(path=http_cache.DEFAULT_CACHE_DIR, ttl=DEFAULT_HASH_CACHE_TTL):
+    """Get the shared HashCache for path and ttl, creating it on first use"""
+    with _hash_caches_lock:
+        hash_cache = _hash_caches.get((path, ttl))
+        if hash_cache is None:
+            hash_cache = HashCache(path, ttl)
+            _hash_caches[(path, ttl)] = hash_cache
+    return hash_cache
@@ -15,10 +15,23 @@
 #
 from __future__ import absolute_import, division, print_function
 
+import copy
+import hashlib
+import json
 import logging
 import os
-from .constants import CONFIG_PATH, CONFIG_KEYS, DEFAULT_CONFIG
-from .exceptions import HashInvalidConfig, HashInvalidDLRNResponse
+import threading
+from .constants import (
+    CONFIG_PATH,
+    CONFIG_KEYS,
+    CONFIG_SNAPSHOT_SUFFIX,
+    DEFAULT_CONFIG,
+)
+from .exceptions import (
+    HashInvalidConfig,
+    HashInvalidDLRNResponse,
+    HashMissingConfig,
+)
 
 try:
     from repo_setup.utils import http_get
@@ -30,6 +43,56 @@ except ImportError:
 
 __metaclass__ = type
 
+# (config path, mtime): the config loaded from that file, shared by every
+# HashInfo of the process
+_config_cache = {}
+_config_lock = threading.Lock()
+
+
+class _AliasFound(Exception):
+    """An alias, which _compose_events does not resolve, was found"""
+
+
+def _compose_events(loader, yaml, event=None):
+    """Compose the node of the next events of a yaml loader
+
+    The node starting at event, or at the next event, is built from the
+    parser events like the yaml Composer does, without resolving anchors
+    and aliases, so it works with the python and the libyaml loaders.
+    """
+    if event is None:
+        event = loader.get_event()
+    if isinstance(event, yaml.AliasEvent):
+        raise _AliasFound()
+    if isinstance(event, yaml.ScalarEvent):
+        tag = event.tag
+        if tag is None or tag == "!":
+            tag = loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+        return yaml.ScalarNode(tag, event.value, event.start_mark, event.end_mark,
+                               style=event.style)
+    tag = event.tag
+    if isinstance(event, yaml.SequenceStartEvent):
+        if tag is None or tag == "!":
+            tag = loader.resolve(yaml.SequenceNode, None, event.implicit)
+        items = []
+        while not loader.check_event(yaml.SequenceEndEvent):
+            items.append(_compose_events(loader, yaml))
+        end = loader.get_event()
+        return yaml.SequenceNode(tag, items, event.start_mark, end.end_mark,
+                                 flow_style=event.flow_style)
+    if tag is None or tag == "!":
+        tag = loader.resolve(yaml.MappingNode, None, event.implicit)
+    pairs = []
+    while not loader.check_event(yaml.MappingEndEvent):
+        pairs.append((_compose_events(loader, yaml), _compose_events(loader, yaml)))
+    end = loader.get_event()
+    return yaml.MappingNode(tag, pairs, event.start_mark, end.end_mark,
+                            flow_style=event.flow_style)
+
+
+def _sha256(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
 
 class HashInfo:
     """
@@ -69,6 +132,88 @@ class HashInfo:
             return True
         return False
 
+    @classmethod
+    def _resolve_config_path(cls):
+        """Get the path and mtime of the config file load_config() uses
+
+        :return: tuple of path and mtime, both None when no config file is
+                 readable and the embedded DEFAULT_CONFIG is used
+        """
+        # prefer const.CONFIG_PATH then local_config
+        if cls._check_read_file(CONFIG_PATH):
+            config_path = CONFIG_PATH
+        else:
+            config_path = cls._resolve_local_config_path()
+        if not config_path:
+            return None, None
+        return config_path, os.stat(config_path).st_mtime
+
+    @classmethod
+    def _read_config_snapshot(cls, config_path, content):
+        """Get the config of the json snapshot of config_path
+
+        :return: the config dict or None when there is no snapshot or it was
+                 written from another content of config_path
+        """
+        snapshot_path = config_path + CONFIG_SNAPSHOT_SUFFIX
+        if not os.path.isfile(snapshot_path):
+            return None
+        try:
+            with open(snapshot_path, "r") as snapshot_file:
+                snapshot = json.load(snapshot_file)
+        except (IOError, OSError, ValueError) as e:
+            logging.debug("Ignoring config snapshot %s: %s", snapshot_path, e)
+            return None
+        if snapshot.get("sha256") != _sha256(content):
+            logging.debug("Ignoring stale config snapshot %s", snapshot_path)
+            return None
+        return snapshot.get("config")
+
+    @classmethod
+    def _read_config(cls, config_path):
+        with open(config_path, "r") as config_yaml:
+            content = config_yaml.read()
+        config = cls._read_config_snapshot(config_path, content)
+        if config is None:
+            config = cls.load_yaml(content)
+        return config
+
+    @classmethod
+    def write_config_snapshot(cls, config_path=None):
+        """Write the json snapshot of a config file next to it
+
+        load_config() reads the snapshot instead of parsing the yaml as
+        long as the config file content is the one it was written from.
+
+        :param config_path: the config file, by default the one
+                            load_config() uses
+        :raises HashMissingConfig when there is no config file
+        :return: the path of the snapshot
+        """
+        if config_path is None:
+            config_path = cls._resolve_config_path()[0]
+        if not config_path:
+            raise HashMissingConfig("No config file to write a snapshot of")
+        with open(config_path, "r") as config_yaml:
+            content = config_yaml.read()
+        snapshot = {
+            "source": config_path,
+            "sha256": _sha256(content),
+            "config": cls.load_yaml(content),
+        }
+        snapshot_path = config_path + CONFIG_SNAPSHOT_SUFFIX
+        tmp_path = "%s.%d.tmp" % (snapshot_path, os.getpid())
+        with open(tmp_path, "w") as snapshot_file:
+            json.dump(snapshot, snapshot_file)
+        os.rename(tmp_path, snapshot_path)
+        return snapshot_path
+
+    @classmethod
+    def clear_config_cache(cls):
+        """Forget the configs loaded by load_config()"""
+        with _config_lock:
+            _config_cache.clear()
+
     @classmethod
     def load_config(cls, passed_config=None):
         """
@@ -83,6 +228,11 @@ class HashInfo:
         loaded config file. Returns a dictionary containing
         the key->value for all the keys in constants.CONFIG_KEYS.
 
+        The config file is parsed once per process and mtime, or read from
+        its json snapshot, see write_config_snapshot(), so creating many
+        HashInfo objects does not parse the yaml again each time. Each call
+        returns its own copy of the values.
+
         :param passed_config: dict with configuration overrides
         :raises HashMissingConfig for missing config.yaml
         :raises HashInvalidConfig for missing keys in config.yaml
@@ -91,20 +241,21 @@ class HashInfo:
 
         passed_config = passed_config or {}
         result_config = {}
-        config_path = ""
-        local_config = cls._resolve_local_config_path()
-        # prefer const.CONFIG_PATH then local_config
-        if cls._check_read_file(CONFIG_PATH):
-            config_path = CONFIG_PATH
-        elif local_config:
-            config_path = local_config
-        else:
+        config_path, mtime = cls._resolve_config_path()
+        if config_path is None:
             logging.debug("Using embedded config file")
             loaded_config = DEFAULT_CONFIG
-        logging.debug("Using config file at %s", config_path)
-        if config_path != "":
-            with open(config_path, "r") as config_yaml:
-                loaded_config = cls.load_yaml(config_yaml)
+        else:
+            logging.debug("Using config file at %s", config_path)
+            with _config_lock:
+                loaded_config = _config_cache.get((config_path, mtime))
+            if loaded_config is None:
+                loaded_config = cls._read_config(config_path)
+                with _config_lock:
+                    # drop the configs of older mtimes of the same file
+                    for key in [k for k in _config_cache if k[0] == config_path]:
+                        del _config_cache[key]
+                    _config_cache[(config_path, mtime)] = loaded_config
         for k in CONFIG_KEYS:
             if k not in loaded_config:
                 error_str = (
@@ -117,10 +268,12 @@ class HashInfo:
             if passed_config.get(k):
                 result_config[k] = passed_config[k]
             else:
-                result_config[k] = loaded_config[k]
+                # a copy, callers changing it must not change the cache
+                result_config[k] = copy.deepcopy(loaded_config[k])
         return result_config
 
-    def __init__(self, os_version, release, component, tag, dlrn_hash_tag=None, config=None):
+    def __init__(self, os_version, release, component, tag, dlrn_hash_tag=None, config=None,
+                 fetch=None, cache=None):
         """Create a new HashInfo object
 
         :param os_version: The OS and version e.g. centos8
@@ -128,20 +281,21 @@ class HashInfo:
         :param component: The podified-ci component e.g. 'common' or None
         :param tag: The Delorean server named tag e.g. current-podified
         :param config: Use an existing config dictionary and don't load it
+        :param fetch: function taking an url and returning its content and
+                      HTTP status like utils.http_get, used by default
+        :param cache: hash_cache.HashCache answering the query, when still
+                      fresh, instead of fetching it
         """
         config = HashInfo.load_config(config)
+        repo_url = self._set_query(
+            os_version, release, component, tag, dlrn_hash_tag, config["dlrn_url"]
+        )
 
-        self.os_version = os_version
-        self.release = release
-        self.component = component
-        self.tag = tag
-        self.dlrn_hash_tag = dlrn_hash_tag
-
-        repo_url = self._resolve_repo_url(config["dlrn_url"])
-        self.dlrn_url = repo_url
-        self.dlrn_api_url = self._get_dlrn_api_url(config["dlrn_url"])
-
-        repo_url_response, status = http_get(repo_url)
+        if cache is not None:
+            key = (config["dlrn_url"], os_version, release, component, tag, dlrn_hash_tag)
+            repo_url_response, status = cache.fetch(key, repo_url)
+        else:
+            repo_url_response, status = (fetch or http_get)(repo_url)
 
         if status != 200:
             error_str = (
@@ -164,6 +318,52 @@ class HashInfo:
             self.distro_hash = None
             self.extended_hash = None
 
+    @classmethod
+    def from_promotion(cls, os_version, release, component, tag, promotion, config=None):
+        """Create a HashInfo from a DLRN API promotion instead of fetching
+        the commit.yaml or delorean.repo.md5 of the named tag
+
+        :param promotion: dict of the latest promotion of the tag, as
+                          returned by the DLRN API promotions call
+        :param config: Use an existing config dictionary and don't load it
+        :raises HashInvalidDLRNResponse when the promotion has no aggregate
+                hash for a query without component
+        """
+        config = cls.load_config(config)
+        self = cls.__new__(cls)
+        self._set_query(os_version, release, component, tag, None, config["dlrn_url"])
+        if component is not None:
+            self.commit_hash = promotion["commit_hash"]
+            self.distro_hash = promotion["distro_hash"]
+            self.extended_hash = promotion.get("extended_hash")
+            self.full_hash = "%s_%s" % (self.commit_hash, self.distro_hash[0:8])
+        else:
+            # delorean.repo.md5 of an aggregate is its aggregate hash
+            if not promotion.get("aggregate_hash"):
+                raise HashInvalidDLRNResponse(
+                    "No aggregate hash in the {0} promotion of {1}".format(
+                        tag, self.dlrn_api_url
+                    )
+                )
+            self.full_hash = promotion["aggregate_hash"]
+            self.commit_hash = None
+            self.distro_hash = None
+            self.extended_hash = None
+        return self
+
+    def _set_query(self, os_version, release, component, tag, dlrn_hash_tag, dlrn_url):
+        """Set the query attributes and the urls, returns the repo url"""
+        self.os_version = os_version
+        self.release = release
+        self.component = component
+        self.tag = tag
+        self.dlrn_hash_tag = dlrn_hash_tag
+
+        repo_url = self._resolve_repo_url(dlrn_url)
+        self.dlrn_url = repo_url
+        self.dlrn_api_url = self._get_dlrn_api_url(dlrn_url)
+        return repo_url
+
     def _resolve_repo_url(self, dlrn_url):
         """Resolve the delorean server URL given the various attributes of
         this HashInfo object. The only passed parameter is the
@@ -215,11 +415,17 @@ class HashInfo:
             * antelope: https://trunk.rdoproject.org/api-centos9-antelope
             * master: https://trunk.rdoproject.org/api-centos9-master-uc
         """
-        dlrn_api_url = "%s/api-%s-%s" % (dlrn_url, self.os_version, self.release)
+        dlrn_api_url = self.get_dlrn_api_url(dlrn_url, self.os_version, self.release)
+        logging.debug("dlrn_api_url is %s", dlrn_api_url)
+        return dlrn_api_url
+
+    @classmethod
+    def get_dlrn_api_url(cls, dlrn_url, os_version, release):
+        """Returns the DLRN API url of os_version and release"""
+        dlrn_api_url = "%s/api-%s-%s" % (dlrn_url, os_version, release)
 
-        if self.release == "master":
+        if release == "master":
             dlrn_api_url = "%s-uc" % dlrn_api_url
-        logging.debug("dlrn_api_url is %s", dlrn_api_url)
         return dlrn_api_url
 
     def _hashes_from_commit_yaml(self, delorean_result):
@@ -229,14 +435,68 @@ class HashInfo:
 
         :returns tuple of strings full, commit, distro, extended hashes
         """
-        parsed_yaml = self.load_yaml(delorean_result)
-        commit = parsed_yaml["commits"][0]["commit_hash"]
-        distro = parsed_yaml["commits"][0]["distro_hash"]
+        first_commit = self._first_commit(delorean_result)
+        if first_commit is None:
+            # not the usual layout, let the full load raise if it is wrong
+            first_commit = self.load_yaml(delorean_result)["commits"][0]
+        commit = first_commit["commit_hash"]
+        distro = first_commit["distro_hash"]
         full = "%s_%s" % (commit, distro[0:8])
-        extended = parsed_yaml["commits"][0]["extended_hash"]
-        logging.debug("delorean commit.yaml results %s", parsed_yaml["commits"][0])
+        extended = first_commit["extended_hash"]
+        logging.debug("delorean commit.yaml results %s", first_commit)
         return full, commit, distro, extended
 
+    @classmethod
+    def _first_commit(cls, commit_yaml):
+        """Get the first item of the commits list of a commit.yaml
+
+        commit.yaml lists every commit of the build but only the first one
+        is used, so the yaml events are parsed, with libyaml when it is
+        available, only up to the end of that first item instead of loading
+        the whole file.
+
+        :returns the first commit dict, or None when commit_yaml is not a
+                 mapping with a non empty commits list in its first document
+        """
+        import yaml
+
+        loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)(commit_yaml)
+        try:
+            for event_class in (yaml.StreamStartEvent, yaml.DocumentStartEvent,
+                                yaml.MappingStartEvent):
+                if not isinstance(loader.get_event(), event_class):
+                    return None
+            while not loader.check_event(yaml.MappingEndEvent):
+                key = loader.get_event()
+                if isinstance(key, yaml.ScalarEvent) and key.value == "commits":
+                    if not isinstance(loader.get_event(), yaml.SequenceStartEvent):
+                        return None
+                    if loader.check_event(yaml.SequenceEndEvent):
+                        return None
+                    return loader.construct_document(_compose_events(loader, yaml))
+                _compose_events(loader, yaml, key)
+                _compose_events(loader, yaml)
+            return None
+        except _AliasFound:
+            return None
+        finally:
+            loader.dispose()
+
+    def to_dict(self):
+        """Returns the hashes and the query of the object as a dict"""
+        return {
+            "commit_hash": self.commit_hash,
+            "distro_hash": self.distro_hash,
+            "full_hash": self.full_hash,
+            "extended_hash": self.extended_hash,
+            "dlrn_url": self.dlrn_url,
+            "dlrn_api_url": self.dlrn_api_url,
+            "os_version": self.os_version,
+            "release": self.release,
+            "component": self.component,
+            "tag": self.tag,
+        }
+
     def __repr__(self):
         """Returns a string representation of the object"""
         attrs = vars(self)
@@ -1,5 +1,3 @@
-#!/usr/bin/env python
-
 # Copyright 2016 Red Hat, Inc.
 # Licensed under the Apache License, Version 2.0 (the "License");
 # you may not use this file except in compliance with the License.
@@ -16,19 +14,54 @@
 
 from __future__ import absolute_import, division, print_function
 import argparse
+import collections
 import os
-import platform
 import re
+import shutil
 import subprocess
 import sys
+import threading
+import time
+
+try:
+    from repo_setup import cache as http_cache
+    from repo_setup import mirrors
+    from repo_setup import rewrite
+    from repo_setup import session as http_session
+    from repo_setup import timings
+    from repo_setup.utils import OS_RELEASE_PATH, get_distro_info
+except ImportError:
+    from ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup import (
+        cache as http_cache,
+        mirrors,
+        rewrite,
+        session as http_session,
+        timings,
+    )
+    from ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup.utils import (
+        OS_RELEASE_PATH,
+        get_distro_info,
+    )
 
 
 __metaclass__ = type
 TITLE_RE = re.compile("\\[(.*)\\]")
+REPO_ID_RE = re.compile("^\\[(.*)\\]", re.MULTILINE)
 NAME_RE = re.compile("name=(.+)")
 PRIORITY_RE = re.compile("priority=\\d+")
+MD5_RE = re.compile("^[0-9a-f]{32}$")
+# DLRN publishes the md5 of these files next to them, as <name>.md5
+MD5_PUBLISHED_FILES = ["delorean.repo"]
 DEFAULT_OUTPUT_PATH = "/etc/yum.repos.d"
+# dnf (libdnf) and dnf5 (libdnf5) metadata cache directories
+DNF_CACHE_DIRS = ["/var/cache/dnf", "/var/cache/libdnf5"]
+# the metadata cache entries of a repo id in DNF_CACHE_DIRS, its
+# <repoid>-<16 hex> directory and its dnf solv files
+DNF_CACHE_ENTRY_RE = "%s(?:(-[0-9a-f]{16})|\\.solv|-[a-z]+\\.solvx)$"
 DEFAULT_RDO_MIRROR = "https://trunk.rdoproject.org"
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_PREWARM_WORKERS = 4
+DEFAULT_PREWARM_TIMEOUT = 300
 
 # RHEL is only provided to licensed cloud providers via RHUI
 DEFAULT_MIRROR_MAP = {
@@ -107,6 +140,27 @@ SUPPORTED_DISTROS = [
 ]
 DISTRO_CHOICES = ["".join(distro_pair) for distro_pair in SUPPORTED_DISTROS]
 
+# Repos that are a DLRN named tag and come with the deps repo
+DLRN_TAG_REPOS = [
+    "current",
+    "consistent",
+    "current-podified",
+    "podified-ci-testing",
+    "podified-ci-testing-tcib",
+]
+
+
+# A repo file written by _write_repo, changed is False when the file already
+# had the same content and was left alone
+WrittenRepo = collections.namedtuple(
+    "WrittenRepo", ["filename", "repo_ids", "changed"]
+)
+
+# The dnf makecache of a repo by _prewarm_metadata, error is None on success
+PrewarmResult = collections.namedtuple(
+    "PrewarmResult", ["repo_id", "seconds", "error"]
+)
+
 
 class InvalidArguments(Exception):
     pass
@@ -116,35 +170,106 @@ class NoRepoTitle(Exception):
     pass
 
 
-def _get_distro():
+class RepoChecksumError(Exception):
+    pass
+
+
+class FetchCache:
+    """Per-invocation cache of remote repo files keyed by resolved url
+
+    Every fetch path of a run goes through the same cache so each url is
+    downloaded at most once, however many requested repos need it.
+
+    :param fetch: function getting the content of a url for args, defaults
+                  to _get_repo, which injects the mirrors of args, and
+                  counting the url as a download or a hit in the
+                  collections.Counter it is passed last
+    """
+
+    def __init__(self, args, fetch=None):
+        self.args = args
+        # urls served without a download, from this run or the caches
+        self.hits = 0
+        # urls downloaded with a 200 response
+        self.downloads = 0
+        self._fetch = fetch
+        self._content = {}
+        self._requested = set()
+        self._lock = threading.Lock()
+
+    def _get(self, url, args):
+        fetch = self._fetch or _get_repo
+        stats = collections.Counter()
+        content = fetch(url, args, stats)
+        with self._lock:
+            self.downloads += stats["download"]
+            self.hits += stats["hit"]
+        return content
+
+    def add(self, url, content):
+        """Add content fetched elsewhere for url"""
+        self._store(url, content)
+
+    def prefetch(self, urls, args_of=None):
+        """Download urls not cached yet using a bounded pool of workers
+
+        Errors are raised in the order the urls were requested, so a failing
+        run reports the same error a serial fetch would have hit first.
+
+        :param args_of: function getting the args a url is fetched with,
+                        by default the args of the cache
+        """
+        urls = [url for url in urls if url not in self._content]
+        if not urls:
+            return
+        args_of = args_of or (lambda url: self.args)
+        workers = min(self.args.max_workers, len(urls))
+        if workers <= 1:
+            for url in urls:
+                self._store(url, self._get(url, args_of(url)))
+            return
+        # lazy import
+        from concurrent import futures
+
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = [(url, executor.submit(self._get, url, args_of(url)))
+                       for url in urls]
+            for url, future in pending:
+                self._store(url, future.result())
+
+    def get(self, url):
+        """Get the (mirror injected) content of url, downloading it once"""
+        with self._lock:
+            hit = url in self._requested
+            if hit:
+                self.hits += 1
+            self._requested.add(url)
+        if hit and url in self._content:
+            _record_fetch(self.args, url, time.monotonic(), cache="run")
+        if url not in self._content:
+            self._store(url, self._get(url, self.args))
+        return self._content[url]
+
+    def _store(self, url, content):
+        with self._lock:
+            self._content.setdefault(url, content)
+
+
+def _get_distro(output=print):
     """Get distro info from os-release
 
+    output: function printing the messages, print by default
     returns: distro_id, distro_major_version_id, distro_name
     """
     # Avoids a crash on unsupported platforms which would prevent even
     # running with `--help`.
-    if not os.path.exists("/etc/os-release"):
-        return platform.system(), "unknown", "unknown"
-
-    output = subprocess.Popen(
-        'source /etc/os-release && echo -e -n "$ID\n$VERSION_ID\n$NAME"',
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=open(os.devnull, "w"),
-        executable="/bin/bash",
-        universal_newlines=True,
-    ).communicate()
+    if not os.path.exists(OS_RELEASE_PATH):
+        # lazy import
+        import platform
 
-    # distro_id and distro_version_id will always be at least an empty string
-    distro_id, distro_version_id, distro_name = output[0].split("\n")
-
-    # if distro_version_id is empty string the major version will be empty
-    # string too
-    distro_major_version_id = distro_version_id.split(".")[0]
+        return platform.system(), "unknown", "unknown"
 
-    # check if that is UBI subcase?
-    if os.path.exists("/etc/yum.repos.d/ubi.repo"):
-        distro_id = "ubi"
+    distro_id, distro_major_version_id, distro_name = get_distro_info()
 
     if (distro_id, distro_major_version_id) not in SUPPORTED_DISTROS:
         print(
@@ -157,7 +282,7 @@ def _get_distro():
         distro_major_version_id = "9"
 
     if distro_id == "ubi":
-        print(
+        output(
             "WARNING: Centos{0} Base and AppStream will be installed for "
             "this UBI distro".format(distro_major_version_id)
         )
@@ -165,10 +290,65 @@ def _get_distro():
     return distro_id, distro_major_version_id, distro_name
 
 
-def _parse_args(distro_id, distro_major_version_id):
+class _RaisingArgumentParser(argparse.ArgumentParser):
+    """ArgumentParser raising InvalidArguments instead of exiting"""
+
+    def error(self, message):
+        raise InvalidArguments(message)
+
+
+def _parse_override(parser, dest, value):
+    """Convert and check the override of dest like parser would its option
+
+    Strings go through the type of the option and flags take booleans or
+    their string forms, e.g. from a templated module option.
+    """
+    actions = [action for action in parser._actions if action.dest == dest]
+    if not actions:
+        parser.error("unknown argument %s" % dest)
+    action = actions[0]
+    name = "/".join(action.option_strings) or action.metavar or dest
+    if action.nargs == 0 and isinstance(action.const, bool):
+        if isinstance(value, str):
+            value = {"true": True, "yes": True, "1": True, "on": True,
+                     "false": False, "no": False, "0": False,
+                     "off": False}.get(value.lower(), value)
+        if not isinstance(value, bool):
+            parser.error("argument %s: invalid boolean value: %r"
+                         % (name, value))
+        return value
+    is_list = action.nargs in ("+", "*") and isinstance(value, list)
+    items = []
+    for item in value if is_list else [value]:
+        if action.type is not None and isinstance(item, str):
+            try:
+                item = action.type(item)
+            except (TypeError, ValueError):
+                parser.error("argument %s: invalid %s value: %r" % (
+                    name, getattr(action.type, "__name__", "type"), item))
+        if action.choices is not None and item not in action.choices:
+            parser.error("argument %s: invalid choice: %r (choose from %s)" % (
+                name, item, ", ".join(repr(c) for c in action.choices)))
+        items.append(item)
+    return items if is_list else items[0]
+
+
+def _parse_args(distro_id, distro_major_version_id, argv=None,
+                exit_on_error=True, **overrides):
+    """Parse argv, sys.argv by default, into the run arguments
+
+    overrides set arguments by their destination name after parsing, e.g.
+    max_workers=8 or max_workers="8", and go through the same conversions
+    and checks as the command line.
+    Invalid arguments print the usage and exit, or raise InvalidArguments
+    without printing anything when exit_on_error is False.
+    """
     distro = "{0}{1}".format(distro_id, distro_major_version_id)
 
-    parser = argparse.ArgumentParser(
+    parser_class = argparse.ArgumentParser
+    if not exit_on_error:
+        parser_class = _RaisingArgumentParser
+    parser = parser_class(
         description="Download and install repos necessary for OpenStack. Note "
         "that some of these repos require yum-plugin-priorities, "
         "so that will also be installed.",
@@ -247,10 +427,175 @@ def _parse_args(distro_id, distro_major_version_id):
         default=False,
         help="Disable stream support for CentOS repos",
     )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help="Maximum number of repo files fetched concurrently.",
+    )
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        default=http_session.DEFAULT_POOL_SIZE,
+        help="Maximum number of keep-alive connections pooled per host.",
+    )
+    parser.add_argument(
+        "--connect-timeout",
+        type=float,
+        default=http_session.DEFAULT_CONNECT_TIMEOUT,
+        help="Seconds to wait for a connection to a repo server.",
+    )
+    parser.add_argument(
+        "--read-timeout",
+        type=float,
+        default=http_session.DEFAULT_READ_TIMEOUT,
+        help="Seconds to wait for a repo server to send data.",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=http_session.DEFAULT_RETRIES,
+        help="Times to retry a repo file download on connection errors, "
+        "timeouts and 429 or 5xx responses, per mirror.",
+    )
+    parser.add_argument(
+        "--backoff",
+        type=float,
+        default=http_session.DEFAULT_BACKOFF,
+        help="Base seconds of the exponential backoff, with jitter, between "
+        "retries.",
+    )
+    parser.add_argument(
+        "--rdo-fallback-mirrors",
+        help="Comma separated RDO mirrors to fetch repo files from when "
+        "--rdo-mirror keeps failing.",
+    )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        help="Seconds the whole run may spend, downloads past it fail.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=http_cache.DEFAULT_CACHE_DIR,
+        help="Directory in which fetched repo files are cached and "
+        "revalidated with conditional requests on later runs.",
+    )
+    parser.add_argument(
+        "--cache-max-size",
+        type=int,
+        default=http_cache.DEFAULT_CACHE_MAX_SIZE,
+        help="Maximum size in bytes of the cache directory. Least recently "
+        "used files are evicted first.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        default=False,
+        help="Always download repo files, bypassing the cache directory.",
+    )
+    parser.add_argument(
+        "--store-max-age",
+        type=float,
+        help="Prune DLRN hash pinned repo files unused for this many days "
+        "from the content store. They are kept forever by default.",
+    )
+    parser.add_argument(
+        "--store-max-size",
+        type=int,
+        help="Prune least recently used DLRN hash pinned repo files until "
+        "the content store fits in this many bytes.",
+    )
+    parser.add_argument(
+        "--staged",
+        action="store_true",
+        default=False,
+        help="Fetch and render every repo file into a staging directory "
+        "first, then move the changed ones into place with atomic renames.",
+    )
+    parser.add_argument(
+        "--prewarm",
+        action="store_true",
+        default=False,
+        help="Download the dnf metadata of the changed repos with dnf "
+        "makecache after installing them, so later dnf commands do not.",
+    )
+    parser.add_argument(
+        "--prewarm-workers",
+        type=int,
+        default=DEFAULT_PREWARM_WORKERS,
+        help="Maximum number of dnf makecache run concurrently by --prewarm.",
+    )
+    parser.add_argument(
+        "--prewarm-timeout",
+        type=float,
+        default=DEFAULT_PREWARM_TIMEOUT,
+        help="Seconds after which the dnf makecache of a repo is killed.",
+    )
+    parser.add_argument(
+        "--probe-mirrors",
+        action="store_true",
+        default=False,
+        help="Probe the mirror candidates concurrently and use the fastest "
+        "healthy one for --mirror and --rdo-mirror, unless those are set.",
+    )
+    parser.add_argument(
+        "--mirror-candidates",
+        help="Comma separated base OS mirrors to probe, overrides the "
+        "--mirror-config entry of the distro.",
+    )
+    parser.add_argument(
+        "--rdo-mirror-candidates",
+        help="Comma separated RDO mirrors to probe, overrides the "
+        "--mirror-config %s entry." % mirrors.RDO_MIRRORS_KEY,
+    )
+    parser.add_argument(
+        "--mirror-config",
+        metavar="PATH",
+        help="json file mapping a distro, e.g. centos9, or %s to a list of "
+        "mirror candidates." % mirrors.RDO_MIRRORS_KEY,
+    )
+    parser.add_argument(
+        "--mirror-map",
+        metavar="PATH",
+        help="json file mapping upstream url prefixes to local mirrors, in "
+        "order, applied to the baseurl, mirrorlist, metalink and gpgkey "
+        "urls of every repo file before --mirror and --rdo-mirror.",
+    )
+    parser.add_argument(
+        "--probe-timeout",
+        type=float,
+        default=mirrors.DEFAULT_PROBE_TIMEOUT,
+        help="Seconds to wait for the mirror probes.",
+    )
+    parser.add_argument(
+        "--mirror-ttl",
+        type=int,
+        default=mirrors.DEFAULT_MIRROR_TTL,
+        help="Seconds a mirror selection is cached for, 0 to always probe.",
+    )
+    parser.add_argument(
+        "--timings",
+        metavar="PATH",
+        default=os.environ.get(timings.TIMINGS_ENV) or None,
+        help="Write a json report of the wall time of each phase and each "
+        "fetched url to PATH, - for stderr. Defaults to the %s "
+        "environment variable." % timings.TIMINGS_ENV,
+    )
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    for dest, value in overrides.items():
+        setattr(args, dest, _parse_override(parser, dest, value))
     if args.no_stream:
         args.stream = False
+    if args.max_workers < 1:
+        parser.error("--max-workers must be at least 1")
+    if args.pool_size < 1:
+        parser.error("--pool-size must be at least 1")
+    if args.retries < 0:
+        parser.error("--retries must not be negative")
+    if args.prewarm_workers < 1:
+        parser.error("--prewarm-workers must be at least 1")
 
     # Default mirror for args.distro (which defaults to 'distro')
     default_mirror = DEFAULT_MIRROR_MAP.get(args.distro, None)
@@ -258,23 +603,285 @@ def _parse_args(distro_id, distro_major_version_id):
     if args.mirror is None:
         args.mirror = default_mirror
     args.old_mirror = default_mirror
+    # set by main() when a timings report was requested
+    args.recorder = None
+    args.deadline_at = None
+    if args.deadline is not None:
+        args.deadline_at = time.monotonic() + args.deadline
 
     return args
 
 
-def _get_repo(path, args):
+def _get_http_cache(args):
+    if args.no_cache:
+        return None
+    return http_cache.get_http_cache(args.cache_dir, args.cache_max_size)
+
+
+def _get_content_store(args):
+    if args.no_cache:
+        return None
+    return http_cache.get_content_store(args.cache_dir)
+
+
+def _prune_content_store(args, output=print):
+    if args.store_max_age is None and args.store_max_size is None:
+        return
+    store = _get_content_store(args)
+    if not store:
+        return
+    max_age = None
+    if args.store_max_age is not None:
+        max_age = args.store_max_age * 24 * 60 * 60
+    removed = store.prune(max_age=max_age, max_size=args.store_max_size)
+    if removed:
+        output("Pruned %d repo file(s) from the content store" % removed)
+
+
+def _get_mirror_candidates(args):
+    config = {}
+    if args.mirror_config:
+        try:
+            config = mirrors.load_mirror_config(args.mirror_config)
+        except (IOError, OSError, ValueError) as e:
+            raise InvalidArguments("Invalid mirror config: %s" % e)
+
+    def split(value):
+        return [url.strip() for url in value.split(",") if url.strip()]
+
+    if args.mirror_candidates:
+        os_urls = split(args.mirror_candidates)
+    else:
+        os_urls = config.get(args.distro, [])
+    if args.rdo_mirror_candidates:
+        rdo_urls = split(args.rdo_mirror_candidates)
+    else:
+        rdo_urls = config.get(mirrors.RDO_MIRRORS_KEY, [])
+    return os_urls, rdo_urls
+
+
+def _select_mirrors(args, output=print):
+    if not args.probe_mirrors:
+        return
+    os_urls, rdo_urls = _get_mirror_candidates(args)
+    cache = None
+    if not args.no_cache and args.mirror_ttl > 0:
+        cache = mirrors.MirrorCache(args.cache_dir, args.mirror_ttl)
+    session = http_session.get_session(args.pool_size)
+    recorder = getattr(args, "recorder", None)
+    # an explicit --mirror or --rdo-mirror wins over the probed ones
+    for attr, default, urls in (
+        ("mirror", args.old_mirror, os_urls),
+        ("rdo_mirror", DEFAULT_RDO_MIRROR, rdo_urls),
+    ):
+        if not urls or getattr(args, attr) != default:
+            continue
+        if len(urls) == 1:
+            mirror, probes = urls[0], []
+        else:
+            mirror, probes = mirrors.select_mirror(
+                session, urls, args.probe_timeout, cache
+            )
+            if not probes:
+                output("Using cached %s selection %s" % (attr, mirror))
+        for probe in probes:
+            output(
+                "Probed %s %s: %.3fs %s"
+                % (attr, probe.url, probe.seconds, probe.status or probe.error)
+            )
+            if recorder:
+                recorder.record_probe(
+                    probe.url, probe.seconds, probe.status, probe.error
+                )
+        if mirror is None:
+            print(
+                "WARNING: No healthy %s among %s, keeping %s"
+                % (attr, ", ".join(urls), default),
+                file=sys.stderr,
+            )
+            continue
+        mirror = mirror.rstrip("/")
+        if probes:
+            output("Selected %s %s" % (attr, mirror))
+        setattr(args, attr, mirror)
+
+
+def _record_fetch(args, url, start, status=None, content=None, cache=None,
+                  stats=None):
+    # content is what was downloaded, cache hits leave it None
+    if stats is not None:
+        if status == 200 and cache in ("miss", "bypass"):
+            stats["download"] += 1
+        elif cache in ("md5", "revalidated", "immutable"):
+            stats["hit"] += 1
+    recorder = getattr(args, "recorder", None)
+    if recorder:
+        size = len(content.encode("utf-8")) if content is not None else 0
+        recorder.record_fetch(url, time.monotonic() - start, status, size, cache)
+
+
+def _get_failover_urls(path, args):
+    urls = [path]
+    if not args.rdo_fallback_mirrors:
+        return urls
+    primary = args.rdo_mirror.rstrip("/") + "/"
+    if path.startswith(primary):
+        for mirror in args.rdo_fallback_mirrors.split(","):
+            mirror = mirror.strip().rstrip("/")
+            if mirror:
+                urls.append(mirror + "/" + path[len(primary):])
+    return urls
+
+
+def _http_get(path, args, headers=None):
+    """GET path with the retry, failover and deadline policy of args"""
+    recorder = getattr(args, "recorder", None)
+
+    def on_retry(url, attempt, reason, delay, failover):
+        if failover:
+            print(
+                "WARNING: %s failed after %d attempt(s) (%s), failing over "
+                "to %s" % (url, attempt, reason, failover),
+                file=sys.stderr,
+            )
+        else:
+            print(
+                "WARNING: Retrying %s in %.2fs after attempt %d failed (%s)"
+                % (url, delay, attempt, reason),
+                file=sys.stderr,
+            )
+        if recorder:
+            recorder.record_retry(url, attempt, reason, delay, failover)
+
+    return http_session.get_with_retries(
+        http_session.get_session(args.pool_size),
+        _get_failover_urls(path, args),
+        headers=headers,
+        timeout=(args.connect_timeout, args.read_timeout),
+        retries=args.retries,
+        backoff=args.backoff,
+        deadline=args.deadline_at,
+        on_retry=on_retry,
+    )
+
+
+def _md5(data):
     # lazy import
-    if "requests" not in globals():
-        import requests
+    import hashlib
+
+    if not isinstance(data, bytes):
+        data = data.encode("utf-8")
+    return hashlib.md5(data).hexdigest()
+
+
+def _get_published_md5(path, args):
+    """Get the md5 DLRN publishes for path, None if there is none
+
+    A failure to get it is not an error, path is then downloaded whole and
+    used unchecked.
+    """
+    if path.rsplit("/", 1)[-1] not in MD5_PUBLISHED_FILES:
+        return None
+    start = time.monotonic()
+    try:
+        r = _http_get(path + ".md5", args)
+    except IOError as e:
+        print(
+            "WARNING: Failed to get %s.md5, fetching the whole file: %s"
+            % (path, e),
+            file=sys.stderr,
+        )
+        _record_fetch(args, path + ".md5", start, cache="bypass")
+        return None
+    md5 = r.text.strip() if r.status_code == 200 else ""
+    _record_fetch(args, path + ".md5", start, r.status_code,
+                  md5 or None, "bypass")
+    return md5 if MD5_RE.match(md5) else None
 
-    r = requests.get(path)
+
+def _get_repo(path, args, stats=None):
+    """Get the content of path with the mirrors of args injected
+
+    :param stats: collections.Counter counting the download or the hit
+    """
+    content = _fetch_repo(path, args, stats)
+    if content is None:
+        return None
+    return _inject_mirrors(content, args)
+
+
+def _fetch_repo(path, args, stats=None):
+    """Get the content of path as published, through the caches"""
+    if http_cache.is_immutable_url(path):
+        return _fetch_immutable_repo(path, args, stats)
+    start = time.monotonic()
+    cache = _get_http_cache(args)
+    md5 = _get_published_md5(path, args)
+    if md5 and cache:
+        # the 32 byte md5 tells whether the cached body is still current
+        content = cache.load(path)
+        if content is not None and _md5(content) == md5:
+            _record_fetch(args, path, start, cache="md5", stats=stats)
+            return content
+    headers = cache.validators(path) if cache else {}
+    r = _http_get(path, args, headers)
+    if r.status_code == 304:
+        content = cache.load(path)
+        if content is not None:
+            _record_fetch(args, path, start, 304, cache="revalidated",
+                          stats=stats)
+            return content
+        # the cached copy vanished since it was revalidated
+        r = _http_get(path, args, {})
     if r.status_code == 200:
-        return _inject_mirrors(r.text, args)
+        # the raw bytes, r.text is decoded with a guessed charset
+        if md5 and _md5(r.content) != md5:
+            # DLRN may have moved the tag between both requests
+            md5 = _get_published_md5(path, args)
+            if md5 and _md5(r.content) != md5:
+                raise RepoChecksumError(
+                    "Downloaded %s does not match its published md5 %s"
+                    % (path, md5)
+                )
+        if cache:
+            cache.store(path, r.text, r.headers.get("ETag"),
+                        r.headers.get("Last-Modified"))
+        _record_fetch(args, path, start, 200, r.text,
+                      "miss" if cache else "bypass", stats)
+        return r.text
     else:
+        _record_fetch(args, path, start, r.status_code,
+                      cache="miss" if cache else "bypass")
         r.raise_for_status()
 
 
-def _write_repo(content, target, name=None):
+def _fetch_immutable_repo(path, args, stats=None):
+    """Get a DLRN hash pinned repo file, from the content store if possible
+
+    The content at a hash addressed path never changes, so once stored it
+    is served without any network access.
+    """
+    start = time.monotonic()
+    store = _get_content_store(args)
+    content = store.load(path) if store else None
+    if content is not None:
+        _record_fetch(args, path, start, cache="immutable", stats=stats)
+    else:
+        r = _http_get(path, args)
+        if r.status_code != 200:
+            _record_fetch(args, path, start, r.status_code,
+                          cache="miss" if store else "bypass")
+            r.raise_for_status()
+            return None
+        content = r.text
+        if store:
+            store.store(path, content)
+        _record_fetch(args, path, start, 200, content,
+                      "miss" if store else "bypass", stats)
+    return content
+
+
+def _get_repo_filename(content, target, name=None):
     if not name:
         m = TITLE_RE.search(content)
         if not m:
@@ -285,10 +892,133 @@ def _write_repo(content, target, name=None):
         if "component" in name:
             name = "delorean"
     filename = name + ".repo"
-    filename = os.path.join(target, filename)
-    with open(filename, "w") as f:
-        f.write(content)
-    print("Installed repo %s to %s" % (name, filename))
+    return name, os.path.join(target, filename)
+
+
+def _is_repo_changed(content, filename):
+    if not os.path.exists(filename):
+        return True
+    with open(filename, "r") as f:
+        return f.read() != content
+
+
+def _write_repo(content, target, name=None, output=print):
+    name, filename = _get_repo_filename(content, target, name)
+    changed = _is_repo_changed(content, filename)
+    if changed:
+        with open(filename, "w") as f:
+            f.write(content)
+        output("Installed repo %s to %s" % (name, filename))
+    else:
+        output("Repo %s is unchanged in %s" % (name, filename))
+    return WrittenRepo(filename, REPO_ID_RE.findall(content), changed)
+
+
+class PlannedInstall:
+    """Render repo files in memory without touching their targets
+
+    Nothing is written until commit(), so a run that is never committed is
+    a dry run. The before and after content of every changed or removed
+    file is kept in diffs.
+
+    :param output: function printing the messages of commit()
+    """
+
+    def __init__(self, output=print):
+        self.output = output
+        self._planned = collections.OrderedDict()
+        self.diffs = []
+
+    def _add_diff(self, filename, after):
+        before = ""
+        if os.path.exists(filename):
+            with open(filename, "r") as f:
+                before = f.read()
+        self.diffs.append({"path": filename, "before": before, "after": after})
+
+    def write(self, content, target, name=None):
+        """Plan content for target, see _write_repo"""
+        name, filename = _get_repo_filename(content, target, name)
+        changed = _is_repo_changed(content, filename)
+        if changed:
+            self._add_diff(filename, content)
+        self._planned[filename] = (name, content, changed)
+        return WrittenRepo(filename, REPO_ID_RE.findall(content), changed)
+
+    def remove(self, filenames):
+        """Plan the removal of filenames"""
+        for filename in filenames:
+            self._add_diff(filename, "")
+
+    def commit(self):
+        """Write every changed planned repo file in place"""
+        for filename, (name, content, changed) in self._planned.items():
+            if changed:
+                _write_repo(content, os.path.dirname(filename), name,
+                            output=self.output)
+            else:
+                self.output("Repo %s is unchanged in %s" % (name, filename))
+        self._planned.clear()
+
+    def cleanup(self):
+        self._planned.clear()
+
+
+class StagedInstall(PlannedInstall):
+    """Stage repo files next to their target, then move them into place
+
+    Repo files are written to a hidden temporary directory inside each
+    target directory, so they are on the same filesystem and commit() can
+    move the changed ones into place with atomic renames. Repo files are
+    never missing or partially written while a run is in progress.
+    """
+
+    def __init__(self, output=print):
+        super(StagedInstall, self).__init__(output)
+        self._stage_dirs = {}
+        self._staged = collections.OrderedDict()
+
+    def _get_stage_dir(self, target):
+        if target not in self._stage_dirs:
+            # lazy import
+            import tempfile
+
+            self._stage_dirs[target] = tempfile.mkdtemp(
+                prefix=".repo-setup-", dir=target
+            )
+        return self._stage_dirs[target]
+
+    def write(self, content, target, name=None):
+        """Stage content for target, see _write_repo"""
+        written = super(StagedInstall, self).write(content, target, name)
+        name, staged = _get_repo_filename(
+            content, self._get_stage_dir(target), name
+        )
+        with open(staged, "w") as f:
+            f.write(content)
+        self._staged[written.filename] = (name, staged, written.changed)
+        return written
+
+    def commit(self):
+        """Move every changed staged repo file into place"""
+        for filename, (name, staged, changed) in self._staged.items():
+            if not changed:
+                self.output("Repo %s is unchanged in %s" % (name, filename))
+                continue
+            if os.path.exists(filename):
+                shutil.copymode(filename, staged)
+            os.rename(staged, filename)
+            self.output("Installed repo %s to %s" % (name, filename))
+        self._staged.clear()
+        self._planned.clear()
+
+    def cleanup(self):
+        """Remove the staging directories and anything left in them"""
+        for stage_dir in self._stage_dirs.values():
+            shutil.rmtree(stage_dir, ignore_errors=True)
+        self._stage_dirs.clear()
+        self._staged.clear()
+        self._planned.clear()
 
 
 def _validate_distro_repos(args):
@@ -408,8 +1138,15 @@ def _validate_args(args, distro_name, distro_major_version_id):
     _validate_distro_stream(args, distro_name, distro_major_version_id)
 
 
-def _remove_existing(args):
-    """Remove any delorean* or opstools repos that already exist"""
+def _remove_existing(args, keep=(), dry_run=False, output=print):
+    """Remove any delorean* or opstools repos that already exist
+
+    Files listed in keep were produced by this run and are left in place.
+    With dry_run, the files are only listed.
+
+    returns: list of removed files
+    """
+    removed = []
     if args.distro in ["ubi8", "ubi9"]:
         regex = (
             "^(BaseOS|AppStream|delorean|repo-setup-centos-"
@@ -428,13 +1165,24 @@ def _remove_existing(args):
     for f in paths:
         if pattern.match(f):
             filename = os.path.join(args.output_path, f)
-            if os.path.exists(filename):
-                os.remove(filename)
-                print('Removed old repo "%s"' % filename)
+            if (
+                filename not in keep
+                and filename not in removed
+                and os.path.exists(filename)
+            ):
+                removed.append(filename)
             filename = os.path.join("/etc/distro.repos.d", f)
-            if os.path.exists(filename):
-                os.remove(filename)
-                print('Removed old repo "%s"' % filename)
+            if (
+                filename not in keep
+                and filename not in removed
+                and os.path.exists(filename)
+            ):
+                removed.append(filename)
+    for filename in removed:
+        if not dry_run:
+            os.remove(filename)
+            output('Removed old repo "%s"' % filename)
+    return removed
 
 
 def _get_base_path(args):
@@ -484,29 +1232,34 @@ def _change_priority(content, new_priority):
     return new_content
 
 
+def _get_mirror_rewrites(args):
+    rewrites = []
+    if args.mirror_map:
+        try:
+            rewrites.extend(rewrite.load_rewrite_map(args.mirror_map))
+        except (IOError, OSError, ValueError) as e:
+            raise InvalidArguments("Invalid mirror map: %s" % e)
+    rewrites.append((DEFAULT_RDO_MIRROR, args.rdo_mirror))
+    if args.old_mirror:
+        rewrites.append((args.old_mirror, args.mirror))
+    return rewrites
+
+
 def _inject_mirrors(content, args):
     """Replace any references to the default mirrors in repo content
 
     In some cases we want to use mirrors whose repo files still point to the
     default servers.  If the user specified to use the mirror, we want to
-    replace any such references with the mirror address.  This function
-    handles that by using a regex to swap out the baseurl server.
+    replace any such references with the mirror address.  The --mirror-map
+    prefixes come first, then the default RDO and base OS servers, and the
+    baseurl, mirrorlist, metalink and gpgkey urls are all rewritten in one
+    pass, see rewrite.MirrorRewriter.
     """
+    return rewrite.get_rewriter(_get_mirror_rewrites(args)).rewrite(content)
 
-    content = re.sub(
-        "baseurl=%s" % DEFAULT_RDO_MIRROR, "baseurl=%s" % args.rdo_mirror, content
-    )
-
-    if args.old_mirror:
-        content = re.sub(
-            "baseurl=%s" % args.old_mirror, "baseurl=%s" % args.mirror, content
-        )
-
-    return content
 
-
-def _get_rhel_trunk_candidate_repos(args, base_path):
-    content = _get_repo(base_path + "osptrunk-deps.repo", args)
+def _get_rhel_trunk_candidate_repos(args, base_path, cache):
+    content = cache.get(base_path + "osptrunk-deps.repo")
     # Replace deps with candidate
     content = content.replace('deps', 'candidate')
     content = content.replace('build', 'candidate')
@@ -535,50 +1288,88 @@ def _get_dlrn_hash_tag(args, repo):
     return repo
 
 
-def _install_repos(args, base_path):
+def _get_deps_url(args, base_path):
+    if 'rhel' in args.distro:
+        return base_path + "osptrunk-deps.repo"
+    return base_path + "delorean-deps.repo"
+
+
+def _get_repo_urls(args, base_path):
+    """Get the remote repo files needed by the requested repos
+
+    returns: list of urls, in the order a serial install would fetch them
+    """
+    urls = []
+    for repo in args.repos:
+        if repo in DLRN_TAG_REPOS:
+            urls.append(base_path + _get_dlrn_hash_tag(args, repo + "/delorean.repo"))
+            urls.append(_get_deps_url(args, base_path))
+        elif repo == "deps":
+            urls.append(_get_deps_url(args, base_path))
+        elif repo != "ceph":
+            raise InvalidArguments('Invalid repo "%s" specified' % repo)
+    unique_urls = []
+    for url in urls:
+        if url not in unique_urls:
+            unique_urls.append(url)
+    return unique_urls
+
+
+def _install_repos(args, base_path, cache=None, stage=None, output=print):
+    if cache is None:
+        cache = FetchCache(args)
+    cache.prefetch(_get_repo_urls(args, base_path))
+    deps_written = set()
+    written = []
+
+    def write(content, target, **kwargs):
+        if stage is not None:
+            written.append(stage.write(content, target, **kwargs))
+        else:
+            written.append(_write_repo(content, target, output=output, **kwargs))
+
     def install_deps(args, base_path):
+        url = _get_deps_url(args, base_path)
         if 'rhel' in args.distro:
-            content = _get_rhel_trunk_candidate_repos(args, base_path)
-            _write_repo(content, args.output_path, name="osp-trunk-candidate")
+            content = _get_rhel_trunk_candidate_repos(args, base_path, cache)
+            name = "osp-trunk-candidate"
+        else:
+            content = cache.get(url)
+            name = None
+        if url in deps_written:
+            return
+        deps_written.add(url)
+        if name:
+            write(content, args.output_path, name=name)
         else:
-            content = _get_repo(base_path + "delorean-deps.repo", args)
-            _write_repo(content, args.output_path)
+            write(content, args.output_path)
 
     for repo in args.repos:
         if repo == "current":
-            content = _get_repo(base_path + _get_dlrn_hash_tag(args, "current/delorean.repo"), args)
-            _write_repo(content, args.output_path, name="delorean")
+            content = cache.get(base_path + _get_dlrn_hash_tag(args, "current/delorean.repo"))
+            write(content, args.output_path, name="delorean")
             install_deps(args, base_path)
-        elif repo == "consistent":
-            content = _get_repo(base_path + _get_dlrn_hash_tag(args, "consistent/delorean.repo"), args)
-            _write_repo(content, args.output_path)
+        elif repo in DLRN_TAG_REPOS:
+            content = cache.get(base_path + _get_dlrn_hash_tag(args, repo + "/delorean.repo"))
+            write(content, args.output_path)
             install_deps(args, base_path)
         elif repo == "deps":
             install_deps(args, base_path)
-        elif repo == "current-podified":
-            content = _get_repo(base_path + _get_dlrn_hash_tag(args, "current-podified/delorean.repo"), args)
-            _write_repo(content, args.output_path)
-            install_deps(args, base_path)
-        elif repo == "podified-ci-testing":
-            content = _get_repo(base_path + _get_dlrn_hash_tag(args, "podified-ci-testing/delorean.repo"), args)
-            _write_repo(content, args.output_path)
-            install_deps(args, base_path)
-        elif repo == "podified-ci-testing-tcib":
-            content = _get_repo(base_path + _get_dlrn_hash_tag(args, "podified-ci-testing-tcib/delorean.repo"), args)
-            _write_repo(content, args.output_path)
-            install_deps(args, base_path)
         elif repo == "ceph":
             content = _create_ceph(args, "pacific")
-            _write_repo(content, args.output_path)
+            write(content, args.output_path)
         else:
             raise InvalidArguments('Invalid repo "%s" specified' % repo)
+    if cache.downloads or cache.hits:
+        output("Fetched %d repo file(s), %d cache hit(s)"
+               % (cache.downloads, cache.hits))
 
     distro = args.distro
     # CentOS-8 AppStream is required for UBI-8
     legacy_url = "centos/"
     if distro in ["ubi8", "ubi9"]:
         if not os.path.exists("/etc/distro.repos.d"):
-            print(
+            output(
                 "WARNING: For UBI it is recommended to create "
                 "/etc/distro.repos.d and rerun!"
             )
@@ -600,13 +1391,13 @@ def _install_repos(args, base_path):
             "legacy_url": legacy_url,
             "stream": distro_name,
         }
-        _write_repo(content, distro_path)
+        write(content, distro_path)
         content = BASE_REPO_TEMPLATE % {
             "mirror": args.mirror,
             "legacy_url": legacy_url,
             "stream": distro_name,
         }
-        _write_repo(content, distro_path)
+        write(content, distro_path)
         if distro in ["centos8", "centos9", "centos-10", "ubi8", "ubi9"]:
             distro = "centos" + str(distro[-1])
 
@@ -627,7 +1418,7 @@ def _install_repos(args, base_path):
                 "stream": stream,
                 "legacy_url": legacy_url,
             }
-            _write_repo(content, args.output_path)
+            write(content, args.output_path)
 
             content = POWERTOOLS_REPO_TEMPLATE % {
                 "mirror": args.mirror,
@@ -635,7 +1426,7 @@ def _install_repos(args, base_path):
                 "legacy_url": legacy_url,
                 "pt_name": pt_name,
             }
-            _write_repo(content, args.output_path)
+            write(content, args.output_path)
 
             if "9" in stream or "10" in stream:
                 content = APPSTREAM_REPO_TEMPLATE % {
@@ -644,33 +1435,378 @@ def _install_repos(args, base_path):
                     "legacy_url": legacy_url,
                     "stream": stream,
                 }
-                _write_repo(content, args.output_path)
+                write(content, args.output_path)
 
                 content = BASE_REPO_TEMPLATE % {
                     "mirror": args.mirror,
                     "legacy_url": legacy_url,
                     "stream": stream,
                 }
-                _write_repo(content, args.output_path)
+                write(content, args.output_path)
+    return written
+
 
+def _clean_repo_metadata(repo_ids, cache_dirs=None):
+    """Remove the cached dnf metadata of repo_ids only
 
-def _run_pkg_clean(distro):
+    `dnf clean metadata` drops the metadata of every repo on the host, so
+    the cache entries of the given repos are removed directly instead. Both
+    the dnf and dnf5 layouts are handled and downloaded packages are kept.
+    """
+    for cache_dir in cache_dirs or DNF_CACHE_DIRS:
+        try:
+            names = os.listdir(cache_dir)
+        except OSError:
+            continue
+        for repo_id in repo_ids:
+            # exact names only, delorean must not match delorean-current-...
+            entry_re = re.compile(DNF_CACHE_ENTRY_RE % re.escape(repo_id))
+            paths = []
+            for name in names:
+                match = entry_re.match(name)
+                if not match:
+                    continue
+                path = os.path.join(cache_dir, name)
+                if match.group(1):
+                    # keep the downloaded packages next to the metadata
+                    paths += [os.path.join(path, "repodata"),
+                              os.path.join(path, "solv")]
+                else:
+                    paths.append(path)
+            for path in paths:
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                elif os.path.exists(path):
+                    os.remove(path)
+
+
+def _run_pkg_clean(distro, repo_ids=None, output=print):
+    """Clean dnf metadata, only for repo_ids when they are given"""
+    if repo_ids is not None:
+        if not repo_ids:
+            output("No repo changed, skipping dnf metadata clean.")
+            return
+        output("Cleaning dnf metadata for: %s" % ", ".join(repo_ids))
+        _clean_repo_metadata(repo_ids)
+        return
     pkg_mgr = "dnf"
     try:
         subprocess.check_call([pkg_mgr, "clean", "metadata"])
     except subprocess.CalledProcessError:
-        print("ERROR: Failed to clean yum metadata.")
+        output("ERROR: Failed to clean yum metadata.")
         raise
 
 
+def _makecache(repo_id, timeout, reposdir=None):
+    start = time.monotonic()
+    error = None
+    cmd = ["dnf", "makecache"]
+    if reposdir:
+        cmd.append("--setopt=reposdir=%s" % reposdir)
+    cmd += ["--repo", repo_id]
+    try:
+        subprocess.run(
+            cmd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            timeout=timeout,
+            check=True,
+        )
+    except subprocess.TimeoutExpired:
+        error = "timed out after %ss" % timeout
+    except subprocess.CalledProcessError as e:
+        lines = (e.stderr or "").strip().splitlines()
+        error = lines[-1] if lines else "exit status %d" % e.returncode
+    except OSError as e:
+        error = str(e)
+    return PrewarmResult(repo_id, time.monotonic() - start, error)
+
+
+def _prewarm_metadata(repo_ids, workers=DEFAULT_PREWARM_WORKERS,
+                      timeout=DEFAULT_PREWARM_TIMEOUT, recorder=None,
+                      reposdir=None, output=print):
+    """Download the dnf metadata of repo_ids ahead of the next dnf command
+
+    Runs dnf makecache for up to workers repos at once, each killed after
+    timeout seconds. A failed repo only warns, dnf downloads its metadata
+    on first use as before.
+
+    :param reposdir: directory of the repo files defining repo_ids, by
+                     default the reposdir of the dnf configuration
+    :param output: function printing the messages, warnings go to stderr
+
+    returns: list of PrewarmResult, slowest first
+    """
+    if not repo_ids:
+        return []
+    # lazy import
+    from concurrent import futures
+
+    with futures.ThreadPoolExecutor(
+        max_workers=min(workers, len(repo_ids))
+    ) as executor:
+        results = list(
+            executor.map(
+                lambda repo_id: _makecache(repo_id, timeout, reposdir), repo_ids
+            )
+        )
+    results.sort(key=lambda result: result.seconds, reverse=True)
+    for result in results:
+        if recorder:
+            recorder.record_prewarm(result.repo_id, result.seconds, result.error)
+        if result.error:
+            print(
+                "WARNING: Failed to pre-warm dnf metadata of %s in %.3fs: %s"
+                % (result.repo_id, result.seconds, result.error),
+                file=sys.stderr,
+            )
+        else:
+            output(
+                "Pre-warmed dnf metadata of %s in %.3fs"
+                % (result.repo_id, result.seconds)
+            )
+    return results
+
+
+def _get_changed_repo_ids(written):
+    repo_ids = []
+    for repo in written:
+        if repo.changed:
+            repo_ids.extend(i for i in repo.repo_ids if i not in repo_ids)
+    return repo_ids
+
+
+def _prepare(args, distro_name, distro_major_version_id, recorder,
+             output=print):
+    """Validate args and select their mirrors
+
+    output: function printing the messages, print by default
+    returns: the base path of the RDO repos
+    """
+    with recorder.phase("validate"):
+        _validate_args(args, distro_name, distro_major_version_id)
+    with recorder.phase("select_mirrors"):
+        _select_mirrors(args, output=output)
+    return _get_base_path(args)
+
+
+def _run(args, distro_name, distro_major_version_id, recorder, stage=None,
+         check=False, cache=None, base_path=None, output=print):
+    """Install the repos of args, timing each phase with recorder
+
+    :param stage: a PlannedInstall the repo files go through, a
+                  StagedInstall with --staged and none otherwise by default
+    :param check: only plan the changes, the stage is never committed
+    :param cache: a FetchCache, possibly filled already
+    :param base_path: the base path returned by _prepare(), which is called
+                      when it is not given
+    :param output: function printing the messages of the run, which the
+                   stage commits with its own
+    returns: list of WrittenRepo and list of removed files
+    """
+    if base_path is None:
+        base_path = _prepare(
+            args, distro_name, distro_major_version_id, recorder, output
+        )
+    if stage is None and (args.staged or check):
+        # check mode writes nothing, not even to the staging directory
+        stage = PlannedInstall(output) if check else StagedInstall(output)
+    with recorder.phase("install"):
+        if stage is not None:
+            try:
+                written = _install_repos(
+                    args, base_path, cache=cache, stage=stage, output=output
+                )
+                if not check:
+                    stage.commit()
+            finally:
+                stage.cleanup()
+        else:
+            written = _install_repos(
+                args, base_path, cache=cache, output=output
+            )
+    with recorder.phase("remove_existing"):
+        keep = [repo.filename for repo in written]
+        if stage is not None:
+            stage.remove(_remove_existing(args, keep=keep, dry_run=True))
+        removed = _remove_existing(
+            args, keep=keep, dry_run=check, output=output
+        )
+    if check:
+        return written, removed
+    with recorder.phase("pkg_clean"):
+        _run_pkg_clean(
+            args.distro, _get_changed_repo_ids(written), output=output
+        )
+    if args.prewarm:
+        with recorder.phase("prewarm"):
+            _prewarm_metadata(
+                _get_changed_repo_ids(written),
+                args.prewarm_workers,
+                args.prewarm_timeout,
+                recorder,
+                reposdir=args.output_path,
+                output=output,
+            )
+    with recorder.phase("prune_store"):
+        _prune_content_store(args, output=output)
+    return written, removed
+
+
+def _prefetch_matrix(targets, recorder, output=print):
+    """Fetch the repo files of every target once and fill their caches
+
+    :param targets: list of (args, base_path) pairs returned by _prepare()
+    :param output: function printing the messages, print by default
+    returns: a FetchCache per target, holding its mirror injected content
+    """
+    urls = [_get_repo_urls(args, base_path) for args, base_path in targets]
+    # each url is fetched with the timeouts, retries, mirrors and caches of
+    # the first target requesting it
+    owners = collections.OrderedDict()
+    for (args, __), target_urls in zip(targets, urls):
+        for url in target_urls:
+            owners.setdefault(url, args)
+    # fetch as published, the mirrors injected differ between targets
+    shared = FetchCache(targets[0][0], fetch=_fetch_repo)
+    with recorder.phase("fetch"):
+        shared.prefetch(owners, args_of=owners.get)
+    caches = []
+    for (args, __), target_urls in zip(targets, urls):
+        cache = FetchCache(args)
+        for url in target_urls:
+            content = shared.get(url)
+            if content is not None:
+                cache.add(url, _inject_mirrors(content, args))
+        caches.append(cache)
+    total = sum(len(target_urls) for target_urls in urls)
+    output("Fetched %d repo file(s) for %d target(s), %d cache hit(s), "
+           "%d shared" % (shared.downloads, len(targets), shared.hits,
+                          total - len(owners)))
+    return caches
+
+
+def _load_matrix(path):
+    """Load the targets of a matrix file
+
+    The file, json or yaml, holds a list of targets, or a dict with the
+    list under targets and arguments common to every target under options.
+    Each target has repos and any other argument by its destination name,
+    e.g. distro, branch and output_path.
+
+    returns: list of target dicts
+    """
+    with open(path, "r") as f:
+        if path.endswith((".yaml", ".yml")):
+            # lazy import
+            import yaml
+
+            matrix = yaml.safe_load(f)
+        else:
+            # lazy import
+            import json
+
+            matrix = json.load(f)
+    options = {}
+    if isinstance(matrix, dict):
+        options = matrix.get("options") or {}
+        matrix = matrix.get("targets")
+    if not isinstance(matrix, list) or not all(
+        isinstance(target, dict) and target.get("repos") for target in matrix
+    ):
+        raise InvalidArguments(
+            "%s must hold a list of targets, each with repos" % path
+        )
+    return [dict(options, **target) for target in matrix]
+
+
+def _matrix_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="repo-setup matrix",
+        description="Install the repos of many targets, e.g. one per "
+        "distro, branch and output path, fetching every repo file once.",
+    )
+    parser.add_argument(
+        "matrix",
+        metavar="FILE",
+        help="json or yaml file with the list of targets.",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        default=False,
+        help="Only report what would change.",
+    )
+    parser.add_argument(
+        "--timings",
+        metavar="PATH",
+        default=os.environ.get(timings.TIMINGS_ENV) or None,
+        help="Write the json timings report to PATH, - for stderr.",
+    )
+    matrix_args = parser.parse_args(argv)
+    # lazy import, api builds on this module
+    try:
+        from repo_setup import api
+    except ImportError:
+        from ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup import (
+            api,
+        )
+
+    requests = [
+        api.InstallRequest(**target) for target in _load_matrix(matrix_args.matrix)
+    ]
+    results = api.install_matrix(requests, check=matrix_args.check)
+    for request, result in zip(requests, results):
+        print("Target %s:" % " ".join(request.argv()))
+        for message in result.messages:
+            print("  " + message)
+    if matrix_args.timings and results:
+        timings.write_report(results[0].timings, matrix_args.timings)
+    return results
+
+
 def main():
-    distro_id, distro_major_version_id, distro_name = _get_distro()
-    args = _parse_args(distro_id, distro_major_version_id)
-    _validate_args(args, distro_name, distro_major_version_id)
-    base_path = _get_base_path(args)
-    _remove_existing(args)
-    _install_repos(args, base_path)
-    _run_pkg_clean(args.distro)
+    if sys.argv[1:2] == ["matrix"]:
+        _matrix_main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["bundle"]:
+        # lazy import, bundle builds on this module
+        try:
+            from repo_setup import bundle
+        except ImportError:
+            from ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup import (
+                bundle,
+            )
+
+        bundle.main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["serve"]:
+        # lazy import, the proxy is only needed by this mode
+        try:
+            from repo_setup import serve
+        except ImportError:
+            from ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup import (
+                serve,
+            )
+
+        serve.main(sys.argv[2:])
+        return
+    recorder = timings.Timings()
+    with recorder.phase("get_distro"):
+        distro_id, distro_major_version_id, distro_name = _get_distro()
+    with recorder.phase("parse_args"):
+        args = _parse_args(distro_id, distro_major_version_id)
+    if args.timings:
+        args.recorder = recorder
+    try:
+        _run(args, distro_name, distro_major_version_id, recorder)
+    except Exception as e:
+        recorder.error = "%s: %s" % (type(e).__name__, e)
+        raise
+    finally:
+        if args.timings:
+            recorder.write(args.timings)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,168 @@
+#  Copyright 2021 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+#
+from __future__ import absolute_import, division, print_function
+
+import collections
+import json
+import os
+import sys
+import threading
+import time
+
+__metaclass__ = type
+
+DEFAULT_PROBE_TIMEOUT = 2.0
+DEFAULT_MIRROR_TTL = 3600
+# key of the RDO mirror candidates in a mirror config file
+RDO_MIRRORS_KEY = "rdo"
+
+MirrorProbe = collections.namedtuple(
+    "MirrorProbe", ["url", "seconds", "status", "error"]
+)
+
+
+def load_mirror_config(path):
+    """Load mirror candidates from a json file
+
+    The file maps a distro, e.g. centos9, or rdo to a list of mirror urls::
+
+        {"centos9": ["http://a.example.org", "http://b.example.org"],
+         "rdo": ["https://trunk.rdoproject.org"]}
+    """
+    with open(path, "r") as f:
+        config = json.load(f)
+    if not isinstance(config, dict) or not all(
+        isinstance(urls, list) for urls in config.values()
+    ):
+        raise ValueError("%s must map names to lists of mirror urls" % path)
+    return config
+
+
+def _probe(session, url, timeout):
+    start = time.monotonic()
+    try:
+        r = session.head(url, timeout=timeout, allow_redirects=True)
+    except Exception as e:
+        return MirrorProbe(url, time.monotonic() - start, None, str(e))
+    return MirrorProbe(url, time.monotonic() - start, r.status_code, None)
+
+
+def probe_mirrors(session, urls, deadline=DEFAULT_PROBE_TIMEOUT):
+    """Probe urls concurrently with HEAD requests
+
+    Probes still running when the deadline expires are reported as timed
+    out and their result is ignored.
+
+    :return: list of MirrorProbe in the order of urls
+    """
+    # lazy import
+    from concurrent import futures
+
+    executor = futures.ThreadPoolExecutor(max_workers=len(urls))
+    pending = [executor.submit(_probe, session, url, deadline) for url in urls]
+    futures.wait(pending, timeout=deadline)
+    executor.shutdown(wait=False)
+    probes = []
+    for url, future in zip(urls, pending):
+        if future.done():
+            probes.append(future.result())
+        else:
+            probes.append(MirrorProbe(url, deadline, None, "timed out"))
+    return probes
+
+
+def fastest_mirror(probes):
+    """Get the url of the fastest healthy probe, None if none is healthy"""
+    healthy = [
+        probe for probe in probes
+        if probe.status is not None and probe.status < 400
+    ]
+    if not healthy:
+        return None
+    return min(healthy, key=lambda probe: probe.seconds).url
+
+
+class MirrorCache:
+    """json file of the mirrors selected for each candidate list
+
+    Selections expire after ttl seconds so the candidates are probed again.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_MIRROR_TTL):
+        self.filename = os.path.join(path, "mirrors.json")
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(urls):
+        return " ".join(urls)
+
+    def _read(self):
+        try:
+            with open(self.filename, "r") as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def get(self, urls):
+        """Get the selected mirror for urls, None if unknown or expired"""
+        entry = self._read().get(self._key(urls))
+        if not entry or entry.get("expires", 0) < time.time():
+            return None
+        return entry.get("mirror")
+
+    def set(self, urls, mirror):
+        with self._lock:
+            data = self._read()
+            now = time.time()
+            data = dict(
+                (key, entry) for key, entry in data.items()
+                if entry.get("expires", 0) >= now
+            )
+            data[self._key(urls)] = {"mirror": mirror, "expires": now + self.ttl}
+            try:
+                dirname = os.path.dirname(self.filename)
+                try:
+                    os.makedirs(dirname)
+                except OSError:
+                    # another process may have just created it
+                    if not os.path.isdir(dirname):
+                        raise
+                tmp_name = "%s.%d.tmp" % (self.filename, os.getpid())
+                with open(tmp_name, "w") as f:
+                    json.dump(data, f)
+                os.rename(tmp_name, self.filename)
+            except (IOError, OSError) as e:
+                print(
+                    "WARNING: Failed to cache mirror selection: %s" % e,
+                    file=sys.stderr,
+                )
+
+
+def select_mirror(session, urls, deadline=DEFAULT_PROBE_TIMEOUT, cache=None):
+    """Select the fastest healthy mirror of urls
+
+    :return: tuple of the selected url, None if no mirror answered, and the
+             list of MirrorProbe, empty when the selection was cached
+    """
+    if cache:
+        mirror = cache.get(urls)
+        if mirror:
+            return mirror, []
+    probes = probe_mirrors(session, urls, deadline)
+    mirror = fastest_mirror(probes)
+    if mirror and cache:
+        cache.set(urls, mirror)
+    return mirror, probes
@@ -0,0 +1,163 @@
+#  Copyright 2021 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+#
+"""Rewrite the upstream urls of repo files to local mirrors
+
+A rewrite map is an ordered list of (prefix, mirror) pairs. Every url of a
+baseurl, mirrorlist, metalink or gpgkey option starting with a prefix gets
+that prefix replaced with its mirror. When several prefixes match a url the
+first one in the map wins.
+"""
+from __future__ import absolute_import, division, print_function
+
+import collections
+import json
+import os
+import re
+import threading
+
+__metaclass__ = type
+
+REWRITE_OPTIONS = ("baseurl", "mirrorlist", "metalink", "gpgkey")
+
+# the start of a line setting a rewritten option
+_OPTION_RE = re.compile(r"(?:%s)[ \t]*=" % "|".join(REWRITE_OPTIONS))
+# characters a url of an option value follows
+_SEPARATORS = " \t\n,="
+# what the first url of an option set on an unindented line follows
+_OPTION_STARTS = tuple("\n%s=" % option for option in REWRITE_OPTIONS)
+
+# path: (mtime, rewrites)
+_map_cache = {}
+_map_lock = threading.Lock()
+# the compiled rewriters kept, least recently used ones are dropped first
+MAX_REWRITERS = 64
+# tuple of rewrites: MirrorRewriter
+_rewriters = collections.OrderedDict()
+_rewriters_lock = threading.Lock()
+
+
+def load_rewrite_map(path):
+    """Load a rewrite map from a json file
+
+    The file is an object or a list of pairs, both keep their order::
+
+        {"https://trunk.rdoproject.org": "http://mirror.example.org/rdo",
+         "http://mirror.stream.centos.org": "http://mirror.example.org/c"}
+
+    Maps are cached until the file changes.
+
+    :return: list of (prefix, mirror) tuples
+    :raises ValueError: when the file is not a valid rewrite map
+    """
+    mtime = os.stat(path).st_mtime
+    with _map_lock:
+        cached = _map_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, "r") as f:
+        # objects are read as lists of pairs to keep their order
+        config = json.load(f, object_pairs_hook=list)
+    if not isinstance(config, list) or not all(
+        isinstance(pair, (list, tuple))
+        and len(pair) == 2
+        and all(isinstance(url, str) and url for url in pair)
+        for pair in config
+    ):
+        raise ValueError("%s must map url prefixes to mirror urls" % path)
+    rewrites = [tuple(pair) for pair in config]
+    with _map_lock:
+        _map_cache[path] = (mtime, rewrites)
+    return rewrites
+
+
+def _in_option(content, start):
+    """Whether a url starts at start in the value of a rewritten option"""
+    if start and content[start - 1] not in _SEPARATORS:
+        return False
+    line = content.rfind("\n", 0, start) + 1
+    # indented continuation lines belong to the option above them
+    while line and content[line] in " \t":
+        line = content.rfind("\n", 0, line - 1) + 1
+    match = _OPTION_RE.match(content, line)
+    return match is not None and match.end() <= start
+
+
+class MirrorRewriter:
+    """Rewrite map compiled into a single escaped alternation
+
+    rewrite() scans the content once for the prefixes and only looks at
+    the line of each match, so its cost hardly depends on the number of
+    prefixes.
+
+    The line of the usual match, the first url of an option set on an
+    unindented line, is recognized from the few characters before it
+    without looking for the start of the line.
+    """
+
+    def __init__(self, rewrites):
+        self.mirrors = {}
+        self.prefixes = []
+        for prefix, mirror in rewrites:
+            # an identity pair rewrites nothing, it must not shadow a later
+            # entry, e.g. --mirror on rhel where the base OS server is the
+            # default RDO one
+            if not prefix or prefix == mirror:
+                continue
+            # a prefix listed again is shadowed by its first entry
+            if prefix in self.mirrors:
+                continue
+            self.mirrors[prefix] = mirror
+            self.prefixes.append(prefix)
+        self._prefix_re = None
+        if self.prefixes:
+            self._prefix_re = re.compile(
+                "|".join(re.escape(prefix) for prefix in self.prefixes)
+            )
+
+    def _replace(self, match):
+        content, start = match.string, match.start()
+        if not (
+            content.endswith(_OPTION_STARTS, 0, start) or _in_option(content, start)
+        ):
+            return match.group(0)
+        return self.mirrors[match.group(0)]
+
+    def rewrite(self, content):
+        if self._prefix_re is None:
+            return content
+        return self._prefix_re.sub(self._replace, content)
+
+
+def get_rewriter(rewrites):
+    """Get the compiled MirrorRewriter of rewrites, compiled once per map
+
+    The last MAX_REWRITERS used maps are kept, so long running processes
+    seeing many mirrors do not grow without bound.
+    """
+    key = tuple(rewrites)
+    with _rewriters_lock:
+        rewriter = _rewriters.get(key)
+        if rewriter is not None:
+            _rewriters.move_to_end(key)
+            return rewriter
+    # compiled unlocked, a concurrent caller compiling the same map too
+    # gets the rewriter stored first
+    rewriter = MirrorRewriter(key)
+    with _rewriters_lock:
+        rewriter = _rewriters.setdefault(key, rewriter)
+        _rewriters.move_to_end(key)
+        while len(_rewriters) > MAX_REWRITERS:
+            _rewriters.popitem(last=False)
+    return rewriter
@@ -0,0 +1,612 @@
+#  Copyright 2021 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+#
+"""Local caching HTTP proxy of the repos for fleets of hosts
+
+repo-setup serve maps the first path component of each request to an
+upstream server, e.g. /rdo/centos9-master/current/delorean.repo is
+fetched from https://trunk.rdoproject.org/centos9-master/current/ and
+cached on disk. Concurrent requests for the same url are fetched once.
+
+Packages and DLRN hash or checksum addressed files never change and are
+served from the cache until evicted, other files, like .repo files and
+repomd.xml, are revalidated once they are older than the metadata ttl.
+The upstream urls of .repo files are rewritten to point back at the
+proxy, and /repo-setup/<repo>[,<repo>...]?distro=...&branch=... serves
+the repo files repo-setup renders, with the proxy as their mirrors.
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import collections
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+
+try:
+    from repo_setup import cache as http_cache
+    from repo_setup import main as repo_main
+    from repo_setup import rewrite
+    from repo_setup import session as http_session
+except ImportError:
+    from ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup import (
+        cache as http_cache,
+        main as repo_main,
+        rewrite,
+        session as http_session,
+    )
+
+__metaclass__ = type
+
+DEFAULT_PORT = 8080
+DEFAULT_PROXY_CACHE_MAX_SIZE = 10 * 1024 * 1024 * 1024
+DEFAULT_METADATA_TTL = 60
+CHUNK_SIZE = 64 * 1024
+# path of the rendered repo files, not an upstream name
+RENDER_PATH = "repo-setup"
+IMMUTABLE_SUFFIXES = (".rpm", ".drpm", ".iso")
+
+DEFAULT_UPSTREAMS = collections.OrderedDict(
+    [
+        ("rdo", repo_main.DEFAULT_RDO_MIRROR),
+        ("centos", "http://mirror.centos.org"),
+        ("centos-stream", "http://mirror.stream.centos.org"),
+    ]
+)
+
+
+class UpstreamError(Exception):
+    def __init__(self, status, message):
+        super(UpstreamError, self).__init__(message)
+        self.status = status
+
+
+def is_immutable_path(url):
+    """Whether the content of url never changes once published
+
+    That is packages, the checksum named files of repodata/ and DLRN hash
+    addressed paths. repomd.xml and .repo files do change.
+    """
+    path = url.split("?", 1)[0]
+    if path.endswith(IMMUTABLE_SUFFIXES):
+        return True
+    if "/repodata/" in path and not path.endswith("/repomd.xml"):
+        return True
+    return http_cache.is_immutable_url(path)
+
+
+class ProxyCache:
+    """On-disk cache of proxied bodies, evicted least recently used first
+
+    Like cache.HttpCache, each url has a json metadata file, holding its
+    validators, content type and fetch time, and a body file, but bodies
+    are bytes streamed to disk, so packages never sit in memory.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_PROXY_CACHE_MAX_SIZE):
+        self.path = os.path.join(path, "proxy")
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        http_cache._makedirs(self.path)
+
+    def _entry(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, key + ".json"), os.path.join(
+            self.path, key + ".body"
+        )
+
+    def _read_meta(self, url):
+        meta_file, body_file = self._entry(url)
+        with open(meta_file, "r") as f:
+            meta = json.load(f)
+        meta["body"] = body_file
+        return meta
+
+    def _write_meta(self, url, meta):
+        meta_file, __ = self._entry(url)
+        data = dict((key, value) for key, value in meta.items() if key != "body")
+        http_cache._atomic_write(meta_file, json.dumps(data).encode("utf-8"))
+
+    def lookup(self, url):
+        """Get the metadata of a cached url and mark it as recently used
+
+        :return: the metadata dict, with the body file as body, or None
+        """
+        try:
+            meta = self._read_meta(url)
+            if not os.path.exists(meta["body"]):
+                return None
+            os.utime(self._entry(url)[0], None)
+        except (IOError, OSError, ValueError):
+            return None
+        return meta
+
+    def store(self, url, response):
+        """Stream the body of a response to the cache, then evict if needed
+
+        :return: the metadata of url, see lookup()
+        """
+        # lazy import
+        import tempfile
+
+        meta_file, body_file = self._entry(url)
+        fd, tmp_name = tempfile.mkstemp(dir=self.path, prefix=".tmp-")
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    size += len(chunk)
+            os.rename(tmp_name, body_file)
+        except Exception:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            raise
+        meta = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "content_type": response.headers.get("Content-Type"),
+            "size": size,
+            "fetched": time.time(),
+        }
+        self._write_meta(url, meta)
+        self.evict(keep=meta_file)
+        meta["body"] = body_file
+        return meta
+
+    def refresh(self, url):
+        """Mark a cached url as just revalidated
+
+        :return: the metadata of url, see lookup()
+        """
+        meta = self._read_meta(url)
+        meta["fetched"] = time.time()
+        self._write_meta(url, meta)
+        return meta
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until under max_size
+
+        :param keep: metadata file of an entry never evicted, the one just
+                     stored, even when it is larger than max_size
+        """
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.path):
+                if not name.endswith(".json"):
+                    continue
+                meta_file = os.path.join(self.path, name)
+                body_file = meta_file[: -len(".json")] + ".body"
+                try:
+                    used = os.path.getmtime(meta_file)
+                    size = os.path.getsize(body_file)
+                except OSError:
+                    continue
+                total += size
+                if meta_file != keep:
+                    entries.append((used, size, meta_file, body_file))
+            entries.sort()
+            while entries and total > self.max_size:
+                __, size, meta_file, body_file = entries.pop(0)
+                # open bodies are still served in full after their removal
+                for filename in (meta_file, body_file):
+                    try:
+                        os.remove(filename)
+                    except OSError:
+                        pass
+                total -= size
+
+
+class _Flight:
+    """An upstream fetch other requests for the same url wait for"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.meta = None
+        self.error = None
+
+
+class RepoProxy:
+    """Fetch and cache upstream urls on behalf of the proxy clients
+
+    :param upstreams: ordered dict of the upstream url of each name
+    :param cache: a ProxyCache
+    :param metadata_ttl: seconds mutable files are served without
+                         revalidation
+    :param cache_dir: cache directory of the repo files renders fetch, the
+                      repo-setup default when None
+    """
+
+    def __init__(
+        self,
+        upstreams,
+        cache,
+        metadata_ttl=DEFAULT_METADATA_TTL,
+        public_url=None,
+        retries=http_session.DEFAULT_RETRIES,
+        pool_size=http_session.DEFAULT_POOL_SIZE,
+        cache_dir=None,
+    ):
+        self.upstreams = upstreams
+        self.cache = cache
+        self.metadata_ttl = metadata_ttl
+        self.public_url = public_url
+        self.retries = retries
+        self.pool_size = pool_size
+        self.cache_dir = cache_dir
+        # hit, miss, revalidated and deduplicated request counts
+        self.stats = collections.Counter()
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def upstream_url(self, path):
+        """Get the upstream url of a proxy path, None if its name is unknown"""
+        name, __, rest = path.lstrip("/").partition("/")
+        upstream = self.upstreams.get(name)
+        if upstream is None:
+            return None
+        return upstream.rstrip("/") + "/" + rest
+
+    def _is_fresh(self, url, meta):
+        if is_immutable_path(url):
+            return True
+        return time.time() - meta.get("fetched", 0) < self.metadata_ttl
+
+    def _fetch(self, url, meta):
+        headers = {}
+        if meta is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        response = http_session.get_with_retries(
+            http_session.get_session(self.pool_size),
+            [url],
+            headers=headers,
+            retries=self.retries,
+            stream=True,
+        )
+        try:
+            if response.status_code == 304 and meta is not None:
+                self._count("revalidated")
+                return self.cache.refresh(url)
+            if response.status_code != 200:
+                raise UpstreamError(
+                    response.status_code,
+                    "%s returned HTTP %d" % (url, response.status_code),
+                )
+            self._count("miss")
+            return self.cache.store(url, response)
+        finally:
+            response.close()
+
+    def fetch(self, url):
+        """Get the cached metadata of url, fetching it when needed
+
+        Concurrent calls for the same url wait for a single upstream fetch.
+
+        :return: the metadata dict, see ProxyCache.lookup()
+        :raises UpstreamError: when upstream answers with an error status
+        """
+        meta = self.cache.lookup(url)
+        if meta is not None and self._is_fresh(url, meta):
+            self._count("hit")
+            return meta
+        with self._lock:
+            flight = self._flights.get(url)
+            leader = flight is None
+            if leader:
+                flight = self._flights[url] = _Flight()
+        if not leader:
+            self._count("deduplicated")
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.meta
+        try:
+            flight.meta = self._fetch(url, meta)
+            return flight.meta
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[url]
+            flight.done.set()
+
+    def rewrite(self, content, public_url):
+        """Point the upstream urls of repo file content at the proxy"""
+        # the longest upstream wins when one is the prefix of another
+        rewrites = sorted(
+            (
+                (upstream.rstrip("/"), "%s/%s" % (public_url, name))
+                for name, upstream in self.upstreams.items()
+            ),
+            key=lambda pair: -len(pair[0]),
+        )
+        return rewrite.get_rewriter(rewrites).rewrite(content)
+
+    def _proxy_mirror(self, upstream, public_url):
+        for name, url in self.upstreams.items():
+            if url.rstrip("/") == upstream:
+                return "%s/%s" % (public_url, name)
+        return None
+
+    def render(self, repos, public_url, distro=None, branch=None):
+        """Get the repo files repo-setup renders for repos, concatenated
+
+        Their mirrors are the proxy, so the repo files are fetched through
+        it too.
+
+        :raises InvalidArguments: when the repos or options are not valid
+        :raises IOError, DeadlineExceeded or RepoChecksumError: when the
+                repo files cannot be fetched
+        """
+        # lazy imports, only renders need them
+        import tempfile
+
+        try:
+            from repo_setup import api
+        except ImportError:
+            from ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup import (
+                api,
+            )
+
+        mirror = None
+        default_mirror = repo_main.DEFAULT_MIRROR_MAP.get(distro)
+        if default_mirror:
+            mirror = self._proxy_mirror(default_mirror, public_url)
+        rdo_mirror = self._proxy_mirror(repo_main.DEFAULT_RDO_MIRROR, public_url)
+        options = {}
+        if self.cache_dir:
+            options["cache_dir"] = self.cache_dir
+        output_path = tempfile.mkdtemp(prefix="repo-setup-serve-")
+        try:
+            request = api.InstallRequest(
+                repos,
+                distro=distro,
+                branch=branch,
+                output_path=output_path,
+                mirror=mirror,
+                rdo_mirror=rdo_mirror,
+                **options
+            )
+            result = api.install(request, check=True)
+        finally:
+            shutil.rmtree(output_path, ignore_errors=True)
+        content = "\n".join(diff["after"] for diff in result.diffs if diff["after"])
+        return self.rewrite(content, public_url)
+
+
+def _get_handler_class():
+    # lazy import
+    from http import server
+    from urllib import parse
+
+    class ProxyHandler(server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status, content_type, size, body=None, head=False):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type or "application/octet-stream")
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            if not head and body is not None:
+                self.wfile.write(body)
+
+        def _render(self, path, query, head):
+            params = parse.parse_qs(query)
+            repos = path[len(RENDER_PATH) + 2:]
+            if repos.endswith(".repo"):
+                repos = repos[: -len(".repo")]
+            try:
+                content = self.server.proxy.render(
+                    [repo for repo in repos.split(",") if repo],
+                    self.server.public_url,
+                    distro=params.get("distro", [None])[0],
+                    branch=params.get("branch", [None])[0],
+                )
+            except repo_main.InvalidArguments as e:
+                self.send_error(400, str(e))
+                return
+            except (
+                IOError,
+                http_session.DeadlineExceeded,
+                repo_main.RepoChecksumError,
+            ) as e:
+                # requests exceptions, HTTPError included, are IOErrors
+                self.send_error(502, str(e))
+                return
+            body = content.encode("utf-8")
+            self._send(200, "text/plain; charset=utf-8", len(body), body, head)
+
+        def _serve(self, head=False):
+            path, __, query = self.path.partition("?")
+            path = parse.unquote(path)
+            if path.startswith("/%s/" % RENDER_PATH):
+                self._render(path, query, head)
+                return
+            proxy = self.server.proxy
+            url = proxy.upstream_url(path)
+            if url is None:
+                self.send_error(404, "Unknown upstream")
+                return
+            if query:
+                url += "?" + query
+            try:
+                meta = proxy.fetch(url)
+            except UpstreamError as e:
+                self.send_error(e.status, str(e))
+                return
+            except (IOError, http_session.DeadlineExceeded) as e:
+                self.send_error(502, str(e))
+                return
+            try:
+                body = open(meta["body"], "rb")
+            except (IOError, OSError):
+                # evicted before it could be served
+                self.send_error(503, "Evicted, try again")
+                return
+            with body:
+                if path.endswith(".repo"):
+                    data = body.read().decode("utf-8")
+                    data = proxy.rewrite(data, self.server.public_url).encode("utf-8")
+                    self._send(200, meta.get("content_type"), len(data), data, head)
+                    return
+                size = os.fstat(body.fileno()).st_size
+                self._send(200, meta.get("content_type"), size, head=True)
+                if not head:
+                    shutil.copyfileobj(body, self.wfile, CHUNK_SIZE)
+
+        def do_GET(self):
+            self._serve()
+
+        def do_HEAD(self):
+            self._serve(head=True)
+
+    return ProxyHandler
+
+
+def _get_public_url(server_address):
+    """Get the base url of the proxy listening on server_address
+
+    Never derived from the request headers: a client sending its own Host
+    header would get repo files pointing wherever it asked for.
+    """
+    host, port = server_address[:2]
+    if host in ("", "0.0.0.0", "::"):
+        # lazy import
+        import socket
+
+        host = socket.getfqdn()
+    return "http://%s:%d" % (host, port)
+
+
+def make_server(proxy, bind="127.0.0.1", port=DEFAULT_PORT):
+    """Create the threaded HTTP server of proxy, call serve_forever() on it"""
+    # lazy import
+    from http import server
+
+    httpd = server.ThreadingHTTPServer((bind, port), _get_handler_class())
+    httpd.daemon_threads = True
+    httpd.proxy = proxy
+    httpd.public_url = (
+        proxy.public_url or _get_public_url(httpd.server_address)
+    ).rstrip("/")
+    return httpd
+
+
+def _parse_upstreams(values):
+    upstreams = collections.OrderedDict(DEFAULT_UPSTREAMS)
+    for value in values or []:
+        name, sep, url = value.partition("=")
+        if not sep or not name or "/" in name or name == RENDER_PATH or not url:
+            raise ValueError("--upstream must be NAME=URL, got %s" % value)
+        upstreams[name] = url.rstrip("/")
+    return upstreams
+
+
+def main(argv):
+    """repo-setup serve entry point"""
+    parser = argparse.ArgumentParser(
+        prog="repo-setup serve",
+        description="Run a local caching HTTP proxy of the RDO and base OS "
+        "repos. /NAME/PATH is fetched from PATH of the NAME upstream, and "
+        "/%s/REPO[,REPO...]?distro=DISTRO&branch=BRANCH serves the repo "
+        "files repo-setup renders, pointing at the proxy." % RENDER_PATH,
+    )
+    parser.add_argument(
+        "--bind", default="127.0.0.1", help="Address to listen on."
+    )
+    parser.add_argument(
+        "--port", type=int, default=DEFAULT_PORT, help="Port to listen on."
+    )
+    parser.add_argument(
+        "--upstream",
+        action="append",
+        metavar="NAME=URL",
+        help="Serve URL under /NAME/, can be repeated. Defaults to %s."
+        % ", ".join("%s=%s" % item for item in DEFAULT_UPSTREAMS.items()),
+    )
+    parser.add_argument(
+        "--public-url",
+        help="Base url of the proxy in rewritten repo files, by default "
+        "http://BIND:PORT, with the host name when listening on every "
+        "address.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=http_cache.DEFAULT_CACHE_DIR,
+        help="Directory of the proxy cache.",
+    )
+    parser.add_argument(
+        "--cache-max-size",
+        type=int,
+        default=DEFAULT_PROXY_CACHE_MAX_SIZE,
+        help="Maximum size in bytes of the proxy cache, least recently used "
+        "files are evicted first.",
+    )
+    parser.add_argument(
+        "--metadata-ttl",
+        type=int,
+        default=DEFAULT_METADATA_TTL,
+        help="Seconds repo files and repomd.xml are served from the cache "
+        "before being revalidated upstream.",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=http_session.DEFAULT_RETRIES,
+        help="Number of retries of failed upstream requests.",
+    )
+    args = parser.parse_args(argv)
+    try:
+        upstreams = _parse_upstreams(args.upstream)
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        cache = ProxyCache(args.cache_dir, args.cache_max_size)
+    except OSError as e:
+        print("ERROR: Cannot create the proxy cache: %s" % e, file=sys.stderr)
+        sys.exit(1)
+    proxy = RepoProxy(
+        upstreams,
+        cache,
+        metadata_ttl=args.metadata_ttl,
+        public_url=args.public_url,
+        retries=args.retries,
+        cache_dir=args.cache_dir,
+    )
+    httpd = make_server(proxy, args.bind, args.port)
+    print("Serving %s on http://%s:%d" % (
+        ", ".join("/%s/ from %s" % item for item in upstreams.items()),
+        args.bind,
+        args.port,
+    ))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
@@ -0,0 +1,144 @@
+#  Copyright 2021 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+#
+from __future__ import absolute_import, division, print_function
+
+import threading
+import time
+
+__metaclass__ = type
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 60.0
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0
+MAX_BACKOFF = 30.0
+# responses worth retrying, anything else is returned to the caller
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+DEFAULT_HEADERS = {
+    "Accept-Encoding": "gzip, deflate",
+    "Connection": "keep-alive",
+}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(pool_size=DEFAULT_POOL_SIZE):
+    """Get the shared keep-alive HTTP session for this process
+
+    Sessions are created once per pool size and reused by every fetch, so
+    repeated downloads from the same mirror share pooled TCP/TLS
+    connections instead of opening a new one per file.
+
+    :param pool_size: maximum number of pooled connections per host
+    :return: a requests.Session
+    """
+    with _sessions_lock:
+        session = _sessions.get(pool_size)
+        if session is None:
+            # lazy import
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update(DEFAULT_HEADERS)
+            _sessions[pool_size] = session
+    return session
+
+
+def close_sessions():
+    """Close every shared session and drop its pooled connections"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def backoff_delay(attempt, backoff=DEFAULT_BACKOFF):
+    """Get the full jitter exponential backoff delay before retry attempt"""
+    # lazy import
+    import random
+
+    return random.uniform(0, min(MAX_BACKOFF, backoff * 2 ** attempt))
+
+
+def get_with_retries(
+    session,
+    urls,
+    headers=None,
+    timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+    retries=DEFAULT_RETRIES,
+    backoff=DEFAULT_BACKOFF,
+    deadline=None,
+    on_retry=None,
+    **kwargs
+):
+    """GET the first of urls that answers, retrying transient failures
+
+    Each url is tried retries + 1 times with exponential backoff and jitter
+    between attempts on connection errors, timeouts and RETRY_STATUSES
+    responses, then the next url is tried as a failover.
+
+    :param urls: the url followed by its failover urls
+    :param deadline: time.monotonic() value no request may go past
+    :param on_retry: called with (url, attempt, reason, delay, failover) on
+                     each retry, failover is the next url on a failover
+    :param kwargs: more session.get arguments, e.g. stream=True
+    :return: the last response, when every attempt failed with a status
+    :raises DeadlineExceeded: when the deadline expires
+    """
+    response = None
+    error = None
+    for index, url in enumerate(urls):
+        for attempt in range(retries + 1):
+            request_timeout = timeout
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise DeadlineExceeded("Deadline exceeded fetching %s" % url)
+                request_timeout = tuple(min(t, remaining) for t in timeout)
+            try:
+                response = session.get(
+                    url, headers=headers, timeout=request_timeout, **kwargs
+                )
+            except IOError as e:
+                # requests exceptions are IOErrors
+                error, response = e, None
+                reason = str(e)
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                error = None
+                reason = "HTTP %d" % response.status_code
+            if attempt < retries:
+                delay = backoff_delay(attempt, backoff)
+                if deadline is not None:
+                    delay = min(delay, max(0, deadline - time.monotonic()))
+                if on_retry:
+                    on_retry(url, attempt + 1, reason, delay, None)
+                time.sleep(delay)
+            elif index + 1 < len(urls) and on_retry:
+                on_retry(url, attempt + 1, reason, 0, urls[index + 1])
+    if error is not None:
+        raise error
+    return response
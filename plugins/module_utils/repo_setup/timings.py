@@ -0,0 +1,135 @@
+#  Copyright 2021 Red Hat, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+#
+from __future__ import absolute_import, division, print_function
+
+import contextlib
+import json
+import sys
+import threading
+import time
+
+__metaclass__ = type
+
+# Environment variable enabling the timings report, same values as --timings
+TIMINGS_ENV = "REPO_SETUP_TIMINGS"
+
+
+class Timings:
+    """Record the wall time of each phase of a run and of each fetched url
+
+    The report is a json document with a list of phases, a list of
+    fetches, each fetch with its HTTP status, body size in bytes and how
+    the caches answered it, a list of mirror probes, a list of retried
+    or failed over downloads and a list of dnf metadata pre-warms.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.phases = []
+        self.fetches = []
+        self.probes = []
+        self.retries = []
+        self.prewarms = []
+        self.error = None
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time the body of the with statement as phase name"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases.append(
+                    {"name": name, "seconds": round(time.monotonic() - start, 6)}
+                )
+
+    def record_fetch(self, url, seconds, status=None, size=0, cache=None):
+        """Record one fetched url
+
+        :param size: bytes downloaded, 0 for the cache hits
+        :param cache: miss, revalidated, immutable, md5, run or bypass
+        """
+        with self._lock:
+            self.fetches.append(
+                {
+                    "url": url,
+                    "seconds": round(seconds, 6),
+                    "status": status,
+                    "bytes": size,
+                    "cache": cache,
+                }
+            )
+
+    def record_probe(self, url, seconds, status=None, error=None):
+        """Record one mirror probe"""
+        with self._lock:
+            self.probes.append(
+                {
+                    "url": url,
+                    "seconds": round(seconds, 6),
+                    "status": status,
+                    "error": error,
+                }
+            )
+
+    def record_retry(self, url, attempt, reason, delay=0, failover=None):
+        """Record a failed attempt followed by a retry or a failover"""
+        with self._lock:
+            self.retries.append(
+                {
+                    "url": url,
+                    "attempt": attempt,
+                    "reason": reason,
+                    "delay": round(delay, 6),
+                    "failover": failover,
+                }
+            )
+
+    def record_prewarm(self, repo_id, seconds, error=None):
+        """Record the dnf makecache of one repo"""
+        with self._lock:
+            self.prewarms.append(
+                {"repo_id": repo_id, "seconds": round(seconds, 6), "error": error}
+            )
+
+    def report(self):
+        with self._lock:
+            return {
+                "started": self.started,
+                "seconds": round(time.monotonic() - self._start, 6),
+                "phases": list(self.phases),
+                "fetches": list(self.fetches),
+                "probes": list(self.probes),
+                "retries": list(self.retries),
+                "prewarms": list(self.prewarms),
+                "error": self.error,
+            }
+
+    def write(self, target):
+        """Write the json report to target, see write_report()"""
+        write_report(self.report(), target)
+
+
+def write_report(report, target):
+    """Write a json report to target, a file path or - for stderr"""
+    data = json.dumps(report, indent=2, sort_keys=True)
+    if target == "-":
+        print(data, file=sys.stderr)
+    else:
+        with open(target, "w") as f:
+            f.write(data + "\n")
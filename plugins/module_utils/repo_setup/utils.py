@@ -15,43 +15,51 @@
 from __future__ import absolute_import, division, print_function
 
 import logging
+import os
 import sys
+import threading
 
 __metaclass__ = type
 
+OS_RELEASE_PATH = "/etc/os-release"
+UBI_REPO_PATH = "/etc/yum.repos.d/ubi.repo"
+
+_os_release_cache = {}
+_os_release_lock = threading.Lock()
+
 # portable http_get that uses either ansible recommended way or python native
 # urllib. Also deals with python2 vs python3 for centos7 train jobs.
+# The url opener is only imported on first use since ansible and urllib are
+# slow to import and most callers never fetch anything.
 py_version = sys.version_info.major
-if py_version < 3:
-    import urllib2
+_url_openers = []
 
-    def http_get(url):
-        try:
-            response = urllib2.urlopen(url)
-            return (response.read().decode("utf-8"), int(response.code))
-        except Exception as e:
-            return (str(e), -1)
 
-else:
-    try:
-        from ansible.module_utils.urls import open_url
+def _get_url_opener():
+    if not _url_openers:
+        if py_version < 3:
+            import urllib2
 
-        def http_get(url):
+            _url_openers.append(urllib2.urlopen)
+        else:
             try:
-                response = open_url(url, method="GET")
-                return (response.read().decode("utf-8"), response.status)
-            except Exception as e:
-                return (str(e), -1)
+                from ansible.module_utils.urls import open_url
 
-    except ImportError:
-        from urllib.request import urlopen
+                _url_openers.append(lambda url: open_url(url, method="GET"))
+            except ImportError:
+                from urllib.request import urlopen
+
+                _url_openers.append(urlopen)
+    return _url_openers[0]
 
-        def http_get(url):
-            try:
-                response = urlopen(url)
-                return (response.read().decode("utf-8"), int(response.status))
-            except Exception as e:
-                return (str(e), -1)
+
+def http_get(url):
+    try:
+        response = _get_url_opener()(url)
+        status = getattr(response, "status", None) or response.code
+        return (response.read().decode("utf-8"), int(status))
+    except Exception as e:
+        return (str(e), -1)
 
 
 def load_logging(level=logging.INFO, module_name="repo-setup"):
@@ -72,3 +80,82 @@ def load_logging(level=logging.INFO, module_name="repo-setup"):
             handler.setFormatter(formatter)
             logger.addHandler(handler)
     logger.setLevel(level)
+
+
+def _unquote_os_release_value(value):
+    """Unquote an os-release value the way a POSIX shell would.
+
+    Single quotes are literal, inside double quotes a backslash only
+    escapes $, `, " and \\, and outside quotes it escapes any character.
+    """
+    result = []
+    quote = None
+    chars = iter(value)
+    for char in chars:
+        if quote is None and char in "\"'":
+            quote = char
+        elif char == quote:
+            quote = None
+        elif char == "\\" and quote != "'":
+            escaped = next(chars, "")
+            if quote == '"' and escaped not in '$`"\\':
+                result.append(char)
+            result.append(escaped)
+        else:
+            result.append(char)
+    return "".join(result)
+
+
+def parse_os_release(path=OS_RELEASE_PATH):
+    """Parse an os-release file without forking a shell.
+
+    Results are cached per path and file modification time, so repeated
+    calls in the same process only cost a stat.
+
+    :param path: path of the os-release file
+    :return: dict of the os-release variables, empty if path is missing
+    """
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return {}
+    with _os_release_lock:
+        cached = _os_release_cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            return dict(cached[1])
+    values = {}
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#") or "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            values[key.strip()] = _unquote_os_release_value(value.strip())
+    with _os_release_lock:
+        _os_release_cache[path] = (mtime, values)
+    return dict(values)
+
+
+def get_distro_info():
+    """Get distro info from os-release file.
+
+    :return: distro_id, distro_major_version_id and distro_name
+    """
+    if not os.path.exists(OS_RELEASE_PATH):
+        import platform
+
+        return platform.system(), "unknown", "unknown"
+
+    os_release = parse_os_release(OS_RELEASE_PATH)
+    # distro_id and distro_version_id will always be at least an empty string
+    distro_id = os_release.get("ID", "")
+    distro_name = os_release.get("NAME", "")
+    # if distro_version_id is empty string the major version will be empty
+    # string too
+    distro_major_version_id = os_release.get("VERSION_ID", "").split(".")[0]
+
+    # check if that is UBI subcase?
+    if os.path.exists(UBI_REPO_PATH):
+        distro_id = "ubi"
+
+    return distro_id, distro_major_version_id, distro_name
@@ -19,7 +19,6 @@ import sys
 
 from repo_setup.utils import load_logging
 import repo_setup.yum_config.constants as const
-import repo_setup.yum_config.yum_config as cfg
 import repo_setup.yum_config.utils as utils
 
 
@@ -216,6 +215,8 @@ def main():
         logging.debug("Logging level set to DEBUG")
 
     if args.command == "repo":
+        import repo_setup.yum_config.yum_config as cfg
+
         set_dict = options_to_dict(args.set_opts)
         config_obj = cfg.YumRepoConfig(
             dir_path=args.config_dir_path, environment_file=args.env_file
@@ -252,6 +253,8 @@ def main():
         dnf_method(args.name, stream=args.stream, profile=args.profile)
 
     elif args.command == "global":
+        import repo_setup.yum_config.yum_config as cfg
+
         set_dict = options_to_dict(args.set_opts)
         config_obj = cfg.YumGlobalConfig(
             file_path=args.config_file_path, environment_file=args.env_file
@@ -261,6 +264,7 @@ def main():
 
     elif args.command == "enable-compose-repos":
         import repo_setup.yum_config.compose_repos as compose_repos
+        import repo_setup.yum_config.yum_config as cfg
 
         repo_obj = compose_repos.YumComposeRepoConfig(
             args.compose_url,
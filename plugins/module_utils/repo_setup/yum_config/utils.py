@@ -12,40 +12,18 @@
 #  License for the specific language governing permissions and limitations
 #  under the License.
 from __future__ import absolute_import, division, print_function
-import os
-import platform
-import subprocess
+
+try:
+    import repo_setup.utils as repos_utils
+except ImportError:
+    import ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup.utils as repos_utils
 
 __metaclass__ = type
 
 
-# TODO(dviroel): Merge in a utils file when refactoring repo-setup.
 def get_distro_info():
     """Get distro info from os-release file.
 
     :return: distro_id, distro_major_version_id and distro_name
     """
-    if not os.path.exists("/etc/os-release"):
-        return platform.system(), "unknown", "unknown"
-
-    output = subprocess.Popen(
-        'source /etc/os-release && echo -e -n "$ID\n$VERSION_ID\n$NAME"',
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=open(os.devnull, "w"),
-        executable="/bin/bash",
-        universal_newlines=True,
-    ).communicate()
-
-    # distro_id and distro_version_id will always be at least an empty string
-    distro_id, distro_version_id, distro_name = output[0].split("\n")
-
-    # if distro_version_id is empty string the major version will be empty
-    # string too
-    distro_major_version_id = distro_version_id.split(".")[0]
-
-    # check if that is UBI subcase?
-    if os.path.exists("/etc/yum.repos.d/ubi.repo"):
-        distro_id = "ubi"
-
-    return distro_id, distro_major_version_id, distro_name
+    return repos_utils.get_distro_info()
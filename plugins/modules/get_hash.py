@@ -48,6 +48,21 @@ options:
         required: false
         type: str
         default: None
+    cache_ttl:
+        description:
+          - Seconds a cached hash is used without asking the DLRN server,
+            older ones are revalidated with a conditional request. The
+            cache in /var/cache/repo-setup/hashes, or
+            ~/.cache/repo-setup/hashes when not run as root, is shared with
+            the repo-setup-get-hash command.
+        required: false
+        type: int
+        default: 300
+    no_cache:
+        description: Always fetch the hashes from the DLRN server
+        required: false
+        type: bool
+        default: false
 
 
 author:
@@ -61,6 +76,12 @@ EXAMPLES = r"""
     release: victoria
     component: tripleo
     dlrn_url: 'https://foo.bar.baz'
+
+- name: Get the current-podified hash, at most 10 minutes old
+  repo_setup_get_hash:
+    os_version: centos9
+    tag: current-podified
+    cache_ttl: 600
 """
 
 RETURN = r"""
@@ -115,7 +136,8 @@ def run_module():
             type="str", required=False, default="https://trunk.rdoproject.org"
         ),
         dlrn_hash_tag=dict(type="str", required=False, default=None),
-
+        cache_ttl=dict(type="int", required=False, default=300),
+        no_cache=dict(type="bool", required=False, default=False),
     )
 
     module = AnsibleModule(argument_spec, supports_check_mode=False)
@@ -124,15 +146,22 @@ def run_module():
         from ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup.get_hash.hash_info import (
             HashInfo,
         )
+        from ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup.get_hash.hash_cache import (
+            get_hash_cache,
+        )
 
         os_version = module.params.get("os_version")
         release = module.params.get("release")
         component = module.params.get("component")
         tag = module.params.get("tag")
         dlrn_url = module.params.get("dlrn_url")
+        cache = None
+        if not module.params.get("no_cache"):
+            cache = get_hash_cache(ttl=module.params.get("cache_ttl"))
 
         hash_result = HashInfo(
-            os_version, release, component, tag, config={"dlrn_url": dlrn_url}
+            os_version, release, component, tag, config={"dlrn_url": dlrn_url},
+            cache=cache,
         )
         result["commit_hash"] = hash_result.commit_hash
         result["distro_hash"] = hash_result.distro_hash
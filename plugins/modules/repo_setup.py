@@ -0,0 +1,197 @@
+#!/usr/bin/python
+# Copyright 2021 Red Hat, Inc.
+# GNU General Public License v3.0+ (see COPYING or
+# https://www.gnu.org/licenses/gpl-3.0.txt)
+from __future__ import absolute_import, division, print_function
+
+
+__metaclass__ = type
+
+
+DOCUMENTATION = r"""
+---
+module: repo_setup
+
+short_description: Install the RDO and base OS repo files
+
+version_added: "1.0.0"
+
+description:
+    - Install the repo files repo-setup would install, without running the
+      console script.
+    - Repo files are only written when their content changes, and old
+      delorean repo files are removed.
+    - Supports check mode and diff mode.
+
+options:
+    repos:
+        description: The repos to install, e.g. current-podified or ceph
+        required: true
+        type: list
+        elements: str
+    distro:
+        description: Target distro, e.g. centos9, detected when not set
+        required: false
+        type: str
+    branch:
+        description: The lowercase name of the OpenStack release
+        required: false
+        type: str
+        default: master
+    output_path:
+        description: Directory in which to save the repo files
+        required: false
+        type: path
+        default: /etc/yum.repos.d
+    mirror:
+        description: Server from which to install base OS packages
+        required: false
+        type: str
+    rdo_mirror:
+        description: Server from which to install RDO packages
+        required: false
+        type: str
+    dlrn_hash_tag:
+        description: Generate DLRN repos using this DLRN hash
+        required: false
+        type: str
+    staged:
+        description: Move the changed repo files into place with atomic renames
+        required: false
+        type: bool
+        default: false
+    options:
+        description:
+            - Any other repo-setup argument by its destination name, e.g.
+              max_workers or rdo_fallback_mirrors
+        required: false
+        type: dict
+        default: {}
+
+author:
+    - Red Hat
+"""
+
+EXAMPLES = r"""
+- name: Install the current-podified repos for centos9
+  repo_setup.repos.repo_setup:
+    repos:
+      - current-podified
+    distro: centos9
+  notify: Refresh the dnf metadata cache
+"""
+
+RETURN = r"""
+files:
+    description: The repo files produced by the run
+    type: list
+    elements: dict
+    returned: always
+    sample:
+        - path: /etc/yum.repos.d/delorean.repo
+          repo_ids: [delorean-component-baremetal]
+          changed: true
+removed:
+    description: The old repo files removed by the run
+    type: list
+    elements: str
+    returned: always
+    sample: ['/etc/yum.repos.d/delorean-current-podified.repo']
+changed_repo_ids:
+    description: The ids of the repos whose file changed
+    type: list
+    elements: str
+    returned: always
+    sample: ['delorean-component-baremetal']
+fetched:
+    description: The fetched urls with their status, size and time
+    type: list
+    elements: dict
+    returned: always
+"""
+
+from ansible.module_utils.basic import AnsibleModule  # noqa: E402
+
+
+def run_module():
+    result = dict(
+        changed=False,
+        files=[],
+        removed=[],
+        changed_repo_ids=[],
+        fetched=[],
+    )
+
+    argument_spec = dict(
+        repos=dict(type="list", required=True, elements="str"),
+        distro=dict(type="str", required=False, default=None),
+        branch=dict(type="str", required=False, default="master"),
+        output_path=dict(
+            type="path", required=False, default="/etc/yum.repos.d"
+        ),
+        mirror=dict(type="str", required=False, default=None),
+        rdo_mirror=dict(type="str", required=False, default=None),
+        dlrn_hash_tag=dict(type="str", required=False, default=None),
+        staged=dict(type="bool", required=False, default=False),
+        options=dict(type="dict", required=False, default={}),
+    )
+
+    module = AnsibleModule(argument_spec, supports_check_mode=True)
+
+    try:
+        try:
+            from ansible_collections.repo_setup.repos.plugins.module_utils.repo_setup import (
+                api,
+            )
+        except ImportError:
+            from repo_setup import api
+
+        request = api.InstallRequest(
+            module.params["repos"],
+            distro=module.params["distro"],
+            branch=module.params["branch"],
+            output_path=module.params["output_path"],
+            mirror=module.params["mirror"],
+            rdo_mirror=module.params["rdo_mirror"],
+            dlrn_hash_tag=module.params["dlrn_hash_tag"],
+            staged=module.params["staged"],
+            **module.params["options"]
+        )
+        install = api.install(request, check=module.check_mode)
+    except Exception as exc:
+        result["msg"] = "Failed to install repos: %s" % exc
+        module.fail_json(**result)
+
+    changed_repo_ids = []
+    for repo in install.written:
+        result["files"].append(
+            dict(path=repo.filename, repo_ids=repo.repo_ids, changed=repo.changed)
+        )
+        if repo.changed:
+            changed_repo_ids.extend(
+                i for i in repo.repo_ids if i not in changed_repo_ids
+            )
+    result["removed"] = install.removed
+    result["changed_repo_ids"] = changed_repo_ids
+    result["fetched"] = install.fetched
+    result["changed"] = bool(install.changed or install.removed)
+    if module._diff:
+        result["diff"] = [
+            dict(
+                before_header=diff["path"],
+                after_header=diff["path"],
+                before=diff["before"],
+                after=diff["after"],
+            )
+            for diff in install.diffs
+        ]
+
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
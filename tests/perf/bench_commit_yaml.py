@@ -0,0 +1,87 @@
+#   Copyright 2021 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+"""Compare getting the first commit of a large multi-commit commit.yaml by
+loading it whole with yaml.safe_load, as HashInfo used to, with the
+streaming HashInfo._first_commit(), with libyaml and without it.
+
+    python -m tests.perf.bench_commit_yaml [--number N] [--commits N]
+"""
+
+import argparse
+import timeit
+from unittest import mock
+
+import yaml
+
+from repo_setup.get_hash.hash_info import HashInfo
+
+COMMIT = """- artifacts: repos/component/common/%(h)s/openstack-c%(i)d.src.rpm,repos/component/common/%(h)s/python3-c%(i)d.noarch.rpm
+  civotes: '[]'
+  commit_branch: master
+  commit_hash: %(h)s
+  component: common
+  distgit_dir: /home/centos9-master-uc/data/openstack-c%(i)d_distro/
+  distro_hash: %(d)s
+  dt_build: '1616646776'
+  dt_commit: '1616646661.0'
+  dt_distro: '1616411951'
+  dt_extended: '0'
+  extended_hash: None
+  flags: '0'
+  id: '%(i)d'
+  notes: OK
+  project_name: openstack-c%(i)d
+  promotions: '[]'
+  repo_dir: /home/centos9-master-uc/data/openstack-c%(i)d
+  status: SUCCESS
+  type: rpm
+"""  # noqa
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=20)
+    parser.add_argument("--commits", type=int, default=200)
+    args = parser.parse_args()
+
+    content = "commits:\n" + "".join(
+        COMMIT % {"i": i, "h": "%040x" % i, "d": "%040x" % (i * 7)}
+        for i in range(args.commits)
+    )
+    print("%d commits, %d bytes, libyaml %s"
+          % (args.commits, len(content), hasattr(yaml, "CSafeLoader")))
+
+    def first_commit_python():
+        with mock.patch.object(yaml, "CSafeLoader", yaml.SafeLoader,
+                               create=True):
+            return HashInfo._first_commit(content)
+
+    results = [
+        ("yaml.safe_load, whole file",
+         lambda: yaml.safe_load(content)["commits"][0]),
+        ("_first_commit, python",
+         first_commit_python),
+    ]
+    if hasattr(yaml, "CSafeLoader"):
+        results.append(("_first_commit, libyaml",
+                        lambda: HashInfo._first_commit(content)))
+    expected = yaml.safe_load(content)["commits"][0]
+    for name, func in results:
+        assert func() == expected, name
+        elapsed = timeit.timeit(func, number=args.number)
+        print("%-30s %10.3f ms/call" % (name, elapsed / args.number * 1e3))
+
+
+if __name__ == "__main__":
+    main()
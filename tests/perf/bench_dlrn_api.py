@@ -0,0 +1,72 @@
+#   Copyright 2021 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+"""Compare resolving every named tag and component of a few releases from
+their static commit.yaml and delorean.repo.md5 files, one request per query,
+with the bulk promotions requests of the DLRN API, on a local fake DLRN
+server answering each request after --latency seconds.
+
+    python -m tests.perf.bench_dlrn_api [--latency S] [--workers N]
+"""
+
+import argparse
+import time
+
+from repo_setup.get_hash import batch
+from repo_setup.get_hash import dlrn_api
+from repo_setup.get_hash.hash_info import HashInfo
+
+from tests.unit.get_hash import fakes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--workers", type=int, default=batch.DEFAULT_BATCH_WORKERS)
+    args = parser.parse_args()
+
+    config = HashInfo.load_config()
+    releases = config["repo_setup_releases"]
+    tags = config["rdo_named_tags"]
+    components = config["repo_setup_ci_components"]
+    promotions = fakes.make_promotions(tags, components, rounds=3)
+    dlrn = fakes.FakeDlrn(
+        dict(("centos9-%s" % release, promotions) for release in releases),
+        delay=args.latency,
+    )
+    config["dlrn_url"] = dlrn.url
+    queries = batch.expand_matrix([{
+        "os_version": "centos9", "release": releases, "tag": tags,
+        "component": [None] + components,
+    }])
+    print("%d queries, %.0f ms latency" % (len(queries), args.latency * 1e3))
+    try:
+        runs = [
+            ("static files, %d workers" % args.workers,
+             lambda: batch.resolve(queries, config, workers=args.workers)),
+            ("DLRN API promotions",
+             lambda: dlrn_api.resolve(queries, config)),
+        ]
+        for name, resolve in runs:
+            dlrn.requests.clear()
+            start = time.monotonic()
+            errors = sum(1 for result in resolve() if result.error)
+            elapsed = time.monotonic() - start
+            print("%-28s %8.3f s %6d requests %4d errors"
+                  % (name, elapsed, sum(dlrn.requests.values()), errors))
+    finally:
+        dlrn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#   Copyright 2021 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+"""Check the import time of every console script entry point against its
+budget, using python -X importtime. Exits non zero when a budget is
+exceeded.
+
+    python -m tests.perf.bench_import_time [--runs N] [--scale FACTOR]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+# Cumulative import time budget of each entry point module, in milliseconds
+IMPORT_BUDGETS_MS = {
+    "repo_setup.main": 40,
+    "repo_setup.get_hash.__main__": 30,
+    "repo_setup.yum_config.__main__": 30,
+}
+
+
+def import_time_us(module):
+    """Cumulative import time of module in a fresh interpreter"""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="")
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import %s" % module],
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        env=env,
+        check=True,
+    ).stderr
+    for line in output.splitlines():
+        fields = [field.strip() for field in line.split("|")]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1])
+    raise RuntimeError("No import time reported for %s" % module)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=5,
+        help="Imports per entry point, the fastest one is compared",
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="Multiply every budget, e.g. for slow CI nodes",
+    )
+    args = parser.parse_args()
+
+    failed = False
+    for module, budget_ms in sorted(IMPORT_BUDGETS_MS.items()):
+        budget_ms *= args.scale
+        best_ms = min(import_time_us(module) for __ in range(args.runs)) / 1000.0
+        status = "OK" if best_ms <= budget_ms else "OVER BUDGET"
+        failed = failed or best_ms > budget_ms
+        print("%-32s %8.1f ms (budget %6.1f ms) %s" % (module, best_ms, budget_ms, status))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
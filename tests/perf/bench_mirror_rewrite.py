@@ -0,0 +1,104 @@
+#   Copyright 2021 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+"""Compare the per mirror re.sub passes repo-setup used to inject mirrors
+with the compiled single pass rewriter, on large multi-section repo files
+with one url per option and with a list of urls in gpgkey.
+
+    python -m tests.perf.bench_mirror_rewrite [--number N] [--sections N]
+"""
+
+import argparse
+import re
+import timeit
+
+from repo_setup import rewrite
+
+SECTION = '''[repo-%(i)d]
+name=repo %(i)d
+baseurl=https://trunk.rdoproject.org/centos9-master/component/c%(i)d/current
+gpgkey=%(gpgkey)s
+mirrorlist=http://mirror.stream.centos.org/mirrorlist?repo=r%(i)d
+metalink=https://mirrors.fedoraproject.org/metalink?repo=epel-%(i)d
+enabled=1
+gpgcheck=1
+priority=20
+
+'''
+
+GPGKEYS = (
+    ("single urls", "http://mirror.stream.centos.org/k"),
+    ("url lists",
+     "file:///etc/pki/rpm-gpg/RPM-GPG-KEY http://mirror.stream.centos.org/k"),
+)
+
+
+def rewrites(count):
+    """The RDO and base OS mirrors plus count - 2 --mirror-map entries"""
+    pairs = [
+        ("https://trunk.rdoproject.org", "http://mirror.example.org/rdo"),
+        ("http://mirror.stream.centos.org", "http://mirror.example.org/c"),
+    ]
+    pairs.extend(
+        ("http://upstream%d.example.org" % i, "http://mirror.example.org/%d" % i)
+        for i in range(count - 2)
+    )
+    return pairs
+
+
+def legacy_inject(content, pairs):
+    """The baseurl only, one re.sub per mirror, injection of before"""
+    for prefix, mirror in pairs:
+        content = re.sub("baseurl=%s" % prefix, "baseurl=%s" % mirror, content)
+    return content
+
+
+def legacy_inject_options(content, pairs):
+    """The same passes extended to every option the rewriter handles"""
+    for prefix, mirror in pairs:
+        for option in rewrite.REWRITE_OPTIONS:
+            content = re.sub("%s=%s" % (option, prefix),
+                             "%s=%s" % (option, mirror), content)
+    return content
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=20)
+    parser.add_argument("--sections", type=int, default=2000)
+    args = parser.parse_args()
+
+    for label, gpgkey in GPGKEYS:
+        content = "".join(SECTION % {"i": i, "gpgkey": gpgkey}
+                          for i in range(args.sections))
+        print("%d sections, %d bytes, %s"
+              % (args.sections, len(content), label))
+        for count in (2, 10, 50):
+            pairs = rewrites(count)
+            rewriter = rewrite.MirrorRewriter(pairs)
+            results = [
+                ("re.sub per mirror, baseurl (%d)" % count,
+                 lambda: legacy_inject(content, pairs)),
+                ("re.sub per mirror, options (%d)" % count,
+                 lambda: legacy_inject_options(content, pairs)),
+                ("MirrorRewriter (%d)" % count,
+                 lambda: rewriter.rewrite(content)),
+            ]
+            for name, func in results:
+                elapsed = timeit.timeit(func, number=args.number)
+                print("%-34s %10.3f ms/call"
+                      % (name, elapsed / args.number * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#   Copyright 2021 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+"""Compare distro detection through a bash subprocess with the pure Python
+os-release parser.
+
+    python -m tests.perf.bench_os_release [--number N]
+"""
+
+import argparse
+import os
+import subprocess
+import tempfile
+import timeit
+
+from repo_setup import utils
+
+OS_RELEASE = '''NAME="CentOS Stream"
+VERSION="9"
+ID="centos"
+ID_LIKE="rhel fedora"
+VERSION_ID="9"
+PLATFORM_ID="platform:el9"
+PRETTY_NAME="CentOS Stream 9"
+CPE_NAME="cpe:/o:centos:centos:9"
+HOME_URL="https://centos.org/"
+'''
+
+
+def bash_source(path):
+    """The os-release parsing repo-setup used before utils.parse_os_release"""
+    output = subprocess.Popen(
+        'source %s && echo -e -n "$ID\n$VERSION_ID\n$NAME"' % path,
+        shell=True,
+        stdout=subprocess.PIPE,
+        stderr=open(os.devnull, "w"),
+        executable="/bin/bash",
+        universal_newlines=True,
+    ).communicate()
+    return output[0].split("\n")
+
+
+def uncached_parse(path):
+    utils._os_release_cache.clear()
+    return utils.parse_os_release(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile("w", suffix="os-release") as f:
+        f.write(OS_RELEASE)
+        f.flush()
+        results = [
+            ("bash subprocess", lambda: bash_source(f.name)),
+            ("parse_os_release (uncached)", lambda: uncached_parse(f.name)),
+            ("parse_os_release (cached)", lambda: utils.parse_os_release(f.name)),
+        ]
+        for name, func in results:
+            elapsed = timeit.timeit(func, number=args.number)
+            print("%-30s %10.1f us/call" % (name, elapsed / args.number * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,14 @@
 #
 #
 
+import collections
+import hashlib
+import json
+import threading
+import time
+from http import server
+from urllib import parse
+
 TEST_COMMIT_YAML_COMPONENT = """
     commits:
     - artifacts: repos/component/common/47/6a/476a52df13202a44336c8b01419f8b73b93d93eb_1f5a41f3/openstack-tacker-4.1.0-0.20210325043415.476a52d.el8.src.rpm,repos/component/common/47/6a/476a52df13202a44336c8b01419f8b73b93d93eb_1f5a41f3/python3-tacker-doc-4.1.0-0.20210325043415.476a52d.el8.noarch.rpm,repos/component/common/47/6a/476a52df13202a44336c8b01419f8b73b93d93eb_1f5a41f3/python3-tacker-tests-4.1.0-0.20210325043415.476a52d.el8.noarch.rpm,repos/component/common/47/6a/476a52df13202a44336c8b01419f8b73b93d93eb_1f5a41f3/openstack-tacker-common-4.1.0-0.20210325043415.476a52d.el8.noarch.rpm,repos/component/common/47/6a/476a52df13202a44336c8b01419f8b73b93d93eb_1f5a41f3/python3-tacker-4.1.0-0.20210325043415.476a52d.el8.noarch.rpm,repos/component/common/47/6a/476a52df13202a44336c8b01419f8b73b93d93eb_1f5a41f3/openstack-tacker-4.1.0-0.20210325043415.476a52d.el8.noarch.rpm
@@ -92,3 +100,107 @@ os_versions:
   - rhel9
 
 """
+
+
+def _sha1(*values):
+    return hashlib.sha1(
+        '-'.join(str(v) for v in values).encode('utf-8')).hexdigest()
+
+
+def make_promotions(tags, components, rounds=1):
+    """DLRN API promotions of every component to every tag, newest first
+
+    Each round promotes every tag once, all its components sharing the
+    aggregate hash of the promotion.
+    """
+    promotions = []
+    timestamp = 1600000000
+    for round_ in range(rounds):
+        for tag in tags:
+            aggregate = _sha1('aggregate', tag, round_)[:32]
+            for component in components:
+                timestamp += 1
+                promotions.append({
+                    'commit_hash': _sha1('commit', component, round_),
+                    'distro_hash': _sha1('distro', component, round_),
+                    'extended_hash': None,
+                    'aggregate_hash': aggregate,
+                    'component': component,
+                    'promote_name': tag,
+                    'timestamp': timestamp,
+                    'user': 'ciuser',
+                })
+    promotions.reverse()
+    return promotions
+
+
+class FakeDlrn:
+    """Local DLRN server with the promotions call of the DLRN API and the
+    commit.yaml and delorean.repo.md5 files of the promoted named tags
+
+    :param promotions: dict of os_version-release, e.g. centos9-master, to
+                       its promotions, as returned by make_promotions()
+    :param delay: seconds each response is delayed, to mimic latency
+    """
+
+    def __init__(self, promotions, delay=0):
+        self.promotions = promotions
+        self.delay = delay
+        self.requests = collections.Counter()
+        self.files = {}
+        for endpoint, endpoint_promotions in promotions.items():
+            for promotion in reversed(endpoint_promotions):
+                tag = promotion['promote_name']
+                self.files['/%s/component/%s/%s/commit.yaml' % (
+                    endpoint, promotion['component'], tag)] = json.dumps(
+                        {'commits': [promotion]})
+                self.files['/%s/%s/delorean.repo.md5' % (endpoint, tag)] = (
+                    promotion['aggregate_hash'])
+        fake = self
+
+        class Handler(server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers and body are separate writes, do not delay the body
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                url = parse.urlsplit(self.path)
+                fake.requests[url.path] += 1
+                time.sleep(fake.delay)
+                body = fake.get(url.path, parse.parse_qs(url.query))
+                if body is None:
+                    self.send_error(404)
+                    return
+                body = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.httpd.server_address[1]
+        threading.Thread(target=self.httpd.serve_forever, args=(0.01,),
+                         daemon=True).start()
+
+    def get(self, path, query):
+        if not path.startswith('/api-'):
+            return self.files.get(path)
+        endpoint, __, call = path[len('/api-'):].partition('/')
+        if endpoint.endswith('-uc'):
+            endpoint = endpoint[:-len('-uc')]
+        if call != 'api/promotions' or endpoint not in self.promotions:
+            return None
+        promotions = self.promotions[endpoint]
+        for name in ('promote_name', 'component'):
+            if name in query:
+                promotions = [p for p in promotions
+                              if p[name] == query[name][0]]
+        limit = int(query.get('limit', ['100'])[0])
+        return json.dumps(promotions[:limit])
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -21,6 +21,7 @@ from unittest.mock import mock_open, MagicMock, patch
 import yaml
 
 import repo_setup.get_hash.__main__ as tgh
+import repo_setup.get_hash.hash_info as thi
 from . import fakes as test_fakes
 
 
@@ -34,6 +35,16 @@ class TestGetHash(unittest.TestCase):
     fakes.CONFIG_FILE
     """
 
+    def setUp(self):
+        # the configs loaded from the mocked open must not be shared
+        thi.HashInfo.clear_config_cache()
+        self.addCleanup(thi.HashInfo.clear_config_cache)
+        # the hashes must not be cached on disk or answered from it
+        patcher = patch.object(tgh.hash_cache, 'get_hash_cache',
+                               return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     def test_centos_8_current_repo_setup_stable(self, mock_config):
         mocked = MagicMock(
             return_value=(test_fakes.TEST_REPO_MD5, 200))
@@ -88,6 +99,15 @@ class TestGetHash(unittest.TestCase):
 #            ]
 #        self.assertEqual(debug_msgs, [])
 
+    def test_config_choices_lazy(self, mock_config):
+        config = {}
+        choices = tgh.ConfigChoices(config, 'rdo_named_tags')
+        self.assertEqual({}, config)
+        self.assertIn('current-podified', choices)
+        self.assertNotIn('nosuchtag', choices)
+        self.assertIn('current-podified', list(choices))
+        self.assertIn('dlrn_url', config)
+
     def test_invalid_unknown_components(self, mock_config):
         args = ['--component', 'nosuchcomponent']
         sys.argv[1:] = args
@@ -212,6 +232,23 @@ class TestGetHash(unittest.TestCase):
                 "/delorean.repo.md5", main_res.dlrn_url,
             )
 
+    def test_cache_options(self, mock_config):
+        mocked = MagicMock(
+            return_value=(test_fakes.TEST_REPO_MD5, 200))
+        cache = MagicMock()
+        cache.fetch.return_value = (test_fakes.TEST_REPO_MD5, 200)
+        with patch('repo_setup.get_hash.hash_info.http_get', mocked):
+            tgh.hash_cache.get_hash_cache.return_value = cache
+            sys.argv[1:] = ['--cache-ttl', '60', '--cache-dir', '/c']
+            tgh.main()
+            tgh.hash_cache.get_hash_cache.assert_called_once_with('/c', 60)
+            mocked.assert_not_called()
+            sys.argv[1:] = ['--no-cache']
+            tgh.main()
+            mocked.assert_called_once()
+        self.assertEqual(1, cache.fetch.call_count)
+        self.assertEqual(1, tgh.hash_cache.get_hash_cache.call_count)
+
 
 if __name__ == '__main__':
     unittest.main()
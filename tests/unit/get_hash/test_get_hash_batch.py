@@ -0,0 +1,156 @@
+#   Copyright 2021 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+#
+
+import io
+import json
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+from unittest.mock import mock_open, patch
+
+import repo_setup.get_hash.__main__ as tgh
+import repo_setup.get_hash.batch as tgb
+import repo_setup.get_hash.exceptions as exc
+import repo_setup.get_hash.hash_info as thi
+from . import fakes as test_fakes
+
+
+@mock.patch(
+    'builtins.open', new_callable=mock_open, read_data=test_fakes.CONFIG_FILE
+)
+class TestGetHashBatch(unittest.TestCase):
+    """Tests for resolving many HashInfo queries at once, with the
+    config.yaml mocked with the contents of fakes.CONFIG_FILE
+    """
+
+    def setUp(self):
+        thi.HashInfo.clear_config_cache()
+        self.addCleanup(thi.HashInfo.clear_config_cache)
+        # the hashes must not be cached on disk or answered from it
+        patcher = patch.object(tgh.hash_cache, 'get_hash_cache',
+                               return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _fetch(self, url):
+        if '-zed/' in url:
+            return 'Not Found', 404
+        if url.endswith('commit.yaml'):
+            return test_fakes.TEST_COMMIT_YAML_COMPONENT, 200
+        return test_fakes.TEST_REPO_MD5, 200
+
+    def test_expand_matrix(self, mock_config):
+        queries = tgb.expand_matrix(
+            [{'release': ['master', 'wallaby'],
+              'component': [None, 'common']},
+             {'tag': 'current'}],
+            defaults={'os_version': 'centos8', 'tag': 'current-podified',
+                      'verbose': False})
+        self.assertEqual(5, len(queries))
+        self.assertEqual(
+            tgb.HashQuery('centos8', 'master', None, 'current-podified',
+                          None), queries[0])
+        self.assertEqual(
+            tgb.HashQuery('centos8', 'wallaby', 'common', 'current-podified',
+                          None), queries[3])
+        self.assertEqual(
+            tgb.HashQuery('centos8', None, None, 'current', None),
+            queries[4])
+
+    def test_expand_matrix_invalid(self, mock_config):
+        for items in ({'release': 'master'}, ['master'],
+                      [{'releases': 'master'}]):
+            self.assertRaises(exc.HashInvalidParameter,
+                              tgb.expand_matrix, items)
+
+    def test_resolve(self, mock_config):
+        queries = [
+            tgb.HashQuery('centos8', 'master', None, 'current', None),
+            tgb.HashQuery('centos8', 'master', 'common', 'current', None),
+            tgb.HashQuery('centos8', 'zed', None, 'current', None),
+            tgb.HashQuery('centos8', 'master', 'nosuchcomponent',
+                          'current', None),
+        ]
+        results = list(tgb.resolve(queries, fetch=self._fetch))
+        self.assertEqual(set(queries), set(r.query for r in results))
+        by_query = dict((r.query, r) for r in results)
+        self.assertEqual(test_fakes.TEST_REPO_MD5,
+                         by_query[queries[0]].hash_info.full_hash)
+        self.assertEqual('476a52df13202a44336c8b01419f8b73b93d93eb',
+                         by_query[queries[1]].hash_info.commit_hash)
+        self.assertIsNone(by_query[queries[0]].error)
+        self.assertIsNone(by_query[queries[2]].hash_info)
+        self.assertIn('Response code: 404', by_query[queries[2]].error)
+        self.assertIn('Invalid component nosuchcomponent',
+                      by_query[queries[3]].error)
+
+    def test_resolve_concurrently(self, mock_config):
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def fetch(url):
+            with lock:
+                active.append(url)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.remove(url)
+            return test_fakes.TEST_REPO_MD5, 200
+
+        queries = tgb.expand_matrix(
+            [{'os_version': 'centos8', 'tag': 'current',
+              'release': ['master', 'zed', 'wallaby', 'victoria', 'ussuri',
+                          'train']}])
+        results = list(tgb.resolve(queries, workers=3, fetch=fetch))
+        self.assertEqual(6, len(results))
+        self.assertEqual(3, max(peak))
+
+    def test_main_matrix(self, mock_config):
+        matrix = json.dumps([{'release': ['master', 'zed']}])
+        stdout = io.StringIO()
+        with patch('sys.stdin', io.StringIO(matrix)), \
+                patch('sys.stdout', stdout), \
+                patch.object(tgb, 'session_fetch',
+                             return_value=self._fetch):
+            sys.argv[1:] = ['--matrix', '-', '--tag', 'current']
+            results = tgh.main()
+        lines = [json.loads(line)
+                 for line in stdout.getvalue().splitlines()]
+        self.assertEqual(2, len(results))
+        by_release = dict((line['release'], line) for line in lines)
+        self.assertEqual(test_fakes.TEST_REPO_MD5,
+                         by_release['master']['full_hash'])
+        self.assertEqual('current', by_release['master']['tag'])
+        self.assertIsNone(by_release['master']['error'])
+        self.assertIn('Response code: 404', by_release['zed']['error'])
+        self.assertNotIn('full_hash', by_release['zed'])
+        with patch.object(tgh, 'main', return_value=results):
+            with self.assertRaises(SystemExit) as e:
+                tgh.cli_entrypoint()
+        self.assertEqual(1, e.exception.code)
+
+    def test_session_fetch(self, mock_config):
+        response = mock.Mock(text='abc', status_code=200)
+        with patch('repo_setup.session.get_with_retries',
+                   return_value=response) as get:
+            fetch = tgb.session_fetch(2)
+            self.assertEqual(('abc', 200), fetch('http://u/a'))
+            get.side_effect = IOError('refused')
+            self.assertEqual(('refused', -1), fetch('http://u/a'))
+        self.assertEqual(['http://u/a'], get.call_args[0][1])
@@ -0,0 +1,186 @@
+#   Copyright 2021 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+#
+
+import os
+import tempfile
+import time
+import unittest
+from concurrent import futures
+from unittest.mock import MagicMock, patch
+
+import repo_setup.get_hash.hash_cache as thc
+import repo_setup.get_hash.hash_info as thi
+from . import fakes as test_fakes
+
+KEY = ('https://trunk.rdoproject.org', 'centos9', 'master', None,
+       'current-podified', None)
+URL = ('https://trunk.rdoproject.org/centos9-master/current-podified/'
+       'delorean.repo.md5')
+
+
+class TestHashCache(unittest.TestCase):
+    """Tests for the on-disk cache of resolved hashes"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = tmp.name
+        self.get = MagicMock(
+            return_value=(test_fakes.TEST_REPO_MD5, 200, {'ETag': '"1"'}))
+
+    def _cache(self, ttl=60):
+        return thc.HashCache(self.path, ttl, get=self.get)
+
+    def test_hit(self):
+        for cache in (self._cache(), self._cache()):
+            self.assertEqual((test_fakes.TEST_REPO_MD5, 200),
+                             cache.fetch(KEY, URL))
+        self.get.assert_called_once_with(URL, {})
+        self.assertEqual({'hit': 1}, dict(cache.stats))
+
+    def test_revalidated(self):
+        cache = self._cache(ttl=0)
+        cache.fetch(KEY, URL)
+        self.get.return_value = ('', 304, {})
+        self.assertEqual((test_fakes.TEST_REPO_MD5, 200),
+                         cache.fetch(KEY, URL))
+        self.get.assert_called_with(URL, {'If-None-Match': '"1"'})
+        self.assertEqual({'miss': 1, 'revalidated': 1}, dict(cache.stats))
+
+    def test_expired_changed(self):
+        cache = self._cache(ttl=0)
+        cache.fetch(KEY, URL)
+        self.get.return_value = ('abc', 200, {'ETag': '"2"'})
+        self.assertEqual(('abc', 200), cache.fetch(KEY, URL))
+        cache.ttl = 60
+        self.assertEqual(('abc', 200), cache.fetch(KEY, URL))
+        self.assertEqual(2, self.get.call_count)
+
+    def test_errors_not_cached(self):
+        cache = self._cache()
+        self.get.return_value = ('Not Found', 404, {})
+        for _ in range(2):
+            self.assertEqual(('Not Found', 404), cache.fetch(KEY, URL))
+        self.assertEqual(2, self.get.call_count)
+
+    def test_other_url(self):
+        cache = self._cache()
+        cache.fetch(KEY, URL)
+        cache.fetch(KEY, URL + '.other')
+        self.assertEqual(2, self.get.call_count)
+
+    def test_disabled(self):
+        with patch('os.makedirs', side_effect=OSError('read only')), \
+                patch('sys.stderr'):
+            cache = self._cache()
+        self.assertFalse(cache.enabled)
+        for _ in range(2):
+            self.assertEqual((test_fakes.TEST_REPO_MD5, 200),
+                             cache.fetch(KEY, URL))
+        self.assertEqual(2, self.get.call_count)
+        self.assertEqual([], os.listdir(self.path))
+
+    def test_concurrent_fetches_locked(self):
+        def get(url, headers):
+            time.sleep(0.05)
+            return test_fakes.TEST_REPO_MD5, 200, {}
+
+        self.get.side_effect = get
+        # one cache object per worker, like separate processes
+        with futures.ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(
+                lambda i: self._cache().fetch(KEY, URL), range(4)))
+        self.assertEqual([(test_fakes.TEST_REPO_MD5, 200)] * 4, results)
+        self.assertEqual(1, self.get.call_count)
+
+    def _age(self, filename, seconds):
+        then = time.time() - seconds
+        os.utime(filename, (then, then))
+
+    def test_prune_on_open(self):
+        cache = self._cache()
+        cache.fetch(KEY, URL)
+        cache.fetch(KEY + ('old',), URL)
+        old_entry, old_lock = cache._entry(KEY + ('old',))
+        orphan_lock = os.path.join(cache.path, 'orphan.lock')
+        open(orphan_lock, 'w').close()
+        self._age(old_entry, thc.DEFAULT_HASH_CACHE_MAX_AGE + 1)
+        self._age(orphan_lock, thc.DEFAULT_HASH_CACHE_MAX_AGE + 1)
+        self._cache()
+        self.assertEqual(sorted(os.path.basename(f)
+                                for f in cache._entry(KEY)),
+                         sorted(os.listdir(cache.path)))
+        self.assertEqual((test_fakes.TEST_REPO_MD5, 200),
+                         cache.fetch(KEY, URL))
+        self.assertEqual({'miss': 2, 'hit': 1}, dict(cache.stats))
+
+    def test_prune_keeps_locked_entries(self):
+        cache = thc.HashCache(self.path, 60, get=self.get, max_age=10)
+        cache.fetch(KEY, URL)
+        entry_file, lock_file = cache._entry(KEY)
+        self._age(entry_file, 3600)
+        with thc._file_lock(lock_file):
+            self.assertEqual(0, cache.prune())
+        self.assertTrue(os.path.exists(entry_file))
+        self.assertEqual(1, cache.prune())
+        self.assertEqual([], os.listdir(cache.path))
+
+    def test_prune_keeps_fresh_entries(self):
+        # entries are kept for at least the ttl
+        cache = thc.HashCache(self.path, 3600, get=self.get, max_age=10)
+        cache.fetch(KEY, URL)
+        self._age(cache._entry(KEY)[0], 60)
+        self.assertEqual(0, cache.prune())
+
+    def test_hash_info(self):
+        cache = self._cache()
+        config = {'dlrn_url': 'https://trunk.rdoproject.org'}
+        http_get = MagicMock()
+        with patch.object(thi, 'http_get', http_get):
+            for _ in range(2):
+                info = thi.HashInfo('centos9', 'master', None,
+                                    'current-podified', config=config,
+                                    cache=cache)
+                self.assertEqual(test_fakes.TEST_REPO_MD5, info.full_hash)
+        http_get.assert_not_called()
+        self.get.assert_called_once_with(URL, {})
+
+    def test_get_hash_cache_shared(self):
+        with patch.dict(thc._hash_caches, clear=True):
+            cache = thc.get_hash_cache(self.path, 10)
+            self.assertIs(cache, thc.get_hash_cache(self.path, 10))
+            self.assertIsNot(cache, thc.get_hash_cache(self.path, 20))
+        self.assertEqual(os.path.join(self.path, 'hashes'), cache.path)
+
+
+class TestConditionalGet(unittest.TestCase):
+    def test_conditional_get(self):
+        response = MagicMock(text='abc', status_code=304,
+                             headers={'ETag': '"1"'})
+        with patch.object(thc.http_session, 'get_with_retries',
+                          return_value=response) as get:
+            self.assertEqual(('abc', 304, {'ETag': '"1"'}),
+                             thc.conditional_get('http://u/a',
+                                                 {'If-None-Match': '"1"'}))
+            self.assertEqual({'If-None-Match': '"1"'},
+                             get.call_args[1]['headers'])
+            get.side_effect = IOError('refused')
+            self.assertEqual(('refused', -1, {}),
+                             thc.conditional_get('http://u/a', {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
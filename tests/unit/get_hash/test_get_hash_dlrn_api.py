@@ -0,0 +1,140 @@
+#   Copyright 2021 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+#
+
+import sys
+import unittest
+from unittest import mock
+from unittest.mock import mock_open, patch
+
+import repo_setup.get_hash.__main__ as tgh
+import repo_setup.get_hash.batch as tgb
+import repo_setup.get_hash.dlrn_api as tda
+import repo_setup.get_hash.exceptions as exc
+import repo_setup.get_hash.hash_info as thi
+from . import fakes as test_fakes
+
+TAGS = ['current-podified', 'current']
+COMPONENTS = ['common', 'compute', 'network']
+
+
+@mock.patch(
+    'builtins.open', new_callable=mock_open, read_data=test_fakes.CONFIG_FILE
+)
+class TestDlrnApi(unittest.TestCase):
+    """Tests for resolving queries with the DLRN API of a fake DLRN server,
+    with the config.yaml mocked with the contents of fakes.CONFIG_FILE
+    """
+
+    def setUp(self):
+        thi.HashInfo.clear_config_cache()
+        self.addCleanup(thi.HashInfo.clear_config_cache)
+        promotions = test_fakes.make_promotions(TAGS, COMPONENTS, rounds=2)
+        self.dlrn = test_fakes.FakeDlrn({'centos9-master': promotions,
+                                         'centos9-wallaby': promotions[2:]})
+        self.addCleanup(self.dlrn.close)
+        self.config = {'dlrn_url': self.dlrn.url}
+
+    def _queries(self, releases=('master', 'wallaby')):
+        return tgb.expand_matrix([{
+            'os_version': 'centos9', 'release': list(releases),
+            'tag': TAGS, 'component': [None] + COMPONENTS}])
+
+    def _api_requests(self):
+        return sum(count for path, count in self.dlrn.requests.items()
+                   if path.endswith('/api/promotions'))
+
+    def test_resolve_matches_static_files(self, mock_config):
+        queries = self._queries()
+        from_api = dict(
+            (r.query, r) for r in tda.resolve(queries, self.config))
+        self.assertEqual(4, self._api_requests())
+        from_files = dict(
+            (r.query, r) for r in tgb.resolve(queries, self.config))
+        self.assertEqual(16, len(from_api))
+        for query in queries:
+            self.assertIsNone(from_api[query].error, query)
+            self.assertEqual(from_files[query].hash_info.to_dict(),
+                             from_api[query].hash_info.to_dict(), query)
+
+    def test_resolve_beyond_limit(self, mock_config):
+        queries = self._queries(releases=['master'])
+        results = list(tda.resolve(queries, self.config, limit=2))
+        self.assertEqual([None] * 8, [r.error for r in results])
+        # the 2 latest promotions of each tag hold only 2 components
+        self.assertEqual(2 + 2, self._api_requests())
+        common = [r.hash_info for r in results
+                  if r.query.component == 'common'
+                  and r.query.tag == 'current'][0]
+        self.assertEqual(
+            test_fakes._sha1('commit', 'common', 1), common.commit_hash)
+
+    def test_resolve_errors(self, mock_config):
+        queries = [
+            tgb.HashQuery('centos9', 'master', None, 'consistent', None),
+            tgb.HashQuery('centos9', 'zed', 'common', 'current', None),
+            tgb.HashQuery('centos9', 'master', 'common', 'current', 'abcd'),
+            tgb.HashQuery('centos9', 'master', 'nosuch', 'current', None),
+            tgb.HashQuery('centos9', 'master', 'common', 'current', None),
+        ]
+        results = dict(
+            (r.query, r) for r in tda.resolve(queries, self.config))
+        self.assertIn('No consistent promotion of the aggregate',
+                      results[queries[0]].error)
+        self.assertIn('Response code: 404', results[queries[1]].error)
+        self.assertIn('not resolved with the DLRN API',
+                      results[queries[2]].error)
+        self.assertIn('Invalid component nosuch', results[queries[3]].error)
+        self.assertIsNone(results[queries[4]].error)
+
+    def test_client_invalid_response(self, mock_config):
+        for response in (('not json', 200), ('{}', 200), ('', 500)):
+            client = tda.DlrnApiClient(
+                'http://dlrn/api-centos9-master-uc',
+                fetch=mock.Mock(return_value=response))
+            self.assertRaises(exc.HashInvalidDLRNResponse,
+                              client.promotions, 'current')
+
+    def test_client_urls(self, mock_config):
+        fetch = mock.Mock(return_value=('[]', 200))
+        client = tda.DlrnApiClient('http://dlrn/api-centos9-master-uc/',
+                                   fetch=fetch, limit=10)
+        self.assertEqual({('current', 'common'): None},
+                         client.latest_promotions([('current', 'common')]))
+        self.assertEqual(
+            [mock.call('http://dlrn/api-centos9-master-uc/api/promotions'
+                       '?promote_name=current&limit=10'),
+             mock.call('http://dlrn/api-centos9-master-uc/api/promotions'
+                       '?promote_name=current&component=common&limit=1')],
+            fetch.call_args_list)
+        self.assertEqual(2, client.requests)
+
+    def test_from_promotion_no_aggregate(self, mock_config):
+        promotion = test_fakes.make_promotions(['current'], ['common'])[0]
+        info = thi.HashInfo.from_promotion(
+            'centos9', 'master', None, 'current', promotion)
+        self.assertEqual(promotion['aggregate_hash'], info.full_hash)
+        self.assertEqual(
+            'https://trunk.rdoproject.org/api-centos9-master-uc',
+            info.dlrn_api_url)
+        promotion['aggregate_hash'] = None
+        self.assertRaises(exc.HashInvalidDLRNResponse,
+                          thi.HashInfo.from_promotion,
+                          'centos9', 'master', None, 'current', promotion)
+
+    def test_main_dlrn_api_requires_matrix(self, mock_config):
+        sys.argv[1:] = ['--dlrn-api']
+        with patch('sys.stderr'):
+            self.assertRaises(SystemExit, tgh.main)
@@ -14,7 +14,10 @@
 #
 #
 
+import os
+import tempfile
 import unittest
+import yaml
 import repo_setup.get_hash.hash_info as thi
 import repo_setup.get_hash.exceptions as exc
 from . import fakes as test_fakes
@@ -32,6 +35,11 @@ class TestGetHashInfo(unittest.TestCase):
     fakes.CONFIG_FILE
     """
 
+    def setUp(self):
+        # the configs loaded from the mocked open must not be shared
+        thi.HashInfo.clear_config_cache()
+        self.addCleanup(thi.HashInfo.clear_config_cache)
+
     def test_hashes_from_commit_yaml(self, mock_config):
         sample_commit_yaml = test_fakes.TEST_COMMIT_YAML_COMPONENT
         expected_result = (
@@ -172,3 +180,133 @@ class TestGetHashInfo(unittest.TestCase):
                 "create HashInfo object."
             ).format(bad_dlrn_url, '404', response_text_404)
             self.assertIn(error_str, debug_msgs)
+
+
+class TestFirstCommit(unittest.TestCase):
+    """_first_commit() parses a commit.yaml only up to its first commit"""
+
+    COMMIT_YAML = (
+        'commits:\n'
+        '- commit_hash: abc\n'
+        '  distro_hash: def\n'
+        '  extended_hash: null\n'
+        '  dt_build: 2021-03-25\n'
+        '  artifacts: [a.rpm, {b: c}]\n'
+        '- commit_hash: older\n'
+    )
+
+    def _first_commits(self, commit_yaml):
+        """The result with libyaml and with the pure python parser"""
+        results = [thi.HashInfo._first_commit(commit_yaml)]
+        with patch.object(yaml, 'CSafeLoader', yaml.SafeLoader,
+                          create=True):
+            results.append(thi.HashInfo._first_commit(commit_yaml))
+        return results
+
+    def test_same_as_safe_load(self):
+        for commit_yaml in (test_fakes.TEST_COMMIT_YAML_COMPONENT,
+                            self.COMMIT_YAML,
+                            'a: {b: [1, 2]}\n' + self.COMMIT_YAML,
+                            '{"commits": [{"commit_hash": "abc"}]}'):
+            expected = yaml.safe_load(commit_yaml)['commits'][0]
+            self.assertEqual([expected] * 2,
+                             self._first_commits(commit_yaml))
+
+    def test_stops_after_first_commit(self):
+        commit_yaml = self.COMMIT_YAML + '- bad: [\n'
+        self.assertRaises(yaml.YAMLError, yaml.safe_load, commit_yaml)
+        self.assertEqual('abc', self._first_commits(commit_yaml)[0][
+            'commit_hash'])
+
+    def test_unexpected_layout(self):
+        for commit_yaml in ('commits: []', 'commits: abc', 'a: 1', '[1]',
+                            'abc', '',
+                            'commits:\n- {a: &x 1, b: *x}\n'):
+            self.assertEqual([None] * 2, self._first_commits(commit_yaml))
+
+    def test_hashes_fall_back_to_full_load(self):
+        commit_yaml = ('commits:\n- &c {commit_hash: abc, distro_hash: '
+                       'def12345678, extended_hash: ext, self: *c}\n')
+        hash_info = thi.HashInfo.__new__(thi.HashInfo)
+        self.assertEqual(('abc_def12345', 'abc', 'def12345678', 'ext'),
+                         hash_info._hashes_from_commit_yaml(commit_yaml))
+        self.assertRaises(KeyError, hash_info._hashes_from_commit_yaml,
+                          'a: 1')
+
+
+class TestLoadConfigCache(unittest.TestCase):
+    """load_config() against real config files, parsed once per mtime"""
+
+    def setUp(self):
+        thi.HashInfo.clear_config_cache()
+        self.addCleanup(thi.HashInfo.clear_config_cache)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.config_path = os.path.join(tmp.name, 'config.yaml')
+        self._write(test_fakes.CONFIG_FILE)
+        patcher = patch.object(thi, 'CONFIG_PATH', self.config_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        load_yaml = patch.object(thi.HashInfo, 'load_yaml',
+                                 side_effect=thi.HashInfo.load_yaml)
+        self.mock_load_yaml = load_yaml.start()
+        self.addCleanup(load_yaml.stop)
+
+    def _write(self, content, mtime=1000):
+        with open(self.config_path, 'w') as f:
+            f.write(content)
+        os.utime(self.config_path, (mtime, mtime))
+
+    def test_parsed_once(self):
+        first = thi.HashInfo.load_config()
+        second = thi.HashInfo.load_config({'dlrn_url': 'https://foo'})
+        self.assertEqual(1, self.mock_load_yaml.call_count)
+        self.assertEqual('https://trunk.rdoproject.org', first['dlrn_url'])
+        self.assertEqual('https://foo', second['dlrn_url'])
+
+    def test_returned_config_is_a_copy(self):
+        first = thi.HashInfo.load_config()
+        first['repo_setup_releases'].append('tomorrow')
+        first['rdo_named_tags'].clear()
+        second = thi.HashInfo.load_config()
+        self.assertEqual(1, self.mock_load_yaml.call_count)
+        self.assertNotIn('tomorrow', second['repo_setup_releases'])
+        self.assertIn('current-podified', second['rdo_named_tags'])
+
+    def test_reloaded_on_mtime_change(self):
+        thi.HashInfo.load_config()
+        self._write(test_fakes.CONFIG_FILE.replace(
+            'https://trunk.rdoproject.org', 'https://changed'), mtime=2000)
+        self.assertEqual('https://changed',
+                         thi.HashInfo.load_config()['dlrn_url'])
+        self.assertEqual(2, self.mock_load_yaml.call_count)
+
+    def test_invalid_config_cached(self):
+        self._write(test_fakes.BAD_CONFIG_FILE)
+        for _ in range(2):
+            self.assertRaises(exc.HashInvalidConfig,
+                              thi.HashInfo.load_config)
+        self.assertEqual(1, self.mock_load_yaml.call_count)
+
+    def test_snapshot(self):
+        snapshot_path = thi.HashInfo.write_config_snapshot()
+        self.assertEqual(self.config_path + '.json', snapshot_path)
+        self.mock_load_yaml.reset_mock()
+        config = thi.HashInfo.load_config()
+        self.mock_load_yaml.assert_not_called()
+        self.assertIn('victoria', config['repo_setup_releases'])
+
+    def test_snapshot_stale(self):
+        thi.HashInfo.write_config_snapshot()
+        self._write(test_fakes.CONFIG_FILE.replace(
+            'https://trunk.rdoproject.org', 'https://changed'), mtime=2000)
+        self.mock_load_yaml.reset_mock()
+        self.assertEqual('https://changed',
+                         thi.HashInfo.load_config()['dlrn_url'])
+        self.mock_load_yaml.assert_called_once()
+
+    def test_snapshot_missing_config(self):
+        with patch.object(thi.HashInfo, '_resolve_config_path',
+                          return_value=(None, None)):
+            self.assertRaises(exc.HashMissingConfig,
+                              thi.HashInfo.write_config_snapshot)
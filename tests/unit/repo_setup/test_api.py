@@ -0,0 +1,174 @@
+# Copyright 2021 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import threading
+from unittest import mock
+
+import fixtures
+import testtools
+
+from repo_setup import api
+from repo_setup import main
+
+REPOS = {
+    'https://trunk.rdoproject.org/centos9-master/current/delorean.repo':
+        '[delorean]\nbaseurl=https://trunk.rdoproject.org/centos9/x\n',
+    'https://trunk.rdoproject.org/centos9-master/delorean-deps.repo':
+        '[delorean-deps]\nbaseurl=http://mirror.stream.centos.org/x\n',
+}
+
+
+def _get(url, **kwargs):
+    if url in REPOS:
+        return mock.Mock(status_code=200, text=REPOS[url], headers={})
+    return mock.Mock(status_code=404)
+
+
+@mock.patch('repo_setup.main._get_distro',
+            return_value=('centos', '9', 'CentOS Stream'))
+@mock.patch('repo_setup.session.get_session')
+class TestInstall(testtools.TestCase):
+    def setUp(self):
+        super(TestInstall, self).setUp()
+        self.path = self.useFixture(fixtures.TempDir()).path
+
+    def _request(self, **kwargs):
+        return api.InstallRequest(['current'], distro='centos9',
+                                  output_path=self.path, no_cache=True,
+                                  **kwargs)
+
+    def test_install(self, mock_session, mock_distro):
+        mock_session.return_value.get.side_effect = _get
+        stale = os.path.join(self.path, 'delorean-old.repo')
+        open(stale, 'w').close()
+        result = api.install(self._request())
+        delorean = os.path.join(self.path, 'delorean.repo')
+        self.assertIn(delorean, result.changed)
+        self.assertEqual([stale], result.removed)
+        self.assertIn('Installed repo delorean to %s' % delorean,
+                      result.messages)
+        self.assertEqual(
+            sorted(REPOS),
+            sorted(f['url'] for f in result.fetched
+                   if f['status'] == 200))
+        self.assertIn('install',
+                      [phase['name'] for phase in result.timings['phases']])
+
+        # a second call in the same process leaves the files alone
+        result = api.install(self._request())
+        self.assertEqual([], result.changed)
+        self.assertEqual([], result.removed)
+        self.assertEqual(6, len(result.written))
+
+    def test_install_options(self, mock_session, mock_distro):
+        mock_session.return_value.get.side_effect = _get
+        result = api.install(self._request(staged=True, max_workers=1))
+        self.assertEqual(6, len(result.changed))
+        self.assertEqual([], [name for name in os.listdir(self.path)
+                              if name.startswith('.')])
+
+    def test_install_check(self, mock_session, mock_distro):
+        mock_session.return_value.get.side_effect = _get
+        stale = os.path.join(self.path, 'delorean-old.repo')
+        with open(stale, 'w') as f:
+            f.write('[delorean-old]\n')
+        result = api.install(self._request(), check=True)
+        self.assertEqual(6, len(result.changed))
+        self.assertEqual([stale], result.removed)
+        self.assertEqual(['delorean-old.repo'], os.listdir(self.path))
+        delorean = os.path.join(self.path, 'delorean.repo')
+        self.assertIn({'path': delorean, 'before': '',
+                       'after': REPOS[sorted(REPOS)[0]]}, result.diffs)
+        self.assertIn({'path': stale, 'before': '[delorean-old]\n',
+                       'after': ''}, result.diffs)
+        self.assertNotIn('pkg_clean',
+                         [phase['name'] for phase in result.timings['phases']])
+
+    def test_install_check_staged(self, mock_session, mock_distro):
+        mock_session.return_value.get.side_effect = _get
+        with mock.patch('repo_setup.main.StagedInstall') as mock_staged:
+            result = api.install(self._request(staged=True), check=True)
+        mock_staged.assert_not_called()
+        self.assertEqual(6, len(result.changed))
+        self.assertEqual([], os.listdir(self.path))
+
+    def test_install_matrix(self, mock_session, mock_distro):
+        mock_get = mock_session.return_value.get
+        mock_get.side_effect = _get
+        other = self.useFixture(fixtures.TempDir()).path
+        results = api.install_matrix([
+            self._request(),
+            api.InstallRequest(['current'], distro='centos9',
+                               output_path=other, no_cache=True,
+                               mirror='http://mirror'),
+        ])
+        self.assertEqual(2, len(results))
+        # every url, the md5 included, is fetched once for both targets
+        urls = [c[0][0] for c in mock_get.call_args_list]
+        self.assertEqual(sorted(set(urls)), sorted(urls))
+        self.assertEqual(3, len(urls))
+        with open(os.path.join(self.path, 'delorean-deps.repo')) as f:
+            self.assertIn('baseurl=http://mirror.stream.centos.org/',
+                          f.read())
+        with open(os.path.join(other, 'delorean-deps.repo')) as f:
+            self.assertIn('baseurl=http://mirror/', f.read())
+        for result in results:
+            self.assertEqual(6, len(result.changed))
+            self.assertEqual(3, len([f for f in result.fetched
+                                     if f['cache'] != 'run']))
+        self.assertIs(results[0].timings, results[1].timings)
+
+    def test_install_concurrent_messages(self, mock_session, mock_distro):
+        mock_session.return_value.get.side_effect = _get
+        paths = [self.useFixture(fixtures.TempDir()).path for i in range(4)]
+        results = {}
+
+        def install(path):
+            results[path] = api.install(api.InstallRequest(
+                ['current'], distro='centos9', output_path=path,
+                no_cache=True))
+
+        threads = [threading.Thread(target=install, args=(path,))
+                   for path in paths]
+        stdout = io.StringIO()
+        with mock.patch('sys.stdout', stdout):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual('', stdout.getvalue())
+        for path in paths:
+            delorean = os.path.join(path, 'delorean.repo')
+            self.assertIn('Installed repo delorean to %s' % delorean,
+                          results[path].messages)
+            self.assertEqual(
+                [], [m for m in results[path].messages
+                     if any(p in m for p in paths if p != path)])
+
+    def test_install_invalid(self, mock_session, mock_distro):
+        request = api.InstallRequest(['tomorrow'], output_path=self.path)
+        e = self.assertRaises(main.InvalidArguments, api.install, request)
+        self.assertIn("invalid choice: 'tomorrow'", str(e))
+        request = self._request(warp_speed=88)
+        e = self.assertRaises(main.InvalidArguments, api.install, request)
+        self.assertIn('unknown argument warp_speed', str(e))
+        mock_session.return_value.get.assert_not_called()
+
+    def test_argv(self, mock_session, mock_distro):
+        request = api.InstallRequest(['current', 'ceph'], branch='wallaby',
+                                     dlrn_hash_tag='abc')
+        self.assertEqual(['current', 'ceph', '--branch', 'wallaby',
+                          '--dlrn-hash-tag', 'abc'], request.argv())
@@ -0,0 +1,143 @@
+# Copyright 2021 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import json
+import os
+import tarfile
+from unittest import mock
+
+import fixtures
+import testtools
+
+from repo_setup import bundle
+from repo_setup import main
+
+HASH_PATH = '12/34/1234abcd/delorean.repo'
+HASH_URL = ('https://trunk.rdoproject.org/centos9-master/current-podified/'
+            + HASH_PATH)
+REPOS = {
+    HASH_URL: '[delorean]\nbaseurl=https://trunk.rdoproject.org/centos9/x\n',
+    'https://trunk.rdoproject.org/centos9-master/delorean-deps.repo':
+        '[delorean-deps]\nbaseurl=http://mirror.stream.centos.org/x\n',
+}
+
+
+def _get(url, **kwargs):
+    if url in REPOS:
+        return mock.Mock(status_code=200, text=REPOS[url], headers={})
+    return mock.Mock(status_code=404)
+
+
+@mock.patch('repo_setup.main._get_distro',
+            return_value=('centos', '9', 'CentOS Stream'))
+@mock.patch('repo_setup.session.get_session')
+class TestBundle(testtools.TestCase):
+    def setUp(self):
+        super(TestBundle, self).setUp()
+        self.path = self.useFixture(fixtures.TempDir()).path
+        self.bundle = os.path.join(self.path, 'bundle.tar.gz')
+        self.output = os.path.join(self.path, 'repos')
+        os.mkdir(self.output)
+        self.useFixture(fixtures.MonkeyPatch(
+            'sys.stdout', io.StringIO()))
+
+    def _create(self, mock_session):
+        mock_session.return_value.get.side_effect = _get
+        with mock.patch('sys.argv', [
+                'repo-setup', 'bundle', 'create', '--file', self.bundle,
+                'current-podified', '-d', 'centos9', '--no-cache',
+                '--dlrn-hash-tag', '1234abcd']):
+            main.main()
+
+    def test_create(self, mock_session, mock_distro):
+        self._create(mock_session)
+        manifest, files = bundle.load(self.bundle)
+        self.assertEqual(bundle.BUNDLE_FORMAT_VERSION,
+                         manifest['format_version'])
+        self.assertEqual('centos9', manifest['distro'])
+        self.assertEqual(
+            'https://trunk.rdoproject.org/centos9-master/',
+            manifest['base_path'])
+        self.assertEqual(REPOS, files)
+
+    def test_install_offline(self, mock_session, mock_distro):
+        self._create(mock_session)
+        mock_session.reset_mock()
+        with mock.patch('sys.argv', [
+                'repo-setup', 'bundle', 'install', self.bundle,
+                '--output-path', self.output, '--mirror', 'http://local']):
+            main.main()
+        mock_session.return_value.get.assert_not_called()
+        with open(os.path.join(self.output, 'delorean-deps.repo')) as f:
+            self.assertEqual('[delorean-deps]\nbaseurl=http://local/x\n',
+                             f.read())
+        self.assertIn('delorean.repo', os.listdir(self.output))
+        self.assertIn('repo-setup-centos-baseos.repo',
+                      os.listdir(self.output))
+
+    def test_install_missing_repo(self, mock_session, mock_distro):
+        self._create(mock_session)
+        manifest, files = bundle.load(self.bundle)
+        args = main._parse_args('centos', '9', manifest['argv'] + [
+            '--output-path', self.output, '--dlrn-hash-tag', 'ffff'])
+        self.assertRaises(bundle.BundleError, bundle.install, manifest,
+                          files, args, 'CentOS Stream', '9',
+                          mock.MagicMock())
+
+    def test_main_install_missing_repo(self, mock_session, mock_distro):
+        self._create(mock_session)
+        report = os.path.join(self.path, 'timings.json')
+        stderr = io.StringIO()
+        with mock.patch('sys.argv', [
+                'repo-setup', 'bundle', 'install', self.bundle,
+                '--output-path', self.output, '--dlrn-hash-tag', 'ffff',
+                '--timings', report]), mock.patch('sys.stderr', stderr):
+            e = self.assertRaises(SystemExit, main.main)
+        self.assertEqual(1, e.code)
+        self.assertIn('ERROR: ', stderr.getvalue())
+        self.assertIn('is not in the bundle', stderr.getvalue())
+        with open(report) as f:
+            self.assertIn('BundleError', json.load(f)['error'])
+
+    def test_main_timings(self, mock_session, mock_distro):
+        self._create(mock_session)
+        report = os.path.join(self.path, 'timings.json')
+        with mock.patch('sys.argv', [
+                'repo-setup', 'bundle', 'install', self.bundle,
+                '--output-path', self.output, '--timings', report]):
+            main.main()
+        with open(report) as f:
+            data = json.load(f)
+        self.assertIsNone(data['error'])
+        self.assertIn('install', [phase['name'] for phase in data['phases']])
+
+    def test_load_checksum_mismatch(self, mock_session, mock_distro):
+        manifest = {'format_version': bundle.BUNDLE_FORMAT_VERSION,
+                    'files': {'http://r/delorean.repo': {
+                        'sha256': '0' * 64, 'size': 3}}}
+        with tarfile.open(self.bundle, 'w:gz') as tar:
+            for name, data in (
+                    ('manifest.json', json.dumps(manifest).encode()),
+                    ('files/' + '0' * 64, b'foo')):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        e = self.assertRaises(bundle.BundleError, bundle.load, self.bundle)
+        self.assertIn('Checksum mismatch for http://r/delorean.repo', str(e))
+
+    def test_load_invalid(self, mock_session, mock_distro):
+        with open(self.bundle, 'w') as f:
+            f.write('not a bundle')
+        self.assertRaises(bundle.BundleError, bundle.load, self.bundle)
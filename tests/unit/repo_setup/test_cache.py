@@ -0,0 +1,189 @@
+# Copyright 2021 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+from unittest import mock
+
+import fixtures
+import testtools
+
+from repo_setup import cache
+
+
+_makedirs = os.makedirs
+
+
+def racing_makedirs(name, *args, **kwargs):
+    """os.makedirs losing the race against another process creating name"""
+    _makedirs(name)
+    raise OSError(17, 'File exists')
+
+
+class TestHttpCache(testtools.TestCase):
+    def setUp(self):
+        super(TestHttpCache, self).setUp()
+        self.path = self.useFixture(fixtures.TempDir()).path
+        self.cache = cache.HttpCache(self.path, max_size=100)
+
+    def test_store_and_load(self):
+        self.cache.store('http://a/delorean.repo', '[delorean]', '"e1"',
+                         'Mon, 01 Jan 2024 00:00:00 GMT')
+        self.assertEqual('[delorean]',
+                         self.cache.load('http://a/delorean.repo'))
+        self.assertEqual(
+            {'If-None-Match': '"e1"',
+             'If-Modified-Since': 'Mon, 01 Jan 2024 00:00:00 GMT'},
+            self.cache.validators('http://a/delorean.repo'))
+
+    def test_miss(self):
+        self.assertIsNone(self.cache.load('http://a/missing.repo'))
+        self.assertEqual({}, self.cache.validators('http://a/missing.repo'))
+
+    def test_store_without_validators(self):
+        self.cache.store('http://a/delorean.repo', '[delorean]')
+        self.assertIsNone(self.cache.load('http://a/delorean.repo'))
+
+    def test_evict_lru(self):
+        self.cache.store('http://a/old', 'x' * 60, '"old"')
+        self.cache.store('http://a/new', 'y' * 30, '"new"')
+        meta_file = self.cache._entry('http://a/old')[0]
+        os.utime(meta_file, (1, 1))
+        self.cache.store('http://a/newer', 'z' * 30, '"newer"')
+        self.assertIsNone(self.cache.load('http://a/old'))
+        self.assertEqual('y' * 30, self.cache.load('http://a/new'))
+        self.assertEqual('z' * 30, self.cache.load('http://a/newer'))
+
+    def test_store_scans_once_under_max_size(self):
+        with mock.patch('os.listdir', side_effect=os.listdir) as listdir:
+            self.cache.store('http://a/one', 'x' * 30, '"one"')
+            self.cache.store('http://a/two', 'y' * 30, '"two"')
+            self.cache.store('http://a/one', 'z' * 40, '"one"')
+        self.assertEqual(1, listdir.call_count)
+        self.assertEqual(70, self.cache._size)
+
+    def test_store_over_max_size_evicts(self):
+        self.cache.store('http://a/old', 'x' * 60, '"old"')
+        os.utime(self.cache._entry('http://a/old')[0], (1, 1))
+        with mock.patch('os.listdir', side_effect=os.listdir) as listdir:
+            self.cache.store('http://a/new', 'y' * 60, '"new"')
+        self.assertEqual(1, listdir.call_count)
+        self.assertIsNone(self.cache.load('http://a/old'))
+        self.assertEqual(60, self.cache._size)
+
+    def test_disabled_on_unwritable_dir(self):
+        blocker = os.path.join(self.path, 'file')
+        open(blocker, 'w').close()
+        disabled = cache.HttpCache(blocker)
+        self.assertFalse(disabled.enabled)
+        disabled.store('http://a/delorean.repo', '[delorean]', '"e1"')
+        self.assertIsNone(disabled.load('http://a/delorean.repo'))
+
+    def test_dir_created_concurrently(self):
+        path = os.path.join(self.path, 'race')
+        with mock.patch('os.makedirs', side_effect=racing_makedirs):
+            racing = cache.HttpCache(path)
+        self.assertTrue(racing.enabled)
+
+    def test_get_http_cache_shared(self):
+        self.assertIs(cache.get_http_cache(self.path, 10),
+                      cache.get_http_cache(self.path, 10))
+
+
+class TestDefaultCacheDir(testtools.TestCase):
+    def test_root(self):
+        with mock.patch('os.geteuid', return_value=0, create=True):
+            self.assertEqual(cache.SYSTEM_CACHE_DIR,
+                             cache.get_default_cache_dir())
+
+    def test_user_xdg_cache_home(self):
+        self.useFixture(
+            fixtures.EnvironmentVariable('XDG_CACHE_HOME', '/xdg/cache'))
+        with mock.patch('os.geteuid', return_value=1000, create=True):
+            self.assertEqual('/xdg/cache/repo-setup',
+                             cache.get_default_cache_dir())
+
+    def test_user_home(self):
+        self.useFixture(fixtures.EnvironmentVariable('XDG_CACHE_HOME'))
+        self.useFixture(fixtures.EnvironmentVariable('HOME', '/home/user'))
+        with mock.patch('os.geteuid', return_value=1000, create=True):
+            self.assertEqual('/home/user/.cache/repo-setup',
+                             cache.get_default_cache_dir())
+
+
+class TestContentStore(testtools.TestCase):
+    url = 'http://r/current/b6/e7/b6e71147e9ec/delorean.repo'
+
+    def setUp(self):
+        super(TestContentStore, self).setUp()
+        self.path = self.useFixture(fixtures.TempDir()).path
+        self.store = cache.ContentStore(self.path)
+
+    def test_is_immutable_url(self):
+        self.assertTrue(cache.is_immutable_url(self.url))
+        self.assertTrue(cache.is_immutable_url(
+            'http://r/component/common/47/6a/476a52df_1f5a41f3/commit.yaml'))
+        self.assertFalse(cache.is_immutable_url(
+            'http://r/current/delorean.repo'))
+        self.assertFalse(cache.is_immutable_url(
+            'http://r/current/b6/e7/aaaa/delorean.repo'))
+
+    def test_store_and_load(self):
+        self.assertIsNone(self.store.load(self.url))
+        self.store.store(self.url, '[delorean]')
+        self.assertEqual('[delorean]', self.store.load(self.url))
+
+    def test_shared_objects(self):
+        self.store.store(self.url, '[delorean]')
+        self.store.store(self.url + '.copy', '[delorean]')
+        self.assertEqual(
+            1, len(os.listdir(self.store.objects_path)))
+
+    def test_corrupted_object(self):
+        self.store.store(self.url, '[delorean]')
+        name = os.listdir(self.store.objects_path)[0]
+        with open(os.path.join(self.store.objects_path, name), 'w') as f:
+            f.write('[tampered]')
+        self.assertIsNone(self.store.load(self.url))
+
+    def test_prune_age(self):
+        self.store.store(self.url, '[old]')
+        self.store.store(self.url + '.new', '[new]')
+        old = time.time() - 3600
+        os.utime(self.store._ref(self.url), (old, old))
+        self.assertEqual(1, self.store.prune(max_age=60))
+        self.assertIsNone(self.store.load(self.url))
+        self.assertEqual('[new]', self.store.load(self.url + '.new'))
+        self.assertEqual(1, len(os.listdir(self.store.objects_path)))
+
+    def test_prune_size(self):
+        self.store.store(self.url, 'x' * 10)
+        self.store.store(self.url + '.new', 'y' * 10)
+        os.utime(self.store._ref(self.url), (1, 1))
+        self.assertEqual(1, self.store.prune(max_size=15))
+        self.assertIsNone(self.store.load(self.url))
+        self.assertEqual('y' * 10, self.store.load(self.url + '.new'))
+
+    def test_dir_created_concurrently(self):
+        path = os.path.join(self.path, 'race')
+        with mock.patch('os.makedirs', side_effect=racing_makedirs):
+            racing = cache.ContentStore(path)
+        self.assertTrue(racing.enabled)
+        racing.store(self.url, '[delorean]')
+        self.assertEqual('[delorean]', racing.load(self.url))
+
+    def test_prune_nothing(self):
+        self.store.store(self.url, '[delorean]')
+        self.assertEqual(0, self.store.prune())
+        self.assertEqual('[delorean]', self.store.load(self.url))
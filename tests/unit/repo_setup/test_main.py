@@ -12,10 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
+import json
+import os
+import subprocess
 import sys
 from unittest import mock
 
 import ddt
+import fixtures
 import testtools
 
 from repo_setup import main
@@ -36,35 +41,483 @@ class TestTripleORepos(testtools.TestCase):
         args = main._parse_args('centos', '8')
         mock_path = mock.Mock()
         mock_gbp.return_value = mock_path
+        mock_install.return_value = [
+            main.WrittenRepo('/etc/yum.repos.d/delorean.repo',
+                             ['delorean'], True),
+            main.WrittenRepo('/etc/yum.repos.d/delorean-deps.repo',
+                             ['delorean-deps', 'centos9-rabbitmq'], False),
+        ]
         main.main()
         mock_validate.assert_called_once_with(args, 'CentOS 8', '8')
         mock_gbp.assert_called_once_with(args)
-        mock_remove.assert_called_once_with(args)
-        mock_clean.assert_called_once_with('centos8')
+        mock_install.assert_called_once_with(args, mock_path, cache=None,
+                                             output=print)
+        mock_remove.assert_called_once_with(
+            args, keep=['/etc/yum.repos.d/delorean.repo',
+                        '/etc/yum.repos.d/delorean-deps.repo'],
+            dry_run=False, output=print)
+        mock_clean.assert_called_once_with('centos8', ['delorean'],
+                                           output=print)
 
-    @mock.patch('requests.get')
-    def test_get_repo(self, mock_get):
+    @mock.patch('os.path.exists', return_value=True)
+    @mock.patch('repo_setup.main.get_distro_info')
+    def test_get_distro(self, mock_info, mock_exists):
+        mock_info.return_value = ('centos', '9', 'CentOS Stream')
+        self.assertEqual(('centos', '9', 'CentOS Stream'), main._get_distro())
+
+    @mock.patch('os.path.exists', return_value=True)
+    @mock.patch('repo_setup.main.get_distro_info')
+    def test_get_distro_unsupported(self, mock_info, mock_exists):
+        mock_info.return_value = ('debian', '12', 'Debian GNU/Linux')
+        self.assertEqual(('centos', '9', 'Debian GNU/Linux'),
+                         main._get_distro())
+
+    @mock.patch('repo_setup.session.get_session')
+    def test_get_repo(self, mock_session):
         mock_response = mock.Mock()
         mock_response.status_code = 200
         mock_response.text = '88MPH'
+        mock_get = mock_session.return_value.get
         mock_get.return_value = mock_response
         fake_addr = 'http://lone/pine/mall'
-        args = mock.Mock()
-        args.distro = 'centos'
+        args = mock.Mock(distro='centos', pool_size=4, connect_timeout=1.0,
+                         read_timeout=2.0, retries=0,
+                         deadline_at=None, rdo_fallback_mirrors=None,
+                         no_cache=True,
+                         old_mirror=None, mirror_map=None)
         content = main._get_repo(fake_addr, args)
         self.assertEqual('88MPH', content)
-        mock_get.assert_called_once_with(fake_addr)
+        mock_session.assert_called_once_with(4)
+        mock_get.assert_called_once_with(fake_addr, headers={},
+                                         timeout=(1.0, 2.0))
 
-    @mock.patch('requests.get')
-    def test_get_repo_404(self, mock_get):
+    @mock.patch('repo_setup.session.get_session')
+    def test_get_repo_404(self, mock_session):
         mock_response = mock.Mock()
         mock_response.status_code = 404
+        mock_get = mock_session.return_value.get
         mock_get.return_value = mock_response
         fake_addr = 'http://twin/pines/mall'
-        main._get_repo(fake_addr, mock.Mock())
-        mock_get.assert_called_once_with(fake_addr)
+        args = mock.Mock(pool_size=4, connect_timeout=1.0, read_timeout=2.0,
+                         retries=0, deadline_at=None,
+                         rdo_fallback_mirrors=None,
+                         no_cache=True)
+        main._get_repo(fake_addr, args)
+        mock_get.assert_called_once_with(fake_addr, headers={},
+                                         timeout=(1.0, 2.0))
         mock_response.raise_for_status.assert_called_once_with()
 
+    @mock.patch('repo_setup.cache.get_http_cache')
+    @mock.patch('repo_setup.session.get_session')
+    def test_get_repo_not_modified(self, mock_session, mock_cache):
+        mock_response = mock.Mock(status_code=304)
+        mock_get = mock_session.return_value.get
+        mock_get.return_value = mock_response
+        cache = mock_cache.return_value
+        cache.validators.return_value = {'If-None-Match': '"88"'}
+        cache.load.return_value = 'baseurl=https://trunk.rdoproject.org/x'
+        args = mock.Mock(pool_size=4, connect_timeout=1.0, read_timeout=2.0,
+                         retries=0, deadline_at=None,
+                         rdo_fallback_mirrors=None,
+                         no_cache=False, cache_dir='/tmp/cache',
+                         cache_max_size=10, rdo_mirror='http://bar',
+                         old_mirror=None, mirror_map=None)
+        content = main._get_repo('http://lone/pine', args)
+        self.assertEqual('baseurl=http://bar/x', content)
+        mock_cache.assert_called_once_with('/tmp/cache', 10)
+        mock_get.assert_called_once_with('http://lone/pine',
+                                         headers={'If-None-Match': '"88"'},
+                                         timeout=(1.0, 2.0))
+        cache.store.assert_not_called()
+
+    @mock.patch('repo_setup.cache.get_http_cache')
+    @mock.patch('repo_setup.session.get_session')
+    def test_get_repo_stores_validators(self, mock_session, mock_cache):
+        mock_response = mock.Mock(status_code=200, text='88MPH',
+                                  headers={'ETag': '"88"'})
+        mock_session.return_value.get.return_value = mock_response
+        cache = mock_cache.return_value
+        cache.validators.return_value = {}
+        args = mock.Mock(pool_size=4, connect_timeout=1.0, read_timeout=2.0,
+                         retries=0, deadline_at=None,
+                         rdo_fallback_mirrors=None,
+                         no_cache=False, old_mirror=None, mirror_map=None)
+        self.assertEqual('88MPH', main._get_repo('http://lone/pine', args))
+        cache.store.assert_called_once_with('http://lone/pine', '88MPH',
+                                            '"88"', None)
+
+    @mock.patch('repo_setup.cache.get_content_store')
+    @mock.patch('repo_setup.session.get_session')
+    def test_get_repo_immutable_stored(self, mock_session, mock_store):
+        store = mock_store.return_value
+        store.load.return_value = '88MPH'
+        args = mock.Mock(no_cache=False, cache_dir='/tmp/cache',
+                         old_mirror=None, mirror_map=None)
+        path = 'http://r/current/b6/e7/b6e71147e9ec/delorean.repo'
+        self.assertEqual('88MPH', main._get_repo(path, args))
+        mock_store.assert_called_once_with('/tmp/cache')
+        store.load.assert_called_once_with(path)
+        mock_session.assert_not_called()
+
+    @mock.patch('repo_setup.cache.get_content_store')
+    @mock.patch('repo_setup.session.get_session')
+    def test_get_repo_immutable_missing(self, mock_session, mock_store):
+        store = mock_store.return_value
+        store.load.return_value = None
+        mock_response = mock.Mock(status_code=200, text='88MPH')
+        mock_get = mock_session.return_value.get
+        mock_get.return_value = mock_response
+        args = mock.Mock(no_cache=False, pool_size=4, connect_timeout=1.0,
+                         read_timeout=2.0, retries=0,
+                         deadline_at=None, rdo_fallback_mirrors=None,
+                         old_mirror=None, mirror_map=None)
+        path = 'http://r/current/b6/e7/b6e71147e9ec/delorean.repo'
+        self.assertEqual('88MPH', main._get_repo(path, args))
+        mock_get.assert_called_once_with(path, headers=None,
+                                         timeout=(1.0, 2.0))
+        store.store.assert_called_once_with(path, '88MPH')
+
+    def _md5_args(self, **kwargs):
+        args = mock.Mock(pool_size=4, connect_timeout=1.0, read_timeout=2.0,
+                         retries=0, deadline_at=None,
+                         rdo_fallback_mirrors=None, no_cache=False,
+                         old_mirror=None, mirror_map=None, recorder=None)
+        for key, value in kwargs.items():
+            setattr(args, key, value)
+        return args
+
+    @mock.patch('repo_setup.cache.get_http_cache')
+    @mock.patch('repo_setup.session.get_session')
+    def test_get_repo_md5_unchanged(self, mock_session, mock_cache):
+        mock_get = mock_session.return_value.get
+        mock_get.return_value = mock.Mock(
+            status_code=200, text=main._md5('88MPH') + '\n')
+        cache = mock_cache.return_value
+        cache.load.return_value = '88MPH'
+        path = 'http://r/centos9-master/current/delorean.repo'
+        self.assertEqual('88MPH', main._get_repo(path, self._md5_args()))
+        mock_get.assert_called_once_with(path + '.md5', headers=None,
+                                         timeout=(1.0, 2.0))
+        cache.validators.assert_not_called()
+
+    @mock.patch('repo_setup.cache.get_http_cache')
+    @mock.patch('repo_setup.session.get_session')
+    def test_get_repo_md5_changed(self, mock_session, mock_cache):
+        mock_get = mock_session.return_value.get
+        mock_get.side_effect = [
+            mock.Mock(status_code=200, text=main._md5('88MPH')),
+            mock.Mock(status_code=200, text='88MPH', content=b'88MPH',
+                      headers={}),
+        ]
+        cache = mock_cache.return_value
+        cache.load.return_value = '1.21GW'
+        cache.validators.return_value = {}
+        path = 'http://r/centos9-master/current/delorean.repo'
+        stats = collections.Counter()
+        self.assertEqual('88MPH', main._get_repo(path, self._md5_args(),
+                                                 stats))
+        self.assertEqual(path, mock_get.call_args[0][0])
+        cache.store.assert_called_once_with(path, '88MPH', None, None)
+        self.assertEqual({'download': 1}, dict(stats))
+
+    @mock.patch('repo_setup.session.get_session')
+    def test_get_repo_md5_mismatch(self, mock_session):
+        mock_get = mock_session.return_value.get
+        mock_get.side_effect = [
+            mock.Mock(status_code=200, text=main._md5('88MPH')),
+            mock.Mock(status_code=200, text='1.21GW', content=b'1.21GW'),
+            mock.Mock(status_code=200, text=main._md5('88MPH')),
+        ]
+        path = 'http://r/centos9-master/current/delorean.repo'
+        # checked without a cache too
+        self.assertRaises(main.RepoChecksumError, main._get_repo, path,
+                          self._md5_args(no_cache=True))
+
+    @mock.patch('repo_setup.cache.get_http_cache')
+    @mock.patch('repo_setup.session.get_session')
+    def test_get_repo_md5_mismatch_not_cached(self, mock_session,
+                                              mock_cache):
+        mock_cache.return_value.load.return_value = None
+        mock_cache.return_value.validators.return_value = {}
+        mock_get = mock_session.return_value.get
+        mock_get.side_effect = [
+            mock.Mock(status_code=200, text=main._md5('88MPH')),
+            mock.Mock(status_code=200, text='1.21GW', content=b'1.21GW'),
+            mock.Mock(status_code=200, text=main._md5('88MPH')),
+        ]
+        path = 'http://r/centos9-master/current/delorean.repo'
+        self.assertRaises(main.RepoChecksumError, main._get_repo, path,
+                          self._md5_args())
+        mock_cache.return_value.store.assert_not_called()
+
+    @mock.patch('repo_setup.session.get_session')
+    def test_get_repo_md5_moved(self, mock_session):
+        mock_get = mock_session.return_value.get
+        mock_get.side_effect = [
+            mock.Mock(status_code=200, text=main._md5('88MPH')),
+            mock.Mock(status_code=200, text='1.21GW', content=b'1.21GW'),
+            mock.Mock(status_code=200, text=main._md5('1.21GW')),
+        ]
+        path = 'http://r/centos9-master/current/delorean.repo'
+        self.assertEqual('1.21GW', main._get_repo(
+            path, self._md5_args(no_cache=True)))
+
+    @mock.patch('repo_setup.session.get_session')
+    def test_get_repo_md5_raw_bytes(self, mock_session):
+        data = u'[delorean]\nname=caf\xe9\n'.encode('utf-8')
+        mock_get = mock_session.return_value.get
+        mock_get.side_effect = [
+            mock.Mock(status_code=200, text=main._md5(data)),
+            # decoded with the latin-1 requests guesses for text/plain
+            mock.Mock(status_code=200, text=data.decode('latin-1'),
+                      content=data),
+        ]
+        path = 'http://r/centos9-master/current/delorean.repo'
+        self.assertEqual(data.decode('latin-1'), main._get_repo(
+            path, self._md5_args(no_cache=True)))
+
+    @mock.patch('repo_setup.session.get_session')
+    def test_get_repo_md5_missing(self, mock_session):
+        mock_get = mock_session.return_value.get
+        mock_get.side_effect = [
+            mock.Mock(status_code=404),
+            mock.Mock(status_code=200, text='88MPH'),
+        ]
+        path = 'http://r/centos9-master/current/delorean.repo'
+        self.assertEqual('88MPH', main._get_repo(
+            path, self._md5_args(no_cache=True)))
+
+    @mock.patch('repo_setup.cache.get_http_cache')
+    @mock.patch('repo_setup.session.get_session')
+    def test_get_repo_md5_error(self, mock_session, mock_cache):
+        mock_cache.return_value.validators.return_value = {}
+        mock_get = mock_session.return_value.get
+        mock_get.side_effect = [
+            IOError('connection reset'),
+            mock.Mock(status_code=200, text='88MPH', headers={}),
+        ]
+        path = 'http://r/centos9-master/current/delorean.repo'
+        with mock.patch('sys.stderr'):
+            self.assertEqual('88MPH', main._get_repo(path, self._md5_args()))
+        mock_cache.return_value.load.assert_not_called()
+        mock_cache.return_value.store.assert_called_once_with(
+            path, '88MPH', None, None)
+
+    def test_get_failover_urls(self):
+        args = mock.Mock(rdo_mirror='https://trunk.rdoproject.org',
+                         rdo_fallback_mirrors='http://a/, http://b')
+        self.assertEqual(
+            ['https://trunk.rdoproject.org/centos9/delorean.repo',
+             'http://a/centos9/delorean.repo',
+             'http://b/centos9/delorean.repo'],
+            main._get_failover_urls(
+                'https://trunk.rdoproject.org/centos9/delorean.repo', args))
+        self.assertEqual(
+            ['http://mirror/ceph.repo'],
+            main._get_failover_urls('http://mirror/ceph.repo', args))
+
+    @mock.patch('time.sleep')
+    @mock.patch('repo_setup.session.get_session')
+    def test_get_repo_failover(self, mock_session, mock_sleep):
+        mock_get = mock_session.return_value.get
+        mock_get.side_effect = [mock.Mock(status_code=503),
+                                mock.Mock(status_code=200, text='88MPH')]
+        args = mock.Mock(pool_size=4, connect_timeout=1.0, read_timeout=2.0,
+                         retries=0, backoff=0, deadline_at=None,
+                         rdo_mirror='http://r',
+                         rdo_fallback_mirrors='http://f',
+                         no_cache=True, old_mirror=None, mirror_map=None)
+        stderr = self.useFixture(fixtures.StringStream('stderr')).stream
+        self.useFixture(fixtures.MonkeyPatch('sys.stderr', stderr))
+        self.assertEqual('88MPH',
+                         main._get_repo('http://r/delorean-deps.repo', args))
+        self.assertEqual('http://f/delorean-deps.repo',
+                         mock_get.call_args[0][0])
+        args.recorder.record_retry.assert_called_once_with(
+            'http://r/delorean-deps.repo', 1, 'HTTP 503', 0,
+            'http://f/delorean-deps.repo')
+        stderr.seek(0)
+        self.assertIn('failing over to http://f/delorean-deps.repo',
+                      stderr.read())
+
+    @mock.patch('repo_setup.cache.get_http_cache')
+    @mock.patch('repo_setup.session.get_session')
+    def test_get_repo_records_timings(self, mock_session, mock_cache):
+        mock_response = mock.Mock(status_code=304)
+        mock_session.return_value.get.return_value = mock_response
+        cache = mock_cache.return_value
+        cache.validators.return_value = {'If-None-Match': '"88"'}
+        cache.load.return_value = '88MPH'
+        args = mock.Mock(pool_size=4, connect_timeout=1.0, read_timeout=2.0,
+                         retries=0, deadline_at=None,
+                         rdo_fallback_mirrors=None,
+                         no_cache=False, old_mirror=None, mirror_map=None)
+        main._get_repo('http://lone/pine', args)
+        url, seconds, status, size, state = \
+            args.recorder.record_fetch.call_args[0]
+        self.assertEqual(('http://lone/pine', 304, 0, 'revalidated'),
+                         (url, status, size, state))
+        self.assertGreaterEqual(seconds, 0)
+
+    @mock.patch('repo_setup.cache.get_content_store')
+    @mock.patch('repo_setup.cache.get_http_cache')
+    @mock.patch('repo_setup.session.get_session')
+    def test_get_repo_records_hits(self, mock_session, mock_cache,
+                                   mock_store):
+        mock_session.return_value.get.return_value = mock.Mock(
+            status_code=200, text=main._md5('88MPH'))
+        mock_cache.return_value.load.return_value = '88MPH'
+        mock_store.return_value.load.return_value = '88MPH'
+        args = self._md5_args(recorder=mock.Mock())
+        stats = collections.Counter()
+        main._get_repo('http://r/centos9-master/current/delorean.repo', args,
+                       stats)
+        main._get_repo('http://r/current/b6/e7/b6e71147e9ec/delorean.repo',
+                       args, stats)
+        self.assertEqual({'hit': 2}, dict(stats))
+        cache = main.FetchCache(args, mock.Mock(return_value='88MPH'))
+        cache.get('http://r/centos9-master/current/delorean.repo')
+        cache.get('http://r/centos9-master/current/delorean.repo')
+        fetches = [c[0] for c in args.recorder.record_fetch.call_args_list]
+        # only the md5 is downloaded, the hits record no bytes
+        self.assertEqual(
+            [(None, 0, 'md5'), (None, 0, 'immutable'), (None, 0, 'run')],
+            [(status, size, state)
+             for url, seconds, status, size, state in fetches
+             if not url.endswith('.md5')])
+        self.assertEqual(
+            [(200, 32, 'bypass')],
+            [(status, size, state)
+             for url, seconds, status, size, state in fetches
+             if url.endswith('.md5')])
+
+    @mock.patch('repo_setup.session.get_session')
+    def test_get_repo_records_timings_404(self, mock_session):
+        mock_response = mock.Mock(status_code=404)
+        mock_session.return_value.get.return_value = mock_response
+        args = mock.Mock(pool_size=4, connect_timeout=1.0, read_timeout=2.0,
+                         retries=0, deadline_at=None,
+                         rdo_fallback_mirrors=None,
+                         no_cache=True)
+        main._get_repo('http://twin/pines', args)
+        self.assertEqual(
+            ('http://twin/pines', 404, 0, 'bypass'),
+            tuple(args.recorder.record_fetch.call_args[0][i]
+                  for i in (0, 2, 3, 4)))
+
+    def _mirror_args(self, **kwargs):
+        args = mock.Mock(probe_mirrors=True, mirror_config=None,
+                         mirror_candidates=None, rdo_mirror_candidates=None,
+                         distro='centos9', mirror='http://default',
+                         old_mirror='http://default',
+                         rdo_mirror=main.DEFAULT_RDO_MIRROR, no_cache=True,
+                         pool_size=4, probe_timeout=1.0, recorder=None)
+        for key, value in kwargs.items():
+            setattr(args, key, value)
+        return args
+
+    @mock.patch('repo_setup.mirrors.select_mirror')
+    @mock.patch('repo_setup.session.get_session')
+    def test_select_mirrors(self, mock_session, mock_select):
+        probes = [main.mirrors.MirrorProbe('http://a/', 0.2, 200, None),
+                  main.mirrors.MirrorProbe('http://b', 0.1, None, 'timeout')]
+        mock_select.return_value = ('http://a/', probes)
+        args = self._mirror_args(mirror_candidates='http://a/, http://b',
+                                 rdo_mirror_candidates='http://rdo')
+        main._select_mirrors(args)
+        self.assertEqual('http://a', args.mirror)
+        self.assertEqual('http://rdo', args.rdo_mirror)
+        mock_select.assert_called_once_with(
+            mock_session.return_value, ['http://a/', 'http://b'], 1.0, None)
+
+    @mock.patch('repo_setup.mirrors.select_mirror')
+    @mock.patch('repo_setup.session.get_session')
+    def test_select_mirrors_explicit(self, mock_session, mock_select):
+        args = self._mirror_args(mirror='http://mine',
+                                 mirror_candidates='http://a,http://b')
+        main._select_mirrors(args)
+        self.assertEqual('http://mine', args.mirror)
+        mock_select.assert_not_called()
+
+    @mock.patch('repo_setup.mirrors.select_mirror')
+    @mock.patch('repo_setup.session.get_session')
+    def test_select_mirrors_config_unhealthy(self, mock_session,
+                                             mock_select):
+        config = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                              'mirrors.json')
+        with open(config, 'w') as f:
+            json.dump({'centos9': ['http://a', 'http://b'],
+                       'centos10': ['http://c']}, f)
+        mock_select.return_value = (None, [])
+        args = self._mirror_args(mirror_config=config)
+        main._select_mirrors(args)
+        self.assertEqual('http://default', args.mirror)
+        self.assertEqual(['http://a', 'http://b'],
+                         mock_select.call_args[0][1])
+
+    def test_select_mirrors_bad_config(self):
+        args = self._mirror_args(mirror_config='/does/not/exist.json')
+        self.assertRaises(main.InvalidArguments, main._select_mirrors, args)
+
+    @mock.patch('repo_setup.main._get_distro')
+    @mock.patch('repo_setup.main._run_pkg_clean')
+    @mock.patch('repo_setup.main._validate_args')
+    @mock.patch('repo_setup.main._get_base_path')
+    @mock.patch('repo_setup.main._remove_existing')
+    @mock.patch('repo_setup.main._install_repos')
+    def test_main_timings(self, mock_install, mock_remove, mock_gbp,
+                          mock_validate, mock_clean, mock_distro):
+        report = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                              'timings.json')
+        mock_distro.return_value = ('centos', '9', 'CentOS Stream')
+        mock_install.return_value = []
+        with mock.patch('sys.argv', ['repo-setup', 'current',
+                                     '--timings', report]):
+            main.main()
+        with open(report) as f:
+            data = json.load(f)
+        self.assertEqual(['get_distro', 'parse_args', 'validate',
+                          'select_mirrors', 'install',
+                          'remove_existing', 'pkg_clean', 'prune_store'],
+                         [phase['name'] for phase in data['phases']])
+        self.assertIsNone(data['error'])
+        self.assertIs(mock_install.call_args[0][0].recorder.__class__,
+                      main.timings.Timings)
+
+    @mock.patch('repo_setup.main._get_distro')
+    @mock.patch('repo_setup.main._validate_args')
+    @mock.patch('repo_setup.main._get_base_path')
+    @mock.patch('repo_setup.main._install_repos')
+    def test_main_timings_env_error(self, mock_install, mock_gbp,
+                                    mock_validate, mock_distro):
+        report = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                              'timings.json')
+        self.useFixture(fixtures.EnvironmentVariable(
+            'REPO_SETUP_TIMINGS', report))
+        mock_distro.return_value = ('centos', '9', 'CentOS Stream')
+        mock_install.side_effect = main.NoRepoTitle('no title')
+        with mock.patch('sys.argv', ['repo-setup', 'current']):
+            self.assertRaises(main.NoRepoTitle, main.main)
+        with open(report) as f:
+            data = json.load(f)
+        self.assertEqual('NoRepoTitle: no title', data['error'])
+        self.assertEqual('install', data['phases'][-1]['name'])
+
+    @mock.patch('repo_setup.cache.get_content_store')
+    def test_prune_content_store(self, mock_store):
+        args = mock.Mock(no_cache=False, store_max_age=2,
+                         store_max_size=None)
+        mock_store.return_value.prune.return_value = 0
+        main._prune_content_store(args)
+        mock_store.return_value.prune.assert_called_once_with(
+            max_age=2 * 24 * 60 * 60, max_size=None)
+
+    @mock.patch('repo_setup.cache.get_content_store')
+    def test_prune_content_store_unset(self, mock_store):
+        args = mock.Mock(store_max_age=None, store_max_size=None)
+        main._prune_content_store(args)
+        mock_store.assert_not_called()
+
     @mock.patch('os.listdir')
     @mock.patch('os.remove')
     @mock.patch('os.path.exists')
@@ -90,6 +543,22 @@ class TestTripleORepos(testtools.TestCase):
         self.assertNotIn(mock.call('/etc/yum.repos.d/foo.repo'),
                          mock_remove.mock_calls)
 
+    @mock.patch('os.listdir')
+    @mock.patch('os.remove')
+    @mock.patch('os.path.exists')
+    def test_remove_existing_keep(self, mock_exists, mock_remove,
+                                  mock_listdir):
+        mock_exists.return_value = True
+        mock_listdir.return_value = ['delorean.repo', 'delorean-old.repo']
+        mock_args = mock.Mock()
+        mock_args.output_path = '/etc/yum.repos.d'
+        main._remove_existing(mock_args,
+                              keep=['/etc/yum.repos.d/delorean.repo'])
+        self.assertNotIn(mock.call('/etc/yum.repos.d/delorean.repo'),
+                         mock_remove.mock_calls)
+        self.assertIn(mock.call('/etc/yum.repos.d/delorean-old.repo'),
+                      mock_remove.mock_calls)
+
     # There is no $DISTRO single path anymore, every path has branch
     # specification, even master
     def test_get_base_path(self):
@@ -109,15 +578,19 @@ class TestTripleORepos(testtools.TestCase):
         args.branch = 'master'
         args.output_path = 'test'
         args.distro = 'fake'
+        args.max_workers = 1
         mock_get.return_value = '[delorean]\nMr. Fusion'
         main._install_repos(args, 'roads/')
-        self.assertEqual([mock.call('roads/current/delorean.repo', args),
-                          mock.call('roads/delorean-deps.repo', args),
+        self.assertEqual([mock.call('roads/current/delorean.repo',
+                                    args, mock.ANY),
+                          mock.call('roads/delorean-deps.repo',
+                                    args, mock.ANY),
                           ],
                          mock_get.mock_calls)
         self.assertEqual([mock.call('[delorean]\nMr. Fusion', 'test',
-                                    name='delorean'),
-                          mock.call('[delorean]\nMr. Fusion', 'test'),
+                                    name='delorean', output=print),
+                          mock.call('[delorean]\nMr. Fusion', 'test',
+                                    output=print),
                           ],
                          mock_write.mock_calls)
 
@@ -129,11 +602,139 @@ class TestTripleORepos(testtools.TestCase):
         args.branch = 'master'
         args.output_path = 'test'
         args.distro = 'fake'
+        args.max_workers = 1
         mock_get.return_value = '[delorean-deps]\nMr. Fusion'
         main._install_repos(args, 'roads/')
-        mock_get.assert_called_once_with('roads/delorean-deps.repo', args)
+        mock_get.assert_called_once_with('roads/delorean-deps.repo', args,
+                                         mock.ANY)
         mock_write.assert_called_once_with('[delorean-deps]\nMr. Fusion',
-                                           'test')
+                                           'test', output=print)
+
+    @mock.patch('repo_setup.main._get_repo')
+    @mock.patch('repo_setup.main._write_repo')
+    def test_install_repos_concurrent(self, mock_write, mock_get):
+        args = mock.Mock()
+        args.repos = ['current', 'deps']
+        args.dlrn_hash_tag = None
+        args.output_path = 'test'
+        args.distro = 'fake'
+        args.max_workers = 4
+        mock_get.side_effect = lambda path, args, stats: '[%s]' % path
+        main._install_repos(args, 'roads/')
+        self.assertCountEqual([mock.call('roads/current/delorean.repo',
+                                         args, mock.ANY),
+                               mock.call('roads/delorean-deps.repo',
+                                         args, mock.ANY),
+                               ],
+                              mock_get.mock_calls)
+        self.assertEqual([mock.call('[roads/current/delorean.repo]', 'test',
+                                    name='delorean', output=print),
+                          mock.call('[roads/delorean-deps.repo]', 'test',
+                                    output=print),
+                          ],
+                         mock_write.mock_calls)
+
+    @mock.patch('repo_setup.main._get_repo')
+    @mock.patch('repo_setup.main._write_repo')
+    def test_install_repos_fetch_error(self, mock_write, mock_get):
+        args = mock.Mock()
+        args.repos = ['current']
+        args.dlrn_hash_tag = None
+        args.output_path = 'test'
+        args.distro = 'fake'
+        args.max_workers = 4
+
+        def fake_get(path, args, stats):
+            if path.endswith('deps.repo'):
+                raise ValueError(path)
+            return '[delorean]'
+
+        mock_get.side_effect = fake_get
+        self.assertRaises(ValueError, main._install_repos, args, 'roads/')
+        mock_write.assert_not_called()
+
+    @mock.patch('repo_setup.main._get_repo')
+    @mock.patch('repo_setup.main._write_repo')
+    def test_install_repos_rhel_deps(self, mock_write, mock_get):
+        args = mock.Mock()
+        args.repos = ['deps']
+        args.output_path = 'test'
+        args.distro = 'rhel9'
+        args.max_workers = 1
+        mock_get.return_value = ('[osptrunk-deps]\nbaseurl=deps\n'
+                                 'priority=1\nmodule_hotfixes=1')
+        main._install_repos(args, 'roads/')
+        mock_get.assert_called_once_with('roads/osptrunk-deps.repo', args,
+                                         mock.ANY)
+        mock_write.assert_called_once_with(
+            '[osptrunk-candidate]\nbaseurl=candidate\npriority=30', 'test',
+            name='osp-trunk-candidate', output=print)
+
+    @mock.patch('repo_setup.main._get_repo')
+    @mock.patch('repo_setup.main._write_repo')
+    def test_install_repos_shared_cache(self, mock_write, mock_get):
+        args = mock.Mock()
+        args.repos = ['deps', 'current']
+        args.dlrn_hash_tag = None
+        args.output_path = 'test'
+        args.distro = 'rhel9'
+        args.max_workers = 1
+
+        def fake_get(path, args, stats):
+            stats['download'] += 1
+            return '[osptrunk-deps]\nmodule_hotfixes=1'
+
+        mock_get.side_effect = fake_get
+        cache = main.FetchCache(args)
+        main._install_repos(args, 'roads/', cache)
+        self.assertEqual([mock.call('roads/osptrunk-deps.repo',
+                                    args, mock.ANY),
+                          mock.call('roads/current/delorean.repo',
+                                    args, mock.ANY),
+                          ],
+                         mock_get.mock_calls)
+        self.assertEqual(2, len(mock_write.mock_calls))
+        self.assertEqual(2, cache.downloads)
+        self.assertEqual(1, cache.hits)
+
+    @mock.patch('repo_setup.main._get_repo')
+    def test_fetch_cache(self, mock_get):
+        args = mock.Mock()
+        args.max_workers = 2
+
+        def fake_get(path, args, stats):
+            stats['download' if path != 'b' else 'hit'] += 1
+            return path.upper()
+
+        mock_get.side_effect = fake_get
+        cache = main.FetchCache(args)
+        cache.prefetch(['a', 'b'])
+        cache.prefetch(['b'])
+        self.assertEqual('A', cache.get('a'))
+        self.assertEqual('A', cache.get('a'))
+        self.assertEqual('C', cache.get('c'))
+        self.assertEqual(3, len(mock_get.mock_calls))
+        # b came from the http cache
+        self.assertEqual(2, cache.downloads)
+        self.assertEqual(2, cache.hits)
+
+    @mock.patch('repo_setup.main._inject_mirrors')
+    @mock.patch('repo_setup.main._fetch_repo')
+    @mock.patch('repo_setup.main._get_repo_urls')
+    def test_prefetch_matrix_target_args(self, mock_urls, mock_fetch,
+                                         mock_inject):
+        first = mock.Mock(max_workers=2)
+        second = mock.Mock(max_workers=2, no_cache=True)
+        mock_urls.side_effect = lambda args, base_path: base_path
+        mock_fetch.side_effect = lambda path, args, stats: path
+        mock_inject.side_effect = lambda content, args: content
+        caches = main._prefetch_matrix(
+            [(first, ['a', 'b']), (second, ['b', 'c'])], mock.MagicMock())
+        # each url is fetched once, with the args of a target requesting it
+        self.assertEqual(3, len(mock_fetch.call_args_list))
+        self.assertEqual({'a': first, 'b': first, 'c': second},
+                         dict(c[0][:2] for c in mock_fetch.call_args_list))
+        self.assertEqual('c', caches[1].get('c'))
 
     @mock.patch('repo_setup.main._get_repo')
     @mock.patch('repo_setup.main._write_repo')
@@ -144,15 +745,19 @@ class TestTripleORepos(testtools.TestCase):
         args.branch = 'master'
         args.output_path = 'test'
         args.distro = 'fake'
+        args.max_workers = 1
         mock_get.return_value = '[delorean]\nMr. Fusion'
         main._install_repos(args, 'roads/')
         self.assertEqual([mock.call('roads/current-podified/delorean.repo',
-                                    args),
-                          mock.call('roads/delorean-deps.repo', args),
+                                    args, mock.ANY),
+                          mock.call('roads/delorean-deps.repo',
+                                    args, mock.ANY),
                           ],
                          mock_get.mock_calls)
-        self.assertEqual([mock.call('[delorean]\nMr. Fusion', 'test'),
-                          mock.call('[delorean]\nMr. Fusion', 'test'),
+        self.assertEqual([mock.call('[delorean]\nMr. Fusion', 'test',
+                                    output=print),
+                          mock.call('[delorean]\nMr. Fusion', 'test',
+                                    output=print),
                           ],
                          mock_write.mock_calls)
 
@@ -165,15 +770,19 @@ class TestTripleORepos(testtools.TestCase):
         args.branch = 'master'
         args.output_path = 'test'
         args.distro = 'fake'
+        args.max_workers = 1
         mock_get.return_value = '[delorean]\nMr. Fusion'
         main._install_repos(args, 'roads/')
         self.assertEqual([mock.call('roads/podified-ci-testing/delorean.repo',
-                                    args),
-                          mock.call('roads/delorean-deps.repo', args),
+                                    args, mock.ANY),
+                          mock.call('roads/delorean-deps.repo',
+                                    args, mock.ANY),
                           ],
                          mock_get.mock_calls)
-        self.assertEqual([mock.call('[delorean]\nMr. Fusion', 'test'),
-                          mock.call('[delorean]\nMr. Fusion', 'test'),
+        self.assertEqual([mock.call('[delorean]\nMr. Fusion', 'test',
+                                    output=print),
+                          mock.call('[delorean]\nMr. Fusion', 'test',
+                                    output=print),
                           ],
                          mock_write.mock_calls)
 
@@ -197,7 +806,8 @@ class TestTripleORepos(testtools.TestCase):
         mock_create_ceph.return_value = mock_repo
         main._install_repos(args, 'roads/')
         mock_create_ceph.assert_called_once_with(args, ceph_release[branch])
-        mock_write_repo.assert_called_once_with(mock_repo, 'test')
+        mock_write_repo.assert_called_once_with(mock_repo, 'test',
+                                                output=print)
 
     def test_install_repos_invalid(self):
         args = mock.Mock()
@@ -214,29 +824,33 @@ class TestTripleORepos(testtools.TestCase):
         args.branch = 'master'
         args.output_path = 'test'
         args.distro = 'centos8'
+        args.max_workers = 1
         args.stream = False
         args.mirror = 'mirror'
         mock_get.return_value = '[delorean]\nMr. Fusion'
         main._install_repos(args, 'roads/')
-        self.assertEqual([mock.call('roads/current/delorean.repo', args),
-                          mock.call('roads/delorean-deps.repo', args),
+        self.assertEqual([mock.call('roads/current/delorean.repo',
+                                    args, mock.ANY),
+                          mock.call('roads/delorean-deps.repo',
+                                    args, mock.ANY),
                           ],
                          mock_get.mock_calls)
         self.assertEqual([mock.call('[delorean]\nMr. Fusion', 'test',
-                                    name='delorean'),
-                          mock.call('[delorean]\nMr. Fusion', 'test'),
+                                    name='delorean', output=print),
+                          mock.call('[delorean]\nMr. Fusion', 'test',
+                                    output=print),
                           mock.call((
                               '\n[repo-setup-centos-highavailability]\n'
                               'name=repo-setup-centos-highavailability\n'
                               'baseurl=mirror/centos/8/HighAvailability'
                               '/$basearch/os/\ngpgcheck=0\nenabled=1\n'),
-                              'test'),
+                              'test', output=print),
                           mock.call((
                               '\n[repo-setup-centos-powertools]\n'
                               'name=repo-setup-centos-powertools\n'
                               'baseurl=mirror/centos/8/PowerTools'
                               '/$basearch/os/\ngpgcheck=0\nenabled=1\n'),
-                              'test')
+                              'test', output=print)
                           ],
                          mock_write.mock_calls)
 
@@ -248,31 +862,35 @@ class TestTripleORepos(testtools.TestCase):
         args.branch = 'master'
         args.output_path = 'test'
         args.distro = 'centos8'
+        args.max_workers = 1
         args.stream = True
         args.no_stream = False
         args.mirror = 'mirror'
         args.dlrn_hash_tag = None
         mock_get.return_value = '[delorean]\nMr. Fusion'
         main._install_repos(args, 'roads/')
-        self.assertEqual([mock.call('roads/current/delorean.repo', args),
-                          mock.call('roads/delorean-deps.repo', args),
+        self.assertEqual([mock.call('roads/current/delorean.repo',
+                                    args, mock.ANY),
+                          mock.call('roads/delorean-deps.repo',
+                                    args, mock.ANY),
                           ],
                          mock_get.mock_calls)
         self.assertEqual([mock.call('[delorean]\nMr. Fusion', 'test',
-                                    name='delorean'),
-                          mock.call('[delorean]\nMr. Fusion', 'test'),
+                                    name='delorean', output=print),
+                          mock.call('[delorean]\nMr. Fusion', 'test',
+                                    output=print),
                           mock.call((
                               '\n[repo-setup-centos-highavailability]\n'
                               'name=repo-setup-centos-highavailability\n'
                               'baseurl=mirror/centos/8-stream/HighAvailability'
                               '/$basearch/os/\ngpgcheck=0\nenabled=1\n'),
-                              'test'),
+                              'test', output=print),
                           mock.call((
                               '\n[repo-setup-centos-powertools]\n'
                               'name=repo-setup-centos-powertools\n'
                               'baseurl=mirror/centos/8-stream/PowerTools'
                               '/$basearch/os/\ngpgcheck=0\nenabled=1\n'),
-                              'test')
+                              'test', output=print)
                           ],
                          mock_write.mock_calls)
 
@@ -285,42 +903,46 @@ class TestTripleORepos(testtools.TestCase):
         args.branch = 'master'
         args.output_path = 'test'
         args.distro = 'centos9'
+        args.max_workers = 1
         args.stream = True
         args.no_stream = False
         args.mirror = 'mirror'
         mock_get.return_value = '[delorean]\nMr. Fusion'
         main._install_repos(args, 'roads/')
-        self.assertEqual([mock.call('roads/current/delorean.repo', args),
-                          mock.call('roads/delorean-deps.repo', args),
+        self.assertEqual([mock.call('roads/current/delorean.repo',
+                                    args, mock.ANY),
+                          mock.call('roads/delorean-deps.repo',
+                                    args, mock.ANY),
                           ],
                          mock_get.mock_calls)
         self.assertEqual([mock.call('[delorean]\nMr. Fusion', 'test',
-                                    name='delorean'),
-                          mock.call('[delorean]\nMr. Fusion', 'test'),
+                                    name='delorean', output=print),
+                          mock.call('[delorean]\nMr. Fusion', 'test',
+                                    output=print),
                           mock.call((
                               '\n[repo-setup-centos-highavailability]\n'
                               'name=repo-setup-centos-highavailability\n'
                               'baseurl=mirror/9-stream/HighAvailability'
                               '/$basearch/os/\ngpgcheck=0\nenabled=1\n'),
-                              'test'),
+                              'test', output=print),
                           mock.call((
                               '\n[repo-setup-centos-powertools]\n'
                               'name=repo-setup-centos-powertools\n'
                               'baseurl=mirror/9-stream/CRB'
                               '/$basearch/os/\ngpgcheck=0\nenabled=1\n'),
-                              'test'),
+                              'test', output=print),
                           mock.call((
                               '\n[repo-setup-centos-appstream]\n'
                               'name=repo-setup-centos-appstream\n'
                               'baseurl=mirror/9-stream/AppStream'
                               '/$basearch/os/\ngpgcheck=0\nenabled=1\n\n'),
-                              'test'),
+                              'test', output=print),
                           mock.call((
                               '\n[repo-setup-centos-baseos]\n'
                               'name=repo-setup-centos-baseos\n'
                               'baseurl=mirror/9-stream/BaseOS'
                               '/$basearch/os/\ngpgcheck=0\nenabled=1\n'),
-                              'test')
+                              'test', output=print)
                           ],
                          mock_write.mock_calls)
 
@@ -333,30 +955,34 @@ class TestTripleORepos(testtools.TestCase):
         args.branch = 'master'
         args.output_path = 'test'
         args.distro = 'centos8'
+        args.max_workers = 1
         args.stream = False
         args.no_stream = True
         args.mirror = 'mirror'
         mock_get.return_value = '[delorean]\nMr. Fusion'
         main._install_repos(args, 'roads/')
-        self.assertEqual([mock.call('roads/current/delorean.repo', args),
-                          mock.call('roads/delorean-deps.repo', args),
+        self.assertEqual([mock.call('roads/current/delorean.repo',
+                                    args, mock.ANY),
+                          mock.call('roads/delorean-deps.repo',
+                                    args, mock.ANY),
                           ],
                          mock_get.mock_calls)
         self.assertEqual([mock.call('[delorean]\nMr. Fusion', 'test',
-                                    name='delorean'),
-                          mock.call('[delorean]\nMr. Fusion', 'test'),
+                                    name='delorean', output=print),
+                          mock.call('[delorean]\nMr. Fusion', 'test',
+                                    output=print),
                           mock.call((
                               '\n[repo-setup-centos-highavailability]\n'
                               'name=repo-setup-centos-highavailability\n'
                               'baseurl=mirror/centos/8/HighAvailability'
                               '/$basearch/os/\ngpgcheck=0\nenabled=1\n'),
-                              'test'),
+                              'test', output=print),
                           mock.call((
                               '\n[repo-setup-centos-powertools]\n'
                               'name=repo-setup-centos-powertools\n'
                               'baseurl=mirror/centos/8/PowerTools'
                               '/$basearch/os/\ngpgcheck=0\nenabled=1\n'),
-                              'test')
+                              'test', output=print)
                           ],
                          mock_write.mock_calls)
 
@@ -367,6 +993,146 @@ class TestTripleORepos(testtools.TestCase):
         m.assert_called_once_with('test/delorean.repo', 'w')
         m().write.assert_called_once_with('#Doc\n[delorean]\nThis=Heavy')
 
+    def test_write_repo_unchanged(self):
+        path = self.useFixture(fixtures.TempDir()).path
+        content = '[delorean]\nbaseurl=a\n[delorean-extra]\nbaseurl=b\n'
+        written = main._write_repo(content, path)
+        self.assertEqual(main.WrittenRepo(
+            os.path.join(path, 'delorean.repo'),
+            ['delorean', 'delorean-extra'], True), written)
+        with mock.patch('repo_setup.main.open', mock.mock_open(
+                read_data=content), create=True) as m:
+            written = main._write_repo(content, path)
+        m.assert_called_once_with(os.path.join(path, 'delorean.repo'), 'r')
+        self.assertFalse(written.changed)
+        written = main._write_repo(content + 'enabled=1\n', path)
+        self.assertTrue(written.changed)
+
+    def test_staged_install(self):
+        path = self.useFixture(fixtures.TempDir()).path
+        with open(os.path.join(path, 'delorean.repo'), 'w') as f:
+            f.write('[delorean]\nbaseurl=old\n')
+        with open(os.path.join(path, 'delorean-deps.repo'), 'w') as f:
+            f.write('[delorean-deps]\n')
+        stage = main.StagedInstall()
+        self.addCleanup(stage.cleanup)
+        written = [stage.write('[delorean]\nbaseurl=new\n', path,
+                               name='delorean'),
+                   stage.write('[delorean-deps]\n', path)]
+        self.assertEqual([True, False], [w.changed for w in written])
+        self.assertEqual([os.path.join(path, 'delorean.repo'),
+                          os.path.join(path, 'delorean-deps.repo')],
+                         [w.filename for w in written])
+        # nothing is touched before commit
+        with open(os.path.join(path, 'delorean.repo')) as f:
+            self.assertEqual('[delorean]\nbaseurl=old\n', f.read())
+        stage.commit()
+        with open(os.path.join(path, 'delorean.repo')) as f:
+            self.assertEqual('[delorean]\nbaseurl=new\n', f.read())
+        stage.cleanup()
+        self.assertEqual(['delorean-deps.repo', 'delorean.repo'],
+                         sorted(os.listdir(path)))
+
+    def test_staged_install_failure(self):
+        path = self.useFixture(fixtures.TempDir()).path
+        stage = main.StagedInstall()
+        stage.write('[delorean]\n', path)
+        self.assertRaises(main.NoRepoTitle, stage.write, 'Great Scot!', path)
+        stage.cleanup()
+        self.assertEqual([], os.listdir(path))
+
+    def test_load_matrix(self):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                            'matrix.yaml')
+        with open(path, 'w') as f:
+            f.write('options:\n  staged: true\n'
+                    'targets:\n'
+                    '  - repos: [current]\n    distro: centos9\n'
+                    '  - repos: [current]\n    distro: centos10\n'
+                    '    staged: false\n')
+        self.assertEqual(
+            [{'repos': ['current'], 'distro': 'centos9', 'staged': True},
+             {'repos': ['current'], 'distro': 'centos10', 'staged': False}],
+            main._load_matrix(path))
+        with open(path, 'w') as f:
+            f.write('- distro: centos9\n')
+        self.assertRaises(main.InvalidArguments, main._load_matrix, path)
+
+    @mock.patch('repo_setup.api.install_matrix')
+    def test_main_matrix(self, mock_matrix):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                            'matrix.json')
+        with open(path, 'w') as f:
+            json.dump([{'repos': ['current'], 'distro': 'centos9',
+                        'output_path': '/tmp/c9'}], f)
+        mock_matrix.return_value = [mock.Mock(messages=['Installed'])]
+        stdout = self.useFixture(fixtures.StringStream('stdout')).stream
+        self.useFixture(fixtures.MonkeyPatch('sys.stdout', stdout))
+        with mock.patch('sys.argv', ['repo-setup', 'matrix', path,
+                                     '--check']):
+            main.main()
+        requests = mock_matrix.call_args[0][0]
+        self.assertEqual(['current', '--distro', 'centos9',
+                          '--output-path', '/tmp/c9'], requests[0].argv())
+        self.assertEqual({'check': True}, mock_matrix.call_args[1])
+        stdout.seek(0)
+        self.assertIn('  Installed', stdout.read())
+
+    def test_planned_install(self):
+        path = self.useFixture(fixtures.TempDir()).path
+        with open(os.path.join(path, 'delorean.repo'), 'w') as f:
+            f.write('[delorean]\nbaseurl=old\n')
+        with open(os.path.join(path, 'delorean-old.repo'), 'w') as f:
+            f.write('[delorean-old]\n')
+        stage = main.PlannedInstall()
+        written = [stage.write('[delorean]\nbaseurl=new\n', path),
+                   stage.write('[delorean-deps]\n', path)]
+        stage.remove([os.path.join(path, 'delorean-old.repo')])
+        self.assertEqual([True, True], [w.changed for w in written])
+        self.assertEqual(
+            [{'path': os.path.join(path, 'delorean.repo'),
+              'before': '[delorean]\nbaseurl=old\n',
+              'after': '[delorean]\nbaseurl=new\n'},
+             {'path': os.path.join(path, 'delorean-deps.repo'),
+              'before': '', 'after': '[delorean-deps]\n'},
+             {'path': os.path.join(path, 'delorean-old.repo'),
+              'before': '[delorean-old]\n', 'after': ''}],
+            stage.diffs)
+        self.assertEqual(['delorean-old.repo', 'delorean.repo'],
+                         sorted(os.listdir(path)))
+        stage.commit()
+        with open(os.path.join(path, 'delorean.repo')) as f:
+            self.assertEqual('[delorean]\nbaseurl=new\n', f.read())
+        self.assertIn('delorean-deps.repo', os.listdir(path))
+
+    @mock.patch('os.listdir')
+    @mock.patch('os.remove')
+    @mock.patch('os.path.exists', return_value=True)
+    def test_remove_existing_dry_run(self, mock_exists, mock_remove,
+                                     mock_listdir):
+        mock_listdir.return_value = ['delorean.repo', 'foo.repo']
+        mock_args = mock.Mock(output_path='/etc/yum.repos.d')
+        self.assertEqual(
+            ['/etc/yum.repos.d/delorean.repo',
+             '/etc/distro.repos.d/delorean.repo'],
+            main._remove_existing(mock_args, dry_run=True))
+        mock_remove.assert_not_called()
+
+    @mock.patch('repo_setup.main._get_repo')
+    @mock.patch('repo_setup.main._write_repo')
+    def test_install_repos_staged(self, mock_write, mock_get):
+        args = mock.Mock()
+        args.repos = ['deps']
+        args.output_path = 'test'
+        args.distro = 'fake'
+        args.max_workers = 1
+        mock_get.return_value = '[delorean-deps]'
+        stage = mock.Mock()
+        written = main._install_repos(args, 'roads/', stage=stage)
+        mock_write.assert_not_called()
+        stage.write.assert_called_once_with('[delorean-deps]', 'test')
+        self.assertEqual([stage.write.return_value], written)
+
     def test_write_repo_invalid(self):
         self.assertRaises(main.NoRepoTitle, main._write_repo, 'Great Scot!',
                           'test')
@@ -392,6 +1158,66 @@ class TestTripleORepos(testtools.TestCase):
         self.assertEqual('master', args.branch)
         self.assertEqual('test', args.output_path)
 
+    def test_parse_args_max_workers(self):
+        with mock.patch.object(sys, 'argv', ['', 'current', '--max-workers',
+                                             '8']):
+            args = main._parse_args('centos', '9')
+        self.assertEqual(8, args.max_workers)
+
+    def test_parse_args_http_options(self):
+        with mock.patch.object(sys, 'argv', ['', 'current', '--pool-size',
+                                             '2', '--connect-timeout', '3',
+                                             '--read-timeout', '4.5']):
+            args = main._parse_args('centos', '9')
+        self.assertEqual(2, args.pool_size)
+        self.assertEqual(3.0, args.connect_timeout)
+        self.assertEqual(4.5, args.read_timeout)
+
+    def test_parse_args_cache_options(self):
+        with mock.patch.object(sys, 'argv', ['', 'current', '--cache-dir',
+                                             '/tmp/c', '--cache-max-size',
+                                             '1024', '--no-cache']):
+            args = main._parse_args('centos', '9')
+        self.assertEqual('/tmp/c', args.cache_dir)
+        self.assertEqual(1024, args.cache_max_size)
+        self.assertTrue(args.no_cache)
+
+    def test_parse_args_staged(self):
+        with mock.patch.object(sys, 'argv', ['', 'current', '--staged']):
+            args = main._parse_args('centos', '9')
+        self.assertTrue(args.staged)
+
+    def test_parse_args_max_workers_invalid(self):
+        with mock.patch.object(sys, 'argv', ['', 'current', '--max-workers',
+                                             '0']):
+            self.assertRaises(SystemExit, main._parse_args, 'centos', '9')
+
+    def test_parse_args_overrides(self):
+        args = main._parse_args('centos', '9', ['current'],
+                                max_workers='4', read_timeout='4.5',
+                                staged='yes', no_cache=True,
+                                repos=['current', 'ceph'], distro='centos9')
+        self.assertEqual(4, args.max_workers)
+        self.assertEqual(4.5, args.read_timeout)
+        self.assertIs(True, args.staged)
+        self.assertIs(True, args.no_cache)
+        self.assertEqual(['current', 'ceph'], args.repos)
+        self.assertEqual('centos9', args.distro)
+
+    @ddt.data(({'max_workers': 'four'}, "invalid int value: 'four'"),
+              ({'max_workers': '0'}, '--max-workers must be at least 1'),
+              ({'distro': 'centos42'}, "invalid choice: 'centos42'"),
+              ({'repos': ['current', 'tomorrow']},
+               "invalid choice: 'tomorrow'"),
+              ({'staged': 'maybe'}, "invalid boolean value: 'maybe'"),
+              ({'warp_speed': 88}, 'unknown argument warp_speed'))
+    @ddt.unpack
+    def test_parse_args_overrides_invalid(self, overrides, message):
+        e = self.assertRaises(main.InvalidArguments, main._parse_args,
+                              'centos', '9', ['current'],
+                              exit_on_error=False, **overrides)
+        self.assertIn(message, str(e))
+
     def test_change_priority(self):
         result = main._change_priority('[delorean]\npriority=1', 10)
         self.assertEqual('[delorean]\npriority=10', result)
@@ -453,7 +1279,8 @@ enabled=1
         mock_args = mock.Mock(mirror='http://foo',
                               rdo_mirror='http://bar',
                               distro='centos',
-                              old_mirror='http://mirror.centos.org')
+                              old_mirror='http://mirror.centos.org',
+                              mirror_map=None)
         result = main._inject_mirrors(start_repo, mock_args)
         self.assertEqual(expected, result)
 
@@ -481,7 +1308,31 @@ enabled=1
         mock_args = mock.Mock(mirror='http://foo',
                               rdo_mirror='http://bar',
                               distro='rhel',
-                              old_mirror='https://some')
+                              old_mirror='https://some',
+                              mirror_map=None)
+        result = main._inject_mirrors(start_repo, mock_args)
+        self.assertEqual(expected, result)
+
+    def test_inject_mirrors_rhel9_mirror(self):
+        start_repo = '''
+[delorean]
+name=delorean
+baseurl=https://trunk.rdoproject.org/rhel9-master/some-repo-hash
+enabled=1
+'''
+        expected = '''
+[delorean]
+name=delorean
+baseurl=http://foo/rhel9-master/some-repo-hash
+enabled=1
+'''
+        # the rhel9 default mirror is the default RDO one, --mirror must
+        # still rewrite its urls
+        mock_args = mock.Mock(mirror='http://foo',
+                              rdo_mirror=main.DEFAULT_RDO_MIRROR,
+                              distro='rhel9',
+                              old_mirror=main.DEFAULT_MIRROR_MAP['rhel9'],
+                              mirror_map=None)
         result = main._inject_mirrors(start_repo, mock_args)
         self.assertEqual(expected, result)
 
@@ -493,17 +1344,157 @@ baseurl=https://some.mirror.com/centos9/some-repo-hash
 enabled=1
 '''
         mock_args = mock.Mock(rdo_mirror='http://some.mirror.com',
-                              distro='centos')
+                              distro='centos',
+                              old_mirror=None, mirror_map=None)
         # If a user has a mirror whose repos already point at itself then
         # the _inject_mirrors call should be a noop.
         self.assertEqual(start_repo, main._inject_mirrors(start_repo,
                                                           mock_args))
 
+    def test_inject_mirrors_mirror_map(self):
+        path = self.useFixture(fixtures.TempDir()).path + '/map.json'
+        with open(path, 'w') as f:
+            json.dump({'https://trunk.rdoproject.org/centos9': 'http://c9',
+                       'http://mirror.stream.centos.org': 'http://s'}, f)
+        start_repo = '''
+[delorean]
+baseurl=https://trunk.rdoproject.org/centos9/some-repo-hash
+gpgkey=https://trunk.rdoproject.org/keys/RPM-GPG-KEY
+[centos]
+metalink=http://mirror.stream.centos.org/metalink?repo=9
+'''
+        expected = '''
+[delorean]
+baseurl=http://c9/some-repo-hash
+gpgkey=http://bar/keys/RPM-GPG-KEY
+[centos]
+metalink=http://s/metalink?repo=9
+'''
+        mock_args = mock.Mock(rdo_mirror='http://bar', old_mirror=None,
+                              mirror_map=path)
+        self.assertEqual(expected,
+                         main._inject_mirrors(start_repo, mock_args))
+        with open(path, 'w') as f:
+            f.write('["http://a"]')
+        os.utime(path, (0, 0))
+        self.assertRaises(main.InvalidArguments, main._inject_mirrors,
+                          start_repo, mock_args)
+
     @mock.patch('subprocess.check_call')
     def test_run_pkg_clean_fedora(self, mock_check_call):
         main._run_pkg_clean('fedora')
         mock_check_call.assert_called_once_with(['dnf', 'clean', 'metadata'])
 
+    @mock.patch('repo_setup.main._clean_repo_metadata')
+    @mock.patch('subprocess.check_call')
+    def test_run_pkg_clean_unchanged(self, mock_check_call, mock_clean):
+        main._run_pkg_clean('centos9', [])
+        mock_check_call.assert_not_called()
+        mock_clean.assert_not_called()
+
+    @mock.patch('repo_setup.main._clean_repo_metadata')
+    @mock.patch('subprocess.check_call')
+    def test_run_pkg_clean_changed(self, mock_check_call, mock_clean):
+        main._run_pkg_clean('centos9', ['delorean'])
+        mock_check_call.assert_not_called()
+        mock_clean.assert_called_once_with(['delorean'])
+
+    @mock.patch('subprocess.run')
+    def test_prewarm_metadata(self, mock_run):
+        def run(cmd, **kwargs):
+            repo_id = cmd[-1]
+            if repo_id == 'broken':
+                raise subprocess.CalledProcessError(
+                    1, cmd, stderr='Error: Failed to download metadata\n')
+            if repo_id == 'slow':
+                raise subprocess.TimeoutExpired(cmd, kwargs['timeout'])
+
+        mock_run.side_effect = run
+        recorder = main.timings.Timings()
+        stderr = self.useFixture(fixtures.StringStream('stderr')).stream
+        self.useFixture(fixtures.MonkeyPatch('sys.stderr', stderr))
+        results = main._prewarm_metadata(['delorean', 'broken', 'slow'],
+                                         workers=2, timeout=5,
+                                         recorder=recorder,
+                                         reposdir='/tmp/repos')
+        errors = dict((result.repo_id, result.error) for result in results)
+        self.assertEqual({'delorean': None,
+                          'broken': 'Error: Failed to download metadata',
+                          'slow': 'timed out after 5s'}, errors)
+        self.assertEqual(sorted(results, key=lambda r: -r.seconds), results)
+        mock_run.assert_any_call(
+            ['dnf', 'makecache', '--setopt=reposdir=/tmp/repos',
+             '--repo', 'delorean'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            universal_newlines=True, timeout=5, check=True)
+        self.assertEqual(
+            [result.repo_id for result in results],
+            [prewarm['repo_id'] for prewarm in recorder.report()['prewarms']])
+        stderr.seek(0)
+        self.assertEqual(2, stderr.read().count('WARNING'))
+
+    @mock.patch('subprocess.run')
+    def test_prewarm_metadata_unchanged(self, mock_run):
+        self.assertEqual([], main._prewarm_metadata([]))
+        mock_run.assert_not_called()
+
+    @mock.patch('repo_setup.main._get_distro')
+    @mock.patch('repo_setup.main._prewarm_metadata')
+    @mock.patch('repo_setup.main._run_pkg_clean')
+    @mock.patch('repo_setup.main._validate_args')
+    @mock.patch('repo_setup.main._get_base_path')
+    @mock.patch('repo_setup.main._remove_existing')
+    @mock.patch('repo_setup.main._install_repos')
+    def test_main_prewarm(self, mock_install, mock_remove, mock_gbp,
+                          mock_validate, mock_clean, mock_prewarm,
+                          mock_distro):
+        mock_distro.return_value = ('centos', '9', 'CentOS Stream')
+        mock_install.return_value = [
+            main.WrittenRepo('/etc/yum.repos.d/delorean.repo',
+                             ['delorean'], True),
+            main.WrittenRepo('/etc/yum.repos.d/delorean-deps.repo',
+                             ['delorean-deps'], False),
+        ]
+        with mock.patch('sys.argv', ['repo-setup', 'current', '--prewarm',
+                                     '--prewarm-workers', '2']):
+            main.main()
+        mock_prewarm.assert_called_once_with(
+            ['delorean'], 2, 300, mock.ANY, reposdir='/etc/yum.repos.d',
+            output=print)
+
+    def test_clean_repo_metadata(self):
+        cache_dir = self.useFixture(fixtures.TempDir()).path
+        paths = ['delorean-0123456789abcdef/repodata/repomd.xml',
+                 'delorean-0123456789abcdef/packages/foo.rpm',
+                 'delorean.solv',
+                 'delorean-filenames.solvx',
+                 'delorean-current-0123456789abcdef/repodata/repomd.xml',
+                 'delorean-current.solv',
+                 'delorean-current-filenames.solvx',
+                 'baseos-89abcdef01234567/repodata/repomd.xml',
+                 'baseos.solv']
+        for path in paths:
+            path = os.path.join(cache_dir, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'w').close()
+        main._clean_repo_metadata(['delorean'], [cache_dir])
+        exists = [p for p in paths
+                  if os.path.exists(os.path.join(cache_dir, p))]
+        # the sibling delorean-current repo is left alone
+        self.assertEqual(
+            ['delorean-0123456789abcdef/packages/foo.rpm',
+             'delorean-current-0123456789abcdef/repodata/repomd.xml',
+             'delorean-current.solv',
+             'delorean-current-filenames.solvx',
+             'baseos-89abcdef01234567/repodata/repomd.xml',
+             'baseos.solv'], exists)
+
+    def test_clean_repo_metadata_missing_cache_dir(self):
+        cache_dir = self.useFixture(fixtures.TempDir()).path
+        main._clean_repo_metadata(['delorean'],
+                                  [os.path.join(cache_dir, 'missing')])
+
 
 class TestValidate(testtools.TestCase):
     def setUp(self):
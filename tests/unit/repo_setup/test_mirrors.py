@@ -0,0 +1,98 @@
+# Copyright 2021 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+from unittest import mock
+
+import fixtures
+import testtools
+
+from repo_setup import mirrors
+
+
+class TestMirrors(testtools.TestCase):
+    def _session(self, delays):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def head(url, **kwargs):
+            delay = delays[url]
+            if isinstance(delay, Exception):
+                raise delay
+            if delay is None:
+                release.wait()
+            else:
+                time.sleep(delay)
+            return mock.Mock(status_code=503 if 'bad' in url else 200)
+
+        return mock.Mock(head=head)
+
+    def test_probe_mirrors(self):
+        session = self._session({'http://fast': 0, 'http://slow': 0.05,
+                                 'http://bad': 0, 'http://down': IOError(),
+                                 'http://hung': None})
+        urls = ['http://slow', 'http://fast', 'http://bad', 'http://down',
+                'http://hung']
+        probes = mirrors.probe_mirrors(session, urls, deadline=0.5)
+        self.assertEqual(urls, [probe.url for probe in probes])
+        self.assertEqual([200, 200, 503, None, None],
+                         [probe.status for probe in probes])
+        self.assertEqual('timed out', probes[-1].error)
+        self.assertEqual('http://fast', mirrors.fastest_mirror(probes))
+
+    def test_fastest_mirror_none_healthy(self):
+        probes = [mirrors.MirrorProbe('http://bad', 0.1, 500, None),
+                  mirrors.MirrorProbe('http://down', 0.1, None, 'refused')]
+        self.assertIsNone(mirrors.fastest_mirror(probes))
+
+    def test_select_mirror_cached(self):
+        path = self.useFixture(fixtures.TempDir()).path
+        cache = mirrors.MirrorCache(path, ttl=60)
+        session = self._session({'http://a': 0.02, 'http://b': 0})
+        mirror, probes = mirrors.select_mirror(
+            session, ['http://a', 'http://b'], 1.0, cache)
+        self.assertEqual('http://b', mirror)
+        self.assertEqual(2, len(probes))
+        session.head = mock.Mock(side_effect=AssertionError())
+        self.assertEqual(('http://b', []), mirrors.select_mirror(
+            session, ['http://a', 'http://b'], 1.0, cache))
+        # a different candidate list is probed again
+        self.assertIsNone(cache.get(['http://a']))
+
+    def test_mirror_cache_expired(self):
+        path = self.useFixture(fixtures.TempDir()).path
+        cache = mirrors.MirrorCache(path, ttl=-1)
+        cache.set(['http://a', 'http://b'], 'http://a')
+        self.assertIsNone(cache.get(['http://a', 'http://b']))
+
+    def test_mirror_cache_dir_created_concurrently(self):
+        path = self.useFixture(fixtures.TempDir()).path + '/cache'
+        cache = mirrors.MirrorCache(path, ttl=60)
+        makedirs = mirrors.os.makedirs
+
+        def racing_makedirs(name, *args, **kwargs):
+            # another process creates the dir first
+            makedirs(name)
+            raise OSError(17, 'File exists')
+
+        with mock.patch('os.makedirs', side_effect=racing_makedirs):
+            cache.set(['http://a', 'http://b'], 'http://a')
+        self.assertEqual('http://a', cache.get(['http://a', 'http://b']))
+
+    def test_load_mirror_config_invalid(self):
+        path = self.useFixture(fixtures.TempDir()).path + '/mirrors.json'
+        with open(path, 'w') as f:
+            f.write('{"centos9": "http://a"}')
+        self.assertRaises(ValueError, mirrors.load_mirror_config, path)
@@ -0,0 +1,121 @@
+# Copyright 2021 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import os
+
+import fixtures
+import testtools
+
+from repo_setup import rewrite
+
+
+class TestRewrite(testtools.TestCase):
+    def test_rewrite_options(self):
+        rewriter = rewrite.MirrorRewriter([
+            ('https://trunk.rdoproject.org', 'http://rdo'),
+            ('http://mirror.centos.org', 'http://os'),
+        ])
+        content = '''[a]
+name=https://trunk.rdoproject.org stays
+baseurl=https://trunk.rdoproject.org/centos9/current
+gpgkey=file:///k http://mirror.centos.org/key,http://mirror.centos.org/k2
+[b]
+mirrorlist = http://mirror.centos.org/?release=9
+metalink=https://trunk.rdoproject.org/metalink
+baseurl=http://other/http://mirror.centos.org
+  http://mirror.centos.org/9/extras
+'''
+        expected = '''[a]
+name=https://trunk.rdoproject.org stays
+baseurl=http://rdo/centos9/current
+gpgkey=file:///k http://os/key,http://os/k2
+[b]
+mirrorlist = http://os/?release=9
+metalink=http://rdo/metalink
+baseurl=http://other/http://mirror.centos.org
+  http://os/9/extras
+'''
+        self.assertEqual(expected, rewriter.rewrite(content))
+
+    def test_rewrite_escapes_prefixes(self):
+        rewriter = rewrite.MirrorRewriter([('http://a.b', 'http://m')])
+        content = 'baseurl=http://aXb/repo\nbaseurl=http://a.b/repo\n'
+        self.assertEqual('baseurl=http://aXb/repo\nbaseurl=http://m/repo\n',
+                         rewriter.rewrite(content))
+
+    def test_rewrite_first_prefix_wins(self):
+        rewriter = rewrite.MirrorRewriter([
+            ('http://up/rdo', 'http://rdo'),
+            ('http://up', 'http://os'),
+            ('http://up/rdo', 'http://ignored'),
+        ])
+        self.assertEqual(
+            'baseurl=http://rdo/x\nbaseurl=http://os/x\n',
+            rewriter.rewrite('baseurl=http://up/rdo/x\nbaseurl=http://up/x\n'))
+
+    def test_rewrite_noop(self):
+        rewriter = rewrite.MirrorRewriter([('http://up', 'http://up')])
+        content = 'baseurl=http://up/x\n'
+        self.assertIs(content, rewriter.rewrite(content))
+
+    def test_rewrite_identity_pair_does_not_shadow(self):
+        rewriter = rewrite.MirrorRewriter([
+            ('http://up', 'http://up'),
+            ('http://up', 'http://down'),
+        ])
+        self.assertEqual('baseurl=http://down/x\n',
+                         rewriter.rewrite('baseurl=http://up/x\n'))
+
+    def test_get_rewriter_compiled_once(self):
+        rewrites = [('http://up', 'http://down')]
+        self.assertIs(rewrite.get_rewriter(rewrites),
+                      rewrite.get_rewriter(list(rewrites)))
+
+    def test_get_rewriter_bounded(self):
+        self.useFixture(fixtures.MonkeyPatch(
+            'repo_setup.rewrite._rewriters', collections.OrderedDict()))
+        self.useFixture(fixtures.MonkeyPatch(
+            'repo_setup.rewrite.MAX_REWRITERS', 2))
+        first = rewrite.get_rewriter([('http://up', 'http://a')])
+        rewrite.get_rewriter([('http://up', 'http://b')])
+        # using the first map again keeps it over the second one
+        self.assertIs(first, rewrite.get_rewriter([('http://up',
+                                                    'http://a')]))
+        rewrite.get_rewriter([('http://up', 'http://c')])
+        self.assertEqual(
+            [(('http://up', 'http://a'),), (('http://up', 'http://c'),)],
+            list(rewrite._rewriters))
+
+    def test_load_rewrite_map(self):
+        tmp = self.useFixture(fixtures.TempDir()).path
+        path = os.path.join(tmp, 'map.json')
+        with open(path, 'w') as f:
+            f.write('{"http://b": "http://1", "http://a": "http://2"}')
+        self.assertEqual([('http://b', 'http://1'), ('http://a', 'http://2')],
+                         rewrite.load_rewrite_map(path))
+        with open(path, 'w') as f:
+            f.write('[["http://c", "http://3"]]')
+        os.utime(path, (0, 0))
+        self.assertEqual([('http://c', 'http://3')],
+                         rewrite.load_rewrite_map(path))
+
+    def test_load_rewrite_map_invalid(self):
+        tmp = self.useFixture(fixtures.TempDir()).path
+        path = os.path.join(tmp, 'map.json')
+        for data in ('["http://a"]', '{"http://a": ["http://b"]}', '1'):
+            with open(path, 'w') as f:
+                f.write(data)
+            os.utime(path, (0, len(data)))
+            self.assertRaises(ValueError, rewrite.load_rewrite_map, path)
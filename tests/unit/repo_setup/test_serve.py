@@ -0,0 +1,283 @@
+# Copyright 2021 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import os
+import threading
+import time
+from concurrent import futures
+from http import server
+from unittest import mock
+from urllib import error, request
+
+import fixtures
+import requests
+import testtools
+
+from repo_setup import main
+from repo_setup import serve
+from repo_setup import session
+
+
+class FakeUpstream:
+    """Stand-in upstream server counting the requests of each path"""
+
+    def __init__(self, files, delay=0):
+        self.files = files
+        self.delay = delay
+        self.requests = collections.Counter()
+        self.conditional = collections.Counter()
+        upstream = self
+
+        class Handler(server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                upstream.requests[self.path] += 1
+                time.sleep(upstream.delay)
+                if self.path not in upstream.files:
+                    self.send_error(404)
+                    return
+                body = upstream.files[self.path]
+                etag = '"%d"' % hash(body)
+                if self.headers.get('If-None-Match') == etag:
+                    upstream.conditional[self.path] += 1
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.httpd.server_address[1]
+        threading.Thread(target=self.httpd.serve_forever, args=(0.01,),
+                         daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class TestServe(testtools.TestCase):
+    def setUp(self):
+        super(TestServe, self).setUp()
+        self.cache_dir = self.useFixture(fixtures.TempDir()).path
+
+    def _serve(self, files, delay=0, **kwargs):
+        upstream = FakeUpstream(files, delay)
+        self.addCleanup(upstream.close)
+        upstreams = collections.OrderedDict([('rdo', upstream.url)])
+        cache = serve.ProxyCache(self.cache_dir,
+                                 kwargs.pop('max_size', 1024 * 1024))
+        proxy = serve.RepoProxy(upstreams, cache, retries=0, **kwargs)
+        httpd = serve.make_server(proxy, port=0)
+        httpd.RequestHandlerClass.log_message = lambda *args: None
+        threading.Thread(target=httpd.serve_forever, args=(0.01,),
+                         daemon=True).start()
+        self.addCleanup(httpd.server_close)
+        self.addCleanup(httpd.shutdown)
+        return upstream, proxy, 'http://127.0.0.1:%d' % httpd.server_address[1]
+
+    def _get(self, url):
+        with request.urlopen(url) as response:
+            return response.read()
+
+    def test_package_cached(self):
+        upstream, proxy, url = self._serve({'/p/a.rpm': b'RPM'})
+        self.assertEqual(b'RPM', self._get(url + '/rdo/p/a.rpm'))
+        self.assertEqual(b'RPM', self._get(url + '/rdo/p/a.rpm'))
+        self.assertEqual(1, upstream.requests['/p/a.rpm'])
+        self.assertEqual({'miss': 1, 'hit': 1}, dict(proxy.stats))
+
+    def test_concurrent_requests_deduplicated(self):
+        upstream, proxy, url = self._serve({'/p/a.rpm': b'RPM'}, delay=0.2)
+        with futures.ThreadPoolExecutor(max_workers=5) as executor:
+            bodies = list(executor.map(
+                lambda i: self._get(url + '/rdo/p/a.rpm'), range(5)))
+        self.assertEqual([b'RPM'] * 5, bodies)
+        self.assertEqual(1, upstream.requests['/p/a.rpm'])
+        self.assertEqual(4, proxy.stats['deduplicated'])
+
+    def test_metadata_revalidated(self):
+        upstream, proxy, url = self._serve(
+            {'/r/repodata/repomd.xml': b'<repomd/>',
+             '/r/repodata/abc-primary.xml.gz': b'gz'}, metadata_ttl=0)
+        for _ in range(2):
+            self.assertEqual(b'<repomd/>',
+                             self._get(url + '/rdo/r/repodata/repomd.xml'))
+            self.assertEqual(
+                b'gz', self._get(url + '/rdo/r/repodata/abc-primary.xml.gz'))
+        self.assertEqual(1, upstream.conditional['/r/repodata/repomd.xml'])
+        self.assertEqual(1, upstream.requests['/r/repodata/abc-primary.xml.gz'])
+
+    def test_repo_file_rewritten(self):
+        upstream, proxy, url = self._serve({})
+        upstream.files['/c/delorean.repo'] = (
+            '[delorean]\nbaseurl=%s/c/x\n' % upstream.url).encode('utf-8')
+        self.assertEqual(
+            ('[delorean]\nbaseurl=%s/rdo/c/x\n' % url).encode('utf-8'),
+            self._get(url + '/rdo/c/delorean.repo'))
+
+    def test_repo_file_ignores_host_header(self):
+        upstream, proxy, url = self._serve({})
+        upstream.files['/c/delorean.repo'] = (
+            '[delorean]\nbaseurl=%s/c/x\n' % upstream.url).encode('utf-8')
+        req = request.Request(url + '/rdo/c/delorean.repo',
+                              headers={'Host': 'attacker.example'})
+        self.assertEqual(
+            ('[delorean]\nbaseurl=%s/rdo/c/x\n' % url).encode('utf-8'),
+            self._get(req))
+
+    def test_public_url(self):
+        upstream, proxy, url = self._serve({}, public_url='http://p:81/')
+        upstream.files['/c/delorean.repo'] = (
+            '[delorean]\nbaseurl=%s/c/x\n' % upstream.url).encode('utf-8')
+        self.assertEqual(b'[delorean]\nbaseurl=http://p:81/rdo/c/x\n',
+                         self._get(url + '/rdo/c/delorean.repo'))
+
+    def test_get_public_url(self):
+        self.assertEqual('http://10.0.0.1:8080',
+                         serve._get_public_url(('10.0.0.1', 8080)))
+        with mock.patch('socket.getfqdn', return_value='proxy.example'):
+            self.assertEqual('http://proxy.example:8080',
+                             serve._get_public_url(('0.0.0.0', 8080)))
+
+    def test_errors(self):
+        upstream, proxy, url = self._serve({})
+        for path in ('/rdo/missing.rpm', '/unknown/a.rpm', '/rdo/missing.rpm'):
+            e = self.assertRaises(error.HTTPError, self._get, url + path)
+            self.assertEqual(404, e.code)
+        self.assertEqual(2, upstream.requests['/missing.rpm'])
+
+    def test_render(self):
+        upstream, proxy, url = self._serve({})
+        diffs = [{'path': 'a.repo', 'before': None,
+                  'after': '[a]\nbaseurl=%s/a\n' % upstream.url}]
+        with mock.patch('repo_setup.api.install') as mock_install:
+            mock_install.return_value = mock.Mock(diffs=diffs)
+            body = self._get(
+                url + '/repo-setup/current-podified,ceph.repo?distro=centos9')
+        self.assertEqual(('[a]\nbaseurl=%s/rdo/a\n' % url).encode('utf-8'),
+                         body)
+        install_request = mock_install.call_args[0][0]
+        self.assertEqual(['current-podified', 'ceph'], install_request.repos)
+        self.assertEqual('centos9', install_request.distro)
+        self.assertIsNone(install_request.mirror)
+        self.assertIsNone(install_request.rdo_mirror)
+        self.assertEqual({'check': True}, mock_install.call_args[1])
+
+    def test_render_invalid(self):
+        upstream, proxy, url = self._serve({})
+        with mock.patch('repo_setup.api.install',
+                        side_effect=main.InvalidArguments('bad repo')):
+            e = self.assertRaises(error.HTTPError, self._get,
+                                  url + '/repo-setup/bad')
+        self.assertEqual(400, e.code)
+
+    def test_render_upstream_error(self):
+        upstream, proxy, url = self._serve({}, cache_dir=self.cache_dir)
+
+        def get(url, **kwargs):
+            response = requests.Response()
+            response.status_code = 404
+            response.url = url
+            return response
+
+        # the delorean.repo of the render is missing upstream
+        with mock.patch('repo_setup.session.get_session') as mock_session, \
+                mock.patch('repo_setup.main._get_distro',
+                           return_value=('centos', '9', 'CentOS Stream')):
+            mock_session.return_value.get.side_effect = get
+            e = self.assertRaises(error.HTTPError, self._get,
+                                  url + '/repo-setup/current?distro=centos9')
+        self.assertEqual(502, e.code)
+        self.assertIn(
+            'https://trunk.rdoproject.org/centos9-master/current/'
+            'delorean.repo',
+            [c[0][0] for c in mock_session.return_value.get.call_args_list])
+
+    def test_render_fetch_errors(self):
+        upstream, proxy, url = self._serve({}, cache_dir=self.cache_dir)
+        for exception in (session.DeadlineExceeded('too late'),
+                          main.RepoChecksumError('bad md5')):
+            with mock.patch('repo_setup.api.install',
+                            side_effect=exception) as mock_install:
+                e = self.assertRaises(error.HTTPError, self._get,
+                                      url + '/repo-setup/current')
+            self.assertEqual(502, e.code)
+            self.assertEqual(
+                {'cache_dir': self.cache_dir},
+                mock_install.call_args[0][0].options)
+
+    def test_proxy_mirrors(self):
+        proxy = serve.RepoProxy(serve.DEFAULT_UPSTREAMS, None)
+        self.assertEqual(
+            'http://p/rdo',
+            proxy._proxy_mirror(main.DEFAULT_RDO_MIRROR, 'http://p'))
+        self.assertEqual(
+            '[a]\nbaseurl=http://p/centos-stream/9\n'
+            'gpgkey=http://p/rdo/key\n',
+            proxy.rewrite('[a]\nbaseurl=http://mirror.stream.centos.org/9\n'
+                          'gpgkey=https://trunk.rdoproject.org/key\n',
+                          'http://p'))
+
+    def test_is_immutable_path(self):
+        for path, expected in (('http://u/a.rpm', True),
+                               ('http://u/repodata/x-primary.xml.gz', True),
+                               ('http://u/repodata/repomd.xml', False),
+                               ('http://u/b6/e7/b6e71147e9ec/a.repo', True),
+                               ('http://u/current/delorean.repo', False)):
+            self.assertEqual(expected, serve.is_immutable_path(path), path)
+
+    def test_cache_dir_created_concurrently(self):
+        path = os.path.join(self.cache_dir, 'race')
+        makedirs = os.makedirs
+
+        def racing_makedirs(name, *args, **kwargs):
+            # another process creates the dir first
+            makedirs(name)
+            raise OSError(17, 'File exists')
+
+        with mock.patch('os.makedirs', side_effect=racing_makedirs):
+            cache = serve.ProxyCache(path)
+        self.assertTrue(os.path.isdir(cache.path))
+
+    def test_cache_eviction(self):
+        cache = serve.ProxyCache(self.cache_dir, max_size=5)
+
+        def store(url, body):
+            return cache.store(url, mock.Mock(
+                iter_content=lambda size: [body], headers={}))
+
+        old = store('http://u/old', b'1234')
+        os.utime(old['body'][:-len('.body')] + '.json', (0, 0))
+        store('http://u/new', b'5678')
+        self.assertIsNone(cache.lookup('http://u/old'))
+        self.assertIsNotNone(cache.lookup('http://u/new'))
+        # the entry just stored is kept even when too large
+        store('http://u/big', b'0123456789')
+        self.assertIsNone(cache.lookup('http://u/new'))
+        with open(cache.lookup('http://u/big')['body'], 'rb') as f:
+            self.assertEqual(b'0123456789', f.read())
+
+    def test_parse_upstreams(self):
+        upstreams = serve._parse_upstreams(['local=http://l/', 'rdo=http://r'])
+        self.assertEqual('http://l', upstreams['local'])
+        self.assertEqual('http://r', upstreams['rdo'])
+        for value in ('local', 'a/b=http://x', 'repo-setup=http://x'):
+            self.assertRaises(ValueError, serve._parse_upstreams, [value])
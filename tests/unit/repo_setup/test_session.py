@@ -0,0 +1,108 @@
+# Copyright 2021 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import mock
+
+import testtools
+
+from repo_setup import session
+
+
+class TestSession(testtools.TestCase):
+    def setUp(self):
+        super(TestSession, self).setUp()
+        self.addCleanup(session.close_sessions)
+
+    def test_get_session_shared(self):
+        first = session.get_session(3)
+        self.assertIs(first, session.get_session(3))
+        self.assertIsNot(first, session.get_session(4))
+
+    def test_get_session_pool(self):
+        shared = session.get_session(3)
+        for prefix in ('http://', 'https://'):
+            adapter = shared.get_adapter(prefix + 'trunk.rdoproject.org')
+            self.assertEqual(3, adapter._pool_connections)
+            self.assertEqual(3, adapter._pool_maxsize)
+        self.assertEqual('gzip, deflate', shared.headers['Accept-Encoding'])
+        self.assertEqual('keep-alive', shared.headers['Connection'])
+
+    def test_close_sessions(self):
+        first = session.get_session(3)
+        session.close_sessions()
+        self.assertIsNot(first, session.get_session(3))
+
+
+@mock.patch('time.sleep')
+class TestGetWithRetries(testtools.TestCase):
+    def test_retry_then_success(self, mock_sleep):
+        http = mock.Mock()
+        http.get.side_effect = [IOError('reset'), mock.Mock(status_code=503),
+                                mock.Mock(status_code=200)]
+        on_retry = mock.Mock()
+        r = session.get_with_retries(http, ['http://a'], retries=2,
+                                     backoff=0.5, on_retry=on_retry)
+        self.assertEqual(200, r.status_code)
+        self.assertEqual(3, http.get.call_count)
+        self.assertEqual(
+            [('http://a', 1, 'reset'), ('http://a', 2, 'HTTP 503')],
+            [c[0][:3] for c in on_retry.call_args_list])
+        self.assertEqual(2, mock_sleep.call_count)
+        # full jitter stays under the exponential bound
+        self.assertLessEqual(on_retry.call_args_list[1][0][3], 1.0)
+
+    def test_no_retry_on_client_error(self, mock_sleep):
+        http = mock.Mock()
+        http.get.return_value = mock.Mock(status_code=404)
+        r = session.get_with_retries(http, ['http://a'], retries=3)
+        self.assertEqual(404, r.status_code)
+        http.get.assert_called_once_with('http://a', headers=None,
+                                         timeout=(10.0, 60.0))
+        mock_sleep.assert_not_called()
+
+    def test_failover(self, mock_sleep):
+        http = mock.Mock()
+        http.get.side_effect = [IOError('down'), mock.Mock(status_code=200)]
+        on_retry = mock.Mock()
+        r = session.get_with_retries(http, ['http://a', 'http://b'],
+                                     retries=0, on_retry=on_retry)
+        self.assertEqual(200, r.status_code)
+        on_retry.assert_called_once_with('http://a', 1, 'down', 0,
+                                         'http://b')
+        self.assertEqual('http://b', http.get.call_args[0][0])
+
+    def test_all_failed(self, mock_sleep):
+        http = mock.Mock()
+        http.get.side_effect = IOError('down')
+        self.assertRaises(IOError, session.get_with_retries, http,
+                          ['http://a', 'http://b'], retries=1)
+        self.assertEqual(4, http.get.call_count)
+        http.get.side_effect = None
+        http.get.return_value = mock.Mock(status_code=502)
+        r = session.get_with_retries(http, ['http://a'], retries=1)
+        self.assertEqual(502, r.status_code)
+
+    @mock.patch('time.monotonic')
+    def test_deadline(self, mock_monotonic, mock_sleep):
+        mock_monotonic.return_value = 100.0
+        http = mock.Mock()
+        http.get.side_effect = IOError('slow')
+        self.assertRaises(session.DeadlineExceeded, session.get_with_retries,
+                          http, ['http://a'], deadline=100.0)
+        http.get.assert_not_called()
+        http.get.side_effect = None
+        http.get.return_value = mock.Mock(status_code=200)
+        session.get_with_retries(http, ['http://a'], deadline=105.0)
+        http.get.assert_called_once_with('http://a', headers=None,
+                                         timeout=(5.0, 5.0))
@@ -0,0 +1,62 @@
+# Copyright 2021 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import subprocess
+import sys
+
+import ddt
+import testtools
+
+from tests.perf import bench_import_time
+
+# Modules that are slow to import and only needed by some code paths
+DEFERRED_MODULES = [
+    'ansible',
+    'concurrent.futures.thread',
+    'configparser',
+    'dnf',
+    'platform',
+    'requests',
+    'urllib.request',
+    'yaml',
+]
+
+# Slack on top of the tests/perf import time budgets, the unit tests run on
+# busy CI nodes and must only catch imports that blow the budget
+IMPORT_BUDGET_SCALE = 2
+
+
+@ddt.ddt
+class TestStartup(testtools.TestCase):
+    """Console script entry points must not import what they may not use"""
+
+    @ddt.data('repo_setup.main',
+              'repo_setup.get_hash.__main__',
+              'repo_setup.yum_config.__main__')
+    def test_deferred_imports(self, module):
+        code = ('import json, sys, %s; '
+                'print(json.dumps(sorted(sys.modules)))' % module)
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         universal_newlines=True)
+        loaded = json.loads(output)
+        self.assertEqual([], [m for m in DEFERRED_MODULES if m in loaded])
+
+    @ddt.data(*sorted(bench_import_time.IMPORT_BUDGETS_MS))
+    def test_import_time_budget(self, module):
+        budget_ms = (bench_import_time.IMPORT_BUDGETS_MS[module]
+                     * IMPORT_BUDGET_SCALE)
+        best_ms = min(bench_import_time.import_time_us(module)
+                      for __ in range(3)) / 1000.0
+        self.assertLessEqual(best_ms, budget_ms)
@@ -0,0 +1,72 @@
+# Copyright 2021 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+
+import fixtures
+import testtools
+
+from repo_setup import timings
+
+
+class TestTimings(testtools.TestCase):
+    def test_phase(self):
+        recorder = timings.Timings()
+        with recorder.phase('install'):
+            pass
+        self.assertRaises(ValueError, self._failing_phase, recorder)
+        report = recorder.report()
+        self.assertEqual(['install', 'fail'],
+                         [phase['name'] for phase in report['phases']])
+        self.assertGreaterEqual(report['phases'][0]['seconds'], 0)
+
+    def _failing_phase(self, recorder):
+        with recorder.phase('fail'):
+            raise ValueError()
+
+    def test_record_fetch(self):
+        recorder = timings.Timings()
+        recorder.record_fetch('http://lone/pine', 0.5, 200, 5, 'miss')
+        self.assertEqual([{'url': 'http://lone/pine', 'seconds': 0.5,
+                           'status': 200, 'bytes': 5, 'cache': 'miss'}],
+                         recorder.report()['fetches'])
+
+    def test_record_prewarm(self):
+        recorder = timings.Timings()
+        recorder.record_prewarm('delorean', 1.5)
+        recorder.record_prewarm('broken', 0.25, 'timed out')
+        self.assertEqual([{'repo_id': 'delorean', 'seconds': 1.5,
+                           'error': None},
+                          {'repo_id': 'broken', 'seconds': 0.25,
+                           'error': 'timed out'}],
+                         recorder.report()['prewarms'])
+
+    def test_write_file(self):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                            'timings.json')
+        recorder = timings.Timings()
+        recorder.record_fetch('http://lone/pine', 0.5, 304, 0, 'revalidated')
+        recorder.write(path)
+        with open(path) as f:
+            data = json.load(f)
+        self.assertEqual('revalidated', data['fetches'][0]['cache'])
+        self.assertIsNone(data['error'])
+
+    def test_write_stderr(self):
+        stderr = self.useFixture(fixtures.StringStream('stderr')).stream
+        self.useFixture(fixtures.MonkeyPatch('sys.stderr', stderr))
+        timings.Timings().write('-')
+        stderr.seek(0)
+        self.assertEqual([], json.loads(stderr.read())['fetches'])
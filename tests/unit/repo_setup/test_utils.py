@@ -0,0 +1,115 @@
+# Copyright 2021 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from unittest import mock
+
+import ddt
+import fixtures
+import testtools
+
+from repo_setup import utils
+from repo_setup.yum_config import utils as yum_config_utils
+
+CENTOS_9_OS_RELEASE = '''NAME="CentOS Stream"
+VERSION="9"
+ID="centos"
+ID_LIKE="rhel fedora"
+VERSION_ID="9"
+PLATFORM_ID="platform:el9"
+PRETTY_NAME="CentOS Stream 9"
+ANSI_COLOR="0;31"
+LOGO="fedora-logo-icon"
+CPE_NAME="cpe:/o:centos:centos:9"
+HOME_URL="https://centos.org/"
+BUG_REPORT_URL="https://issues.redhat.com/"
+REDHAT_SUPPORT_PRODUCT="Red Hat Enterprise Linux 9"
+REDHAT_SUPPORT_PRODUCT_VERSION="CentOS Stream"
+'''
+
+
+@ddt.ddt
+class TestOsRelease(testtools.TestCase):
+    def setUp(self):
+        super(TestOsRelease, self).setUp()
+        self.path = self.useFixture(fixtures.TempDir()).path
+        self.os_release = os.path.join(self.path, 'os-release')
+
+    def _write(self, content):
+        with open(self.os_release, 'w') as f:
+            f.write(content)
+
+    def test_parse(self):
+        self._write(CENTOS_9_OS_RELEASE)
+        parsed = utils.parse_os_release(self.os_release)
+        self.assertEqual('centos', parsed['ID'])
+        self.assertEqual('9', parsed['VERSION_ID'])
+        self.assertEqual('CentOS Stream', parsed['NAME'])
+        self.assertEqual('rhel fedora', parsed['ID_LIKE'])
+
+    @ddt.data(
+        ('ID=fedora', 'fedora'),
+        ('ID="fedora"', 'fedora'),
+        ("ID='fedora linux'", 'fedora linux'),
+        ('ID="a \\"quoted\\" \\$word"', 'a "quoted" $word'),
+        ('ID="back\\\\slash \\n"', 'back\\slash \\n'),
+        ("ID='no \\escape'", 'no \\escape'),
+        ('ID=un\\ quoted', 'un quoted'),
+        ('ID=""', ''),
+    )
+    @ddt.unpack
+    def test_parse_quoting(self, line, expected):
+        self._write('# comment\n\n%s\nbogus line\n' % line)
+        self.assertEqual({'ID': expected},
+                         utils.parse_os_release(self.os_release))
+
+    def test_parse_missing(self):
+        self.assertEqual({}, utils.parse_os_release(self.os_release + 'x'))
+
+    def test_parse_cached(self):
+        self._write('ID=centos\n')
+        self.assertEqual('centos',
+                         utils.parse_os_release(self.os_release)['ID'])
+        with mock.patch('repo_setup.utils.open', create=True) as m:
+            self.assertEqual('centos',
+                             utils.parse_os_release(self.os_release)['ID'])
+        m.assert_not_called()
+        self._write('ID=rhel\n')
+        os.utime(self.os_release, (1, 1))
+        self.assertEqual('rhel',
+                         utils.parse_os_release(self.os_release)['ID'])
+
+    def test_get_distro_info(self):
+        self._write(CENTOS_9_OS_RELEASE)
+        with mock.patch.object(utils, 'OS_RELEASE_PATH', self.os_release):
+            with mock.patch.object(utils, 'UBI_REPO_PATH',
+                                   self.os_release + '.ubi'):
+                self.assertEqual(('centos', '9', 'CentOS Stream'),
+                                 utils.get_distro_info())
+                self.assertEqual(('centos', '9', 'CentOS Stream'),
+                                 yum_config_utils.get_distro_info())
+
+    def test_get_distro_info_ubi(self):
+        self._write('ID="rhel"\nVERSION_ID="9.4"\nNAME="Red Hat"\n')
+        with mock.patch.object(utils, 'OS_RELEASE_PATH', self.os_release):
+            with mock.patch.object(utils, 'UBI_REPO_PATH', self.os_release):
+                self.assertEqual(('ubi', '9', 'Red Hat'),
+                                 utils.get_distro_info())
+
+    @mock.patch('platform.system', return_value='Darwin')
+    def test_get_distro_info_missing(self, mock_system):
+        with mock.patch.object(utils, 'OS_RELEASE_PATH',
+                               self.os_release + 'x'):
+            self.assertEqual(('Darwin', 'unknown', 'unknown'),
+                             utils.get_distro_info())